@@ -1,383 +1,726 @@
 
-import json
 import datetime as dt
+import functools
+import os
+import tempfile
+import time
+import uuid
 import streamlit as st
-
-APP_TITLE = "AR.Architectural Style Builder"
-st.set_page_config(page_title=APP_TITLE, layout="wide")
-
-# ----------------------------------
-# Data & Concept Guides
-# ----------------------------------
-
-STAGES = [
-    {
-        "id":"soul","title":"Stage 1 — Soul / Ideology",
-        "prompt":"Choose the core belief(s) of your architecture.",
-        "type":"multi","min_selections":1,"max_selections":2,
-        "options":[
-            "Order — symmetry, balance, civic duty, divine ratio",
-            "Growth — organic change, evolution, breathing walls, living façades",
-            "Memory — ruin, layering, patina, archaeology of time",
-            "Defiance — asymmetry, rebellion, distortion, tension",
-            "Transcendence — light, ascension, spirit, metaphysical space"
-        ],
-        "default":[
-            "Order — symmetry, balance, civic duty, divine ratio",
-            "Transcendence — light, ascension, spirit, metaphysical space"
-        ]
-    },
-    {
-        "id":"heritage","title":"Stage 2 — Time / Heritage",
-        "prompt":"Select the ancestral lineage(s) your style imagines.",
-        "type":"multi","min_selections":1,"max_selections":2,
-        "options":[
-            "Antiquity Reimagined — Hellenic clarity, temple logic, sacred proportion",
-            "Enlightenment Rationalism — 17–18th-century civic idealism, measured geometry",
-            "Neo-Spiritual Futurism — celestial materials, glass cathedrals, cosmic metaphors",
-            "Forgotten Civilization — mythic ruins, invented archaeology, symbols of a lost age",
-            "Timeless Modernism — pure planes, light as doctrine, austerity as prayer"
-        ],
-        "default":[
-            "Antiquity Reimagined — Hellenic clarity, temple logic, sacred proportion",
-            "Forgotten Civilization — mythic ruins, invented archaeology, symbols of a lost age"
-        ]
-    },
-    {
-        "id":"form","title":"Stage 3 — Form / Gesture",
-        "prompt":"How do your buildings move and compose themselves?",
-        "type":"multi","min_selections":1,"max_selections":2,
-        "options":[
-            "Vertical Ascent — towers, spires, and colonnades reaching skyward in disciplined rhythm",
-            "Harmonic Symmetry — balanced façades, perfect ratios, temple-like calm",
-            "Buried Monumentality — half-submerged mass, weight, ruins hinting at depth below",
-            "Curvilinear Rebirth — domes, spirals, and arcs expressing continuity and celestial motion",
-            "Fragmented Order — shards and alignments suggesting past perfection now half-remembered"
-        ],
-        "default":[
-            "Curvilinear Rebirth — domes, spirals, and arcs expressing continuity and celestial motion",
-            "Harmonic Symmetry — balanced façades, perfect ratios, temple-like calm"
-        ]
-    },
-    {
-        "id":"material","title":"Stage 4 — Material / Flesh",
-        "prompt":"Pick core materials (Texture) and tones (Palette).",
-        "type":"compound",
-        "groups":[
-            {
-                "id":"texture","label":"Texture (choose 1–2)",
-                "min_selections":1,"max_selections":2,
-                "options":[
-                    "Polished Stone — perfection, ritual, divinity through permanence",
-                    "Weathered Limestone — soft endurance, faith worn by centuries",
-                    "Forged Metal — strength, resonance, cosmic alloy",
-                    "Carved Basalt or Obsidian — gravity, sacred darkness",
-                    "Porous Ceramic or Plaster — breath, imperfection, light’s companion"
-                ],
-                "default":[
-                    "Forged Metal — strength, resonance, cosmic alloy",
-                    "Porous Ceramic or Plaster — breath, imperfection, light’s companion"
-                ]
-            },
-            {
-                "id":"tone","label":"Tone / Palette (choose 1–2)",
-                "min_selections":1,"max_selections":2,
-                "options":[
-                    "Ivory and Gold — sanctity and enlightenment",
-                    "Verdigris and Bronze — memory, oxidation, earthly transcendence",
-                    "Charcoal and Ash — solemn mystery, purification through ruin",
-                    "Sand and Ochre — rebirth from earth, ritual warmth",
-                    "Pearl and Silver — lunar stillness, celestial reflection"
-                ],
-                "default":[
-                    "Verdigris and Bronze — memory, oxidation, earthly transcendence",
-                    "Pearl and Silver — lunar stillness, celestial reflection"
-                ]
-            }
-        ]
-    },
-    {
-        "id":"light","title":"Stage 5 — Light / Emotion",
-        "prompt":"How does illumination behave in your spaces?",
-        "type":"multi","min_selections":1,"max_selections":2,
-        "options":[
-            "Filtered Sanctum — light seeps through lattices or fractures, sacred and slow",
-            "Radiant Core — buildings emit inner light; metallic reflection as divine aura",
-            "Refracted Tide — glass, water, and reflective surfaces scatter light in motion",
-            "Shadowed Silence — illumination is withheld, mystery shaped by gloom",
-            "Descending Beam — light falls vertically, a connection between heaven and order"
-        ],
-        "default":[
-            "Filtered Sanctum — light seeps through lattices or fractures, sacred and slow",
-            "Descending Beam — light falls vertically, a connection between heaven and order"
-        ]
-    },
-    {
-        "id":"ornament","title":"Stage 6 — Ornament / Voice",
-        "prompt":"How (if at all) do surfaces speak?",
-        "type":"multi","min_selections":1,"max_selections":2,
-        "options":[
-            "Geometric Liturgy — repeating ratios, sacred geometry, tessellations as prayer",
-            "Scriptural Reliefs — runes, calligraphy, or engraved stories folded into walls",
-            "Biomorphic Reverence — vines, shells, or waves abstracted into order",
-            "Fractured Inlay — kintsugi-like seams, contrasting metals marking repair and memory",
-            "Silent Surface — absence of ornament, relying on proportion and light alone"
-        ],
-        "default":[
-            "Fractured Inlay — kintsugi-like seams, contrasting metals marking repair and memory"
-        ]
-    },
-    {
-        "id":"composition","title":"Stage 7 — Composition / Signature",
-        "prompt":"Choose a spatial grammar that unifies everything.",
-        "type":"single",
-        "options":[
-            "Processional Axis — long, disciplined approaches; thresholds ascend to stillness",
-            "Radial Sanctum — circular plans; all geometry converges on a luminous heart",
-            "Tiered Continuum — layered terraces or ascending platforms, symbolic ascent",
-            "Nested Labyrinth — sacred complexity; symmetry hiding within asymmetry",
-            "Suspended Harmony — bridges or floating halls that defy gravity in balance"
-        ],
-        "default":"Processional Axis — long, disciplined approaches; thresholds ascend to stillness"
-    }
-]
-
-CONCEPT_GUIDE = {
-    "soul": {
-        "Order": "Proportion, symmetry, civic clarity — classical discipline.",
-        "Growth": "Biodynamic change and biomorphic forms; buildings feel alive.",
-        "Memory": "Patina, layers, repair — time as material.",
-        "Defiance": "Breaks grids and expectations; tension and asymmetry.",
-        "Transcendence": "Light and height that point beyond the material."
-    },
-    "heritage": {
-        "Antiquity Reimagined": "Temple logic reinterpreted; Hellenic clarity today.",
-        "Enlightenment Rationalism": "18th‑century reason; measured civic ideals.",
-        "Neo-Spiritual Futurism": "Cosmic metaphors, luminous media; sacred futurity.",
-        "Forgotten Civilization": "Invented archaeology; mythic ruins and symbols.",
-        "Timeless Modernism": "Pure planes, restraint, light-as-doctrine."
-    },
-    "form": {
-        "Vertical Ascent": "Upward emphasis; towers and spires in rhythm.",
-        "Harmonic Symmetry": "Balanced composition; calm via mirroring and ratio.",
-        "Buried Monumentality": "Half-submerged mass; hints at depth/history below.",
-        "Curvilinear Rebirth": "Domes/spirals; continuous, celestial motion.",
-        "Fragmented Order": "Shards imply a prior whole; memory of order."
-    },
-    "material_texture": {
-        "Polished Stone": "Ritual purity and permanence.",
-        "Weathered Limestone": "Soft endurance; touch of centuries.",
-        "Forged Metal": "Strength, resonance; responsive to light.",
-        "Carved Basalt or Obsidian": "Gravitas; sacred darkness.",
-        "Porous Ceramic or Plaster": "Breathable, imperfect; loves light."
-    },
-    "material_tone": {
-        "Ivory and Gold": "Sanctity and enlightenment.",
-        "Verdigris and Bronze": "Oxidised memory; earth meets time.",
-        "Charcoal and Ash": "Purifying solemnity; shadow play.",
-        "Sand and Ochre": "Earthen warmth; rebirth.",
-        "Pearl and Silver": "Lunar quiet; reflective calm."
-    },
-    "light": {
-        "Filtered Sanctum": "Screened light; devotional ambience.",
-        "Radiant Core": "Glow from within; metallic aura.",
-        "Refracted Tide": "Shimmer and movement from glass/water.",
-        "Shadowed Silence": "Withheld light; mystery leads.",
-        "Descending Beam": "Vertical shaft; heaven-to-earth axis."
-    },
-    "ornament": {
-        "Geometric Liturgy": "Tessellations and ratios as visual prayer.",
-        "Scriptural Reliefs": "Walls speak via runes/calligraphy/story.",
-        "Biomorphic Reverence": "Nature abstracted into ordered motifs.",
-        "Fractured Inlay": "Kintsugi seams; repair as beauty.",
-        "Silent Surface": "No ornament; proportion and light suffice."
-    },
-    "composition": {
-        "Processional Axis": "Long approach; thresholds stage stillness.",
-        "Radial Sanctum": "All geometry gathers at a luminous heart.",
-        "Tiered Continuum": "Ascending terraces; ritual climb.",
-        "Nested Labyrinth": "Complexity with hidden symmetry.",
-        "Suspended Harmony": "Bridged volumes in poised balance."
-    }
-}
-
-DEFAULT_STYLE_NAME = "The Reconciliant Order"
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+from archstyle import compose
+from archstyle.stagepacks import DEFAULT as DEFAULT_PACK, available as available_packs, load as load_pack
+from archstyle.cache import RENDER_CACHE, render_cached
+from archstyle.codec import (unpack, with_slot, to_token, from_token,
+                             compact_preset, expand_preset, dumps_preset)
+from archstyle.importer import ImportReport, iter_presets, errors_csv, validator
+from archstyle.library import PresetLibrary, library_path
+from archstyle.similar import SimilarityIndex
+from archstyle.export import spool_archive
+from archstyle.ornament import KINDS as ORNAMENT_KINDS, ornament_lab
+from archstyle import urban
+from archstyle import analytics
+from archstyle.sessions import STORE as SESSION_STORE, PresetList, start_reaper
+from archstyle.metrics import (METRICS, ENABLED as METRICS_ENABLED, METRICS_FILE, FLUSH_SECONDS, timed, timer,
+                               instrument, state_footprint, start_flusher)
+
+def current_pack():
+    # The session's stage pack (sidebar), loaded on first use in the process.
+    return load_pack(st.session_state.setdefault("pack", DEFAULT_PACK))
+
+st.set_page_config(page_title=current_pack().title, layout="wide")
+
+IMPORT_PICKER_LIMIT = 500
+LIBRARY_PAGE = 200
+SIMILAR_COUNT = 5
+IMAGE_URL = os.environ.get("ARCHSTYLE_IMAGE_URL", "")
+# Progress files and images of "Send prompts", one of each per style code.
+DISPATCH_DIR = os.environ.get("ARCHSTYLE_DISPATCH_DIR", os.path.join(tempfile.gettempdir(), "archstyle-dispatch"))
+DISPATCH_POLL = 1.0  # seconds between status updates while prompts are sent
+ORNAMENT_PAGE_SIZES = (25, 50, 100, 250)
+ORNAMENT_KEYS = ("ornament", "material.texture", "material.tone", "light")
+URBAN_VIEW = 640  # pixels per side of the layout view
+TABS = ("Builder", "Ornament Lab", "Urban Layout Lab", "Preset Analytics")
+# Scanning server files is opt-in: only under ARCHSTYLE_ANALYTICS_ROOT, with
+# at most ARCHSTYLE_ANALYTICS_WORKERS processes per scan.
+ANALYTICS_ROOT = os.path.realpath(os.environ["ARCHSTYLE_ANALYTICS_ROOT"]) if os.environ.get("ARCHSTYLE_ANALYTICS_ROOT") else ""
+ANALYTICS_WORKERS = max(1, min(int(os.environ.get("ARCHSTYLE_ANALYTICS_WORKERS", "2")), os.cpu_count() or 1))
+ANALYTICS_FILES = "Files on the server"
+ANALYTICS_SOURCES = ("Preset library", "Imported presets") + ((ANALYTICS_FILES,) if ANALYTICS_ROOT else ())
+ANALYTICS_MEASURES = {"count": "Presets with both", "share": "Share of presets with both",
+                      "lift": "Lift (observed / expected if independent)"}
+# Reset when the stage pack changes: they hold the old pack's options or codes.
+PACK_STATE = ("style", "style_order", "complete_slots", "style_code_input", "lib_options", "lib_pick", "imported_pick", "ana_slots")
+
+# Opt-in profiling (ARCHSTYLE_METRICS=1, see archstyle/metrics.py): all of
+# this is a no-op unless it is switched on.
+script_started = time.perf_counter()
+instrument(compose, ("render_manifesto", "render_prompts", "render_outline"), "composer")
+start_flusher()
+start_reaper()
 
 # -------------------------------
 # Utilities & State
 # -------------------------------
-def init_state():
-    if "responses" not in st.session_state:
-        st.session_state["responses"] = {}
+# Selections live in the widgets' own state; st.session_state["style"] holds
+# the packed style code derived from them (see archstyle/codec.py). Bulky
+# values (a bulk import, analytics results) live in the session store under
+# st.session_state["sid"], which moves idle sessions' values to disk and
+# reads them back on their next run (see archstyle/sessions.py). The stage
+# pack is chosen per session; its table is passed to everything that reads
+# or writes a style code.
+
+def stored(name, default=None):
+    return SESSION_STORE.get(st.session_state["sid"], name, default)
+
+def store(name, value):
+    SESSION_STORE.put(st.session_state["sid"], name, value)
+
+def widget_key(stage, grp=None):
+    if stage["type"] == "single":
+        return f"radio_{stage['id']}"
+    return f"pills_{stage['id']}_{grp['id']}" if grp else f"pills_{stage['id']}"
+
+def all_slots(table):
+    return (1 << len(table.slots)) - 1
+
+@functools.lru_cache(maxsize=None)
+def guide_markdown(table, stage_id):
+    return table.guide_markdown(stage_id)
+
+def slot_widgets(table):
+    # (slot, stage, widget key) for every selectable list, in slot order.
+    for stage in table.stages:
+        slots = table.stage_slots[stage["id"]]
+        if stage["type"] == "compound":
+            for slot, grp in zip(slots, stage["groups"]):
+                yield slot, stage, widget_key(stage, grp)
+        else:
+            yield slots[0], stage, widget_key(stage)
+
+@timed("init_state")
+def init_state(pack):
+    SESSION_STORE.touch(st.session_state.setdefault("sid", uuid.uuid4().hex))
     if "style_name" not in st.session_state:
-        st.session_state["style_name"] = DEFAULT_STYLE_NAME
+        st.session_state["style_name"] = pack.default_style_name
     if "notes" not in st.session_state:
         st.session_state["notes"] = ""
     if "world_name" not in st.session_state:
         st.session_state["world_name"] = ""
+    # Seed widget state from the stage defaults so presets can overwrite it.
+    for stage in pack.stages:
+        if stage["type"] == "compound":
+            for grp in stage["groups"]:
+                st.session_state.setdefault(widget_key(stage, grp), list(grp.get("default", [])))
+        elif stage["type"] == "single":
+            default = stage.get("default")
+            st.session_state.setdefault(widget_key(stage), default if default in stage["options"] else stage["options"][0])
+        else:
+            st.session_state.setdefault(widget_key(stage), list(stage.get("default", [])))
+    if "style" not in st.session_state:
+        st.session_state["style"] = 0
+        st.session_state["style_order"] = {}
+        st.session_state["complete_slots"] = 0
+        for slot, stage, key in slot_widgets(pack.table):
+            set_selection(pack.table, slot, widget_values(slot, key))
+
+def switch_pack():
+    # Drops the previous pack's widgets, style and pack-bound results; the
+    # rerun seeds them again from the new pack's defaults.
+    for key in list(st.session_state):
+        if key.startswith(("radio_", "pills_")) or key in PACK_STATE:
+            del st.session_state[key]
+    SESSION_STORE.pop(st.session_state["sid"], "import")
+    SESSION_STORE.pop(st.session_state["sid"], "analytics")
+
+def widget_values(slot, key):
+    value = st.session_state.get(key)
+    if isinstance(value, str):
+        return [value]
+    return list(value or [])[: slot.max_selections]
+
+def set_selection(table, slot, values):
+    mask = 0
+    for text in values:
+        mask |= table.text_bits[slot.index].get(text, 0)
+    st.session_state["style"] = with_slot(st.session_state["style"], slot.index, mask, table)
+    # The order picks were made in, where it is not the options' own.
+    order = st.session_state["style_order"]
+    if values == table.values[slot.index][mask]:
+        order.pop(slot.index, None)
+    else:
+        order[slot.index] = tuple(values)
+    # Completion is tracked per slot, so only the stage that changed is re-checked.
+    bit = 1 << slot.index
+    if table.slot_complete(slot.index, mask):
+        st.session_state["complete_slots"] |= bit
+    else:
+        st.session_state["complete_slots"] &= ~bit
+
+def completion_bits(table, masks):
+    return sum(1 << i for i, mask in enumerate(masks) if table.slot_complete(i, mask))
+
+def apply_preset(table, preset):
+    for k in ("style_name", "world_name", "notes"):
+        if k in preset:
+            st.session_state[k] = preset[k]
+    masks = unpack(preset["code"], table)
+    order = {slot: tuple(t for t in texts if t in table.text_bits[slot])
+             for slot, texts in (preset.get("order") or {}).items()}
+    for slot, stage, key in slot_widgets(table):
+        values = order.get(slot.index) or table.values[slot.index][masks[slot.index]]
+        if stage["type"] == "single":
+            if values:
+                st.session_state[key] = values[0]
+        else:
+            st.session_state[key] = list(values)
+    st.session_state["style"] = preset["code"]
+    st.session_state["style_order"] = order
+    st.session_state["complete_slots"] = completion_bits(table, masks)
+
+def release_uploads(files):
+    # Parsed uploads are not read again: give the uploader a fresh key, so it
+    # shows empty and its old state is discarded at the end of the run. Their
+    # bytes are dropped from Streamlit's upload storage right away where its
+    # (non-public) upload manager allows; otherwise when the session ends.
+    ctx = get_script_run_ctx()
+    remove = getattr(getattr(ctx, "uploaded_file_mgr", None), "remove_file", None)
+    if remove is not None:
+        for f in files:
+            try:
+                remove(ctx.session_id, f.file_id)
+            except (AttributeError, KeyError, TypeError):
+                break
+    st.session_state["upload_key"] = st.session_state.get("upload_key", 0) + 1
+
+def load_preset_files(key):
+    files = st.session_state.get(key) or []
+    SESSION_STORE.pop(st.session_state["sid"], "import")
+    if not files:
+        return
+    for f in files:
+        f.seek(0)
+    table = current_pack().table
+    report = ImportReport()
+    presets = PresetList(iter_presets(((f.name, f) for f in files), report, validator(table)), table)
+    release_uploads(files)
+    files_text = f"{len(files)} file{'s' if len(files) > 1 else ''}"
+    if len(presets) == 1 and not report.rejected:
+        apply_preset(table, presets[0])
+        st.session_state["preset_status"] = ("success", f"Preset loaded from {files_text}. "
+                                                        "Scroll the Builder to see selections updated.")
+        return
+    store("import", (presets, report))
+    level = "error" if not presets else "warning" if report.rejected else "success"
+    st.session_state["preset_status"] = (level, f"Import from {files_text}: {report.summary()}.")
+
+def load_imported_preset():
+    i = st.session_state.get("imported_pick")
+    if i is None:
+        return
+    imported, _ = stored("import", (None, None))
+    if imported is None or i >= len(imported):
+        # The session store forgot the import (session expired): reset the picker.
+        st.session_state["imported_pick"] = None
+        st.session_state["preset_status"] = ("warning", "The imported presets are no longer available. "
+                                                        "Upload the files again to pick from them.")
+        return
+    apply_preset(current_pack().table, imported[i])
+    st.session_state["preset_status"] = ("success", "Preset loaded. Scroll the Builder to see selections updated.")
+
+def imported_label(imported, i):
+    preset = imported[i]
+    return f"{preset.get('style_name') or 'Untitled'} · {to_token(preset['code'], current_pack().table)}"
+
+def load_style_code():
+    token = st.session_state.get("style_code_input", "").strip()
+    if not token:
+        return
+    try:
+        table = current_pack().table
+        apply_preset(table, {"code": from_token(token, table)})
+        st.session_state["preset_status"] = ("success", f"Style code {token} loaded.")
+    except ValueError as e:
+        st.session_state["preset_status"] = ("error", f"Could not load style code: {e}")
+
+@st.cache_resource
+def preset_library(pack_name):
+    # One SQLite connection per pack and server process, shared by all sessions.
+    return PresetLibrary(library_path(pack_name), load_pack(pack_name).table)
+
+@st.cache_resource
+def similar_index(pack_name):
+    # Memory-mapped, so every session and worker shares the same pages.
+    return SimilarityIndex(preset_library(pack_name).path, load_pack(pack_name).table)
+
+def save_to_library():
+    preset_library(st.session_state["pack"]).add([{"code": st.session_state["style"], "style_name": st.session_state["style_name"],
+                           "world_name": st.session_state["world_name"], "notes": st.session_state["notes"],
+                           "exported_at": dt.datetime.now().strftime("%Y%m%d_%H%M%S")}])
+    st.session_state["preset_status"] = ("success", "Style saved to the library.")
+
+def add_imported_to_library():
+    added = preset_library(st.session_state["pack"]).add(stored("import", ([],))[0])
+    st.session_state["preset_status"] = ("success", f"Added {added:,} presets to the library.")
+
+def library_filters():
+    require = {}
+    for key, label in st.session_state.get("lib_options") or []:
+        require.setdefault(key, set()).add(label)
+    dates = st.session_state.get("lib_dates") or ()
+    return dict(require=require, style_name=st.session_state.get("lib_style", "").strip(),
+                world_name=st.session_state.get("lib_world", "").strip(),
+                since=dates[0].isoformat() if len(dates) > 0 else None,
+                until=dates[1].isoformat() if len(dates) > 1 else None)
+
+def load_library_preset(results):
+    i = st.session_state.get("lib_pick")
+    if i is not None:
+        apply_preset(current_pack().table, results[i])
+        st.session_state["preset_status"] = ("success", "Preset loaded. Scroll the Builder to see selections updated.")
+
+def send_prompts(preset):
+    # Sends on a background thread, with a progress file per style code: a
+    # click returns at once, and clicking again after a refresh resumes
+    # where the last run stopped. The session keeps the run's key.
+    # Imported here: aiohttp is only needed once an image backend is configured.
+    from archstyle.dispatch import TOKEN_ENV, start_background, style_jobs
+    table = current_pack().table
+    headers = {"Authorization": f"Bearer {os.environ[TOKEN_ENV]}"} if os.environ.get(TOKEN_ENV) else {}
+    token = to_token(preset["code"], table)
+    progress = os.path.join(DISPATCH_DIR, f"{token}.progress.jsonl")
+    os.makedirs(DISPATCH_DIR, exist_ok=True)
+    start_background(progress, style_jobs(preset, table=table), IMAGE_URL, headers=headers, timeout=300,
+                     out_dir=os.path.join(DISPATCH_DIR, token), progress=progress)
+    SESSION_STORE.put(st.session_state["sid"], "dispatch", progress)
+
+def sending_prompts():
+    from archstyle.dispatch import background
+    key = SESSION_STORE.get(st.session_state["sid"], "dispatch")
+    return key and background(key)
+
+def dispatch_panel():
+    task = sending_prompts()
+    if not task:
+        return
+    if task.running:
+        st.info(f"Sending prompts… {task.finished} of {task.total} finished")
+        st.session_state["dispatch_polling"] = True
+        return
+    if task.error:
+        st.error(f"Sending stopped: {task.error}")
+    else:
+        getattr(st, "error" if task.report.failed else "success")(task.report.summary())
+    if st.session_state.pop("dispatch_polling", False):
+        st.rerun()  # a full rerun stops this fragment's timer
+
+def load_library_id(preset_id):
+    preset = preset_library(st.session_state["pack"]).get(preset_id)
+    if preset:
+        apply_preset(current_pack().table, preset)
+        st.session_state["preset_status"] = ("success", "Preset loaded. Scroll the Builder to see selections updated.")
+
+def render_similar(pack, code):
+    library, index = preset_library(pack.name), similar_index(pack.name)
+    with st.spinner("Updating similar-styles index…"):
+        index.sync(library)
+    if index.rebuilding:
+        st.caption("Re-indexing the library after a delete; results may be a little out of date.")
+    if not len(index):
+        st.caption("Save styles to the library to see similar ones here.")
+        return
+    ids, scores = index.nearest(code, SIMILAR_COUNT)
+    for pid, score in zip(ids.tolist(), scores.tolist()):
+        preset = library.get(pid)
+        if not preset:
+            continue
+        st.markdown(f"**{preset['style_name'] or 'Untitled'}** · {score:.0%}"
+                    + (" (this style)" if preset["code"] == code else ""))
+        st.caption(f"{preset['world_name'] or '—'} · `{to_token(preset['code'], pack.table)}`")
+        st.button("Load", key=f"similar_{pid}", on_click=load_library_id, args=(pid,))
+
+def render_library(pack):
+    table = pack.table
+    library = preset_library(pack.name)
+    st.button("Save current style to library", on_click=save_to_library,
+              disabled=st.session_state["complete_slots"] != all_slots(table))
+    imported, _ = stored("import", (None, None))
+    if imported:
+        st.button(f"Add {len(imported):,} imported presets to library", on_click=add_imported_to_library)
+        st.download_button(f"Export {len(imported):,} imported presets (zip)",
+                           data=lambda: spool_archive(imported, table=table), file_name="imported_styles.zip", mime="application/zip")
+    with st.expander("Search library"):
+        st.multiselect("Includes options", [(table.slots[o.slot].key, o.label) for o in table.options],
+                       key="lib_options", format_func=lambda o: f"{o[1]} ({o[0]})")
+        st.text_input("Style name starts with", key="lib_style")
+        st.text_input("World name starts with", key="lib_world")
+        st.date_input("Exported between", value=(), key="lib_dates")
+        filters = library_filters()
+        results = library.query(limit=LIBRARY_PAGE, **filters)
+        total = library.count(**filters) if len(results) == LIBRARY_PAGE else len(results)
+        st.caption(f"{total:,} matching presets" + (f", newest {LIBRARY_PAGE} shown" if total > len(results) else ""))
+        if results:
+            st.download_button(f"Export {total:,} matches (zip)",
+                               data=lambda: spool_archive(library.iter_matches(**filters), table=table),
+                               file_name="library_styles.zip", mime="application/zip")
+            st.selectbox("Matches", range(len(results)), index=None, placeholder="Choose a preset to load",
+                         format_func=lambda i: f"{results[i]['style_name'] or 'Untitled'} · "
+                                               f"{results[i]['world_name'] or '—'} · "
+                                               f"{to_token(results[i]['code'], table)}",
+                         key="lib_pick", on_change=load_library_preset, args=(results,))
 
-def clean_label(s):
-    return s.split(" — ")[0].strip()
+# -------------------------------
+# Builder fragments
+# -------------------------------
+# Each stage panel, the progress bar and the artifact area are keyed
+# fragments. A selection callback updates the style code and completion
+# bits for its own slot, then reruns just the fragments that depend on the
+# change instead of the whole script.
+
+def fragment(body, key, run_every=None):
+    # st.fragment, with metrics on counting each run of the body that is a
+    # fragment rerun (a widget in it, st.rerun of its key, run_every), per key.
+    if METRICS_ENABLED:
+        inner = body
+        def body(*args):
+            ctx = get_script_run_ctx()
+            if ctx is not None and ctx.fragment_ids_this_run:
+                METRICS.inc("reruns_total", scope="fragment", fragment=key)
+            return inner(*args)
+    return st.fragment(body, key=key, run_every=run_every)
+
+def on_select(slot_index, key):
+    table = current_pack().table
+    slot = table.slots[slot_index]
+    code, complete = st.session_state["style"], st.session_state["complete_slots"]
+    order = st.session_state["style_order"].get(slot_index)
+    set_selection(table, slot, widget_values(slot, key))
+    if st.session_state["style"] == code and st.session_state["style_order"].get(slot_index) == order:
+        return  # e.g. a pick beyond max_selections: only this stage reruns
+    targets = [f"stage_{slot.stage_id}", "artifacts"]
+    if st.session_state["complete_slots"] != complete:
+        targets.append("progress")
+    st.rerun(targets)
+
+def stage_panel(table, stage):
+    with st.container(border=True):
+        render_stage(table, stage)
+
+def progress_panel(table):
+    st.progress(bin(st.session_state["complete_slots"]).count("1") / len(table.slots))
+
+def artifacts_panel(pack):
+    table = pack.table
+    st.divider()
+    with timer("done_check"):
+        done = st.session_state["complete_slots"] == all_slots(table)
+    if not done:
+        st.warning("Complete all stages to generate your manifesto, prompts, and outline.")
+        st.caption("Tip: Defaults are preselected — accept them and refine later.")
+        return
+
+    code = st.session_state["style"]
+    style_name, notes, world_name = st.session_state["style_name"], st.session_state["notes"], st.session_state["world_name"]
+    order = st.session_state["style_order"]
+    artifacts = render_cached(code, style_name, notes, world_name, table=table, order=order)
+    col1, col2, col3, col4 = st.columns([1,1,1,1])
+
+    with col1:
+        st.subheader("Manifesto")
+        st.markdown(artifacts["manifesto"])
+
+    with col2:
+        st.subheader("AI Image Prompts")
+        for k, v in artifacts["prompts"].items():
+            st.markdown(f"**{k}**")
+            st.code(v)
+        if IMAGE_URL:
+            st.button("Send prompts to image backend", key="send_prompts", on_click=send_prompts,
+                      args=({"code": code, "style_name": style_name, "order": dict(order)},))
+            task = sending_prompts()
+            fragment(dispatch_panel, "dispatch", run_every=DISPATCH_POLL if task and task.running else None)()
+
+    with col3:
+        st.subheader("Export")
+        ts = dt.datetime.now().strftime("%Y%m%d_%H%M%S")
+        base = (world_name or style_name).replace(' ', '_')
+        # Every payload below is a callable: built only when its button is clicked.
+        current = {"code": code, "style_name": style_name, "world_name": world_name, "notes": notes,
+                   "exported_at": ts, "order": dict(order)}
+        st.download_button("Download All (zip)",
+                           data=timed("export_payload", {"kind": "zip"})(lambda: spool_archive([current], table=table)),
+                           file_name=f"{base}_{ts}.zip",
+                           mime="application/zip", type="primary")
+        st.download_button("Download Manifesto (Markdown)",
+                           data=lambda: artifacts["manifesto_bytes"],
+                           file_name=f"{base}_manifesto_{ts}.md",
+                           mime="text/markdown")
+        legacy = st.toggle("Full preset JSON (selections + prompts)", key="legacy_preset",
+                           help="Off: compact preset holding the style code. Both forms load in the sidebar.")
+        def preset_json():
+            if legacy:
+                payload = expand_preset(code, style_name, world_name, notes, exported_at=ts, table=table, order=dict(order))
+            else:
+                payload = compact_preset(code, style_name, world_name, notes, exported_at=ts, table=table)
+            return dumps_preset(payload, compact=not legacy).encode("utf-8")
+        st.download_button("Download Style JSON (Preset)",
+                           data=timed("export_payload", {"kind": "preset_json"})(preset_json),
+                           file_name=f"{base}_style_{ts}.json",
+                           mime="application/json")
+        st.caption(f"Style code: `{to_token(code, table)}`")
+
+    with col4:
+        st.subheader("Similar Styles")
+        st.caption("Closest styles in your library, by shared options.")
+        render_similar(pack, code)
 
-def render_concept_guide(stage):
+    st.divider()
+    with st.container(border=True):
+        st.subheader("World Outline")
+        st.caption("A quick working document you can paste into your notebook or wiki.")
+        st.markdown(artifacts["world_outline"])
+        st.download_button("Download World Outline (Markdown)",
+                           data=lambda: artifacts["world_outline_bytes"],
+                           file_name=f"{base}_world_outline_{ts}.md",
+                           mime="text/markdown")
+
+def render_concept_guide(table, stage):
     with st.expander("Concept Guide — what the choices mean"):
-        if stage["id"] == "material":
-            st.markdown("**Textures**")
-            for opt in stage["groups"][0]["options"]:
-                n = clean_label(opt); st.markdown(f"- **{n}** — {CONCEPT_GUIDE['material_texture'][n]}")
-            st.markdown("**Tones / Palette**")
-            for opt in stage["groups"][1]["options"]:
-                n = clean_label(opt); st.markdown(f"- **{n}** — {CONCEPT_GUIDE['material_tone'][n]}")
-        else:
-            key = stage["id"]
-            for opt in stage["options"]:
-                n = clean_label(opt)
-                st.markdown(f"- **{n}** — {CONCEPT_GUIDE[key][n]}")
+        st.markdown(guide_markdown(table, stage["id"]))
 
-def render_stage(stage):
+@timed("render_stage", lambda table, stage: {"stage": stage["id"]})
+def render_stage(table, stage):
     st.subheader(stage["title"])
     st.caption(stage["prompt"])
-    render_concept_guide(stage)
+    render_concept_guide(table, stage)
+    slots = table.stage_slots[stage["id"]]
 
     if stage["type"] == "single":
-        default = stage.get("default")
-        value = st.radio("Pick one", options=stage["options"],
-                         index=stage["options"].index(default) if default in stage["options"] else 0,
-                         key=f"radio_{stage['id']}")
-        st.session_state["responses"][stage["id"]] = [value]
+        st.radio("Pick one", options=stage["options"], key=widget_key(stage),
+                 on_change=on_select, args=(slots[0].index, widget_key(stage)))
 
     elif stage["type"] == "multi":
-        default = stage.get("default", [])
         value = st.pills("Choose up to {} options".format(stage["max_selections"]),
-                         options=stage["options"], selection_mode="multi",
-                         default=default, key=f"pills_{stage['id']}")
+                         options=stage["options"], selection_mode="multi", key=widget_key(stage),
+                         on_change=on_select, args=(slots[0].index, widget_key(stage)))
         if len(value) < stage["min_selections"]:
             st.warning(f"Please choose at least {stage['min_selections']} option(s).")
-        if len(value) > stage["max_selections"]:
-            value = value[: stage["max_selections"]]
-        st.session_state["responses"][stage["id"]] = value
 
     elif stage["type"] == "compound":
         groups = stage["groups"]
-        selections = {}
         cols = st.columns(len(groups))
         for i, grp in enumerate(groups):
             with cols[i]:
-                default = grp.get("default", [])
                 value = st.pills(grp["label"], options=grp["options"], selection_mode="multi",
-                                 default=default, key=f"pills_{stage['id']}_{grp['id']}")
+                                 key=widget_key(stage, grp),
+                                 on_change=on_select, args=(slots[i].index, widget_key(stage, grp)))
                 if len(value) < grp["min_selections"]:
                     st.warning(f"{grp['label']}: Choose at least {grp['min_selections']} option(s).")
-                if len(value) > grp["max_selections"]:
-                    value = value[: grp["max_selections"]]
-                selections[grp["id"]] = value
-        st.session_state["responses"][stage["id"]] = selections
-
-def compose_manifesto(responses, style_name, notes, world_name):
-    def pick(id_):
-        return [clean_label(s) for s in responses.get(id_, [])]
-    def pick_group(id_, group_id):
-        grp = responses.get(id_, {})
-        return [clean_label(s) for s in grp.get(group_id, [])]
-
-    soul = " + ".join(pick("soul"))
-    heritage = " + ".join(pick("heritage"))
-    form = " + ".join(pick("form"))
-    textures = ", ".join(pick_group("material", "texture"))
-    tones = ", ".join(pick_group("material", "tone"))
-    light = " + ".join(pick("light"))
-    ornament = " + ".join(pick("ornament"))
-    composition = " + ".join(pick("composition"))
-
-    header = f"# {style_name}"
-    if world_name.strip():
-        header += f" — for **{world_name.strip()}**"
-
-    manifesto = f"""{header}
-
-**Soul / Ideology:** {soul}
-**Time / Heritage:** {heritage}
-**Form / Gesture:** {form}
-**Material / Flesh:** {textures}
-**Tone / Palette:** {tones}
-**Light / Emotion:** {light}
-**Ornament / Voice:** {ornament}
-**Composition / Signature:** {composition}
-
----
-**Designer Notes:** {notes or "—"}
-"""
-    return manifesto
-
-def compose_prompts(responses, style_name):
-    def pick(id_):
-        return [clean_label(s) for s in responses.get(id_, [])]
-    def pick_group(id_, group_id):
-        grp = responses.get(id_, {})
-        return [clean_label(s) for s in grp.get(group_id, [])]
-
-    textures = ", ".join(pick_group("material", "texture"))
-    tones = ", ".join(pick_group("material", "tone"))
-    form = ", ".join(pick("form"))
-    heritage = ", ".join(pick("heritage"))
-    light = ", ".join(pick("light"))
-    ornament = ", ".join(pick("ornament"))
-    composition = ", ".join(pick("composition"))
-
-    base = (f"{style_name} architecture, {form}, materials: {textures}, palette: {tones}, "
-            f"light: {light}, ornament: {ornament}, heritage: {heritage}")
-
-    prompts = {
-        "Sacred Interior": f"interior sanctum, {base}, processional stillness, cinematic volumetric light, hyperreal detail",
-        "Façade & Approach": f"monumental façade along a {composition.lower()}, {base}, wide-angle perspective, serene and mathematical",
-        "Civic Plaza": f"civic plaza mixing temple and senate hall, {base}, atmospheric realism, human scale and cosmic order"
-    }
-    return prompts
-
-def compose_world_outline(responses, world_name):
-    name = world_name.strip() or "Unnamed World"
-    def pick(id_):
-        return [clean_label(s) for s in responses.get(id_, [])]
-    def pick_group(id_, group_id):
-        grp = responses.get(id_, {})
-        return [clean_label(s) for s in grp.get(group_id, [])]
-
-    lines = []
-    lines.append(f"# World Outline — {name}")
-    lines.append("")
-    lines.append("## Essence")
-    lines.append(f"- **Soul:** {', '.join(pick('soul')) or '—'}")
-    lines.append(f"- **Heritage:** {', '.join(pick('heritage')) or '—'}")
-    lines.append("")
-    lines.append("## Form & Light")
-    lines.append(f"- **Form:** {', '.join(pick('form')) or '—'}")
-    lines.append(f"- **Light:** {', '.join(pick('light')) or '—'}")
-    lines.append("")
-    lines.append("## Material Language")
-    lines.append(f"- **Textures:** {', '.join(pick_group('material','texture')) or '—'}")
-    lines.append(f"- **Palette:** {', '.join(pick_group('material','tone')) or '—'}")
-    lines.append("")
-    lines.append("## Voice & Composition")
-    lines.append(f"- **Ornament:** {', '.join(pick('ornament')) or '—'}")
-    lines.append(f"- **Composition:** {', '.join(pick('composition')) or '—'}")
-    lines.append("")
-    lines.append("## Sites to Sketch")
-    lines.append("- [ ] Sacred interior (altar/chamber)")
-    lines.append("- [ ] Façade + processional approach")
-    lines.append("- [ ] Civic plaza / forum variant")
-    lines.append("")
-    lines.append("## Notes")
-    lines.append("_Add references, locations, climate, patrons, time period, typologies…_")
-    return "\n".join(lines)
+
+def render_metrics_panel():
+    snapshot = METRICS.snapshot()
+    footprint = st.session_state.get("_state_footprint", {})
+    largest = sorted(footprint.items(), key=lambda kv: -kv[1])[:5]
+    st.caption(f"Process-wide since start · this session ≈ {sum(footprint.values()):,} bytes, "
+               f"sampled every {FLUSH_SECONDS:g}s"
+               + (f" (largest: {', '.join(f'{k} {n:,}' for k, n in largest)})" if largest else ""))
+    sessions = SESSION_STORE.stats()
+    st.caption(f"Session store: {sessions['resident']:,} of {sessions['sessions']:,} sessions in memory, "
+               f"{sessions['spilled']:,} on disk ({sessions['spilled_bytes']:,} bytes) · "
+               f"{sessions['spills']:,} spills, {sessions['restores']:,} restores")
+    st.dataframe([{"section": name, "labels": ", ".join(f"{k}={v}" for k, v in labels.items()), "calls": count,
+                   "mean ms": total / count * 1000, "last ms": last * 1000, "max ms": peak * 1000}
+                  for name, labels, count, total, peak, last in snapshot["timings"]], hide_index=True)
+    for (name, labels), value in sorted({**snapshot["counters"], **snapshot["gauges"]}.items()):
+        shown = ", ".join(f"{k}={v}" for k, v in labels)
+        st.caption(f"{name}{f' ({shown})' if shown else ''}: {value:,}")
+    if METRICS_FILE:
+        st.caption(f"Written to `{METRICS_FILE}` in Prometheus text format.")
+    st.button("Reset metrics", on_click=METRICS.clear)
+
+# -------------------------------
+# Ornament Lab
+# -------------------------------
+# Pages through the current style's motif and detail variants. Only the
+# page on screen is generated: variant n is computed from n directly.
+
+def ornament_panel(table):
+    masks = unpack(st.session_state["style"], table)
+    if not all(masks[table.slot_index[k]] for k in ORNAMENT_KEYS):
+        st.warning("Choose at least one Ornament, Texture, Tone and Light option in the Builder first.")
+        return
+    c1, c2, c3 = st.columns([2, 1, 1])
+    kinds = c1.pills("Prompt types", ORNAMENT_KINDS, selection_mode="multi", default=list(ORNAMENT_KINDS),
+                     format_func=lambda k: {"sheet": "Motif sheets", "detail": "Details"}[k], key="orn_kinds")
+    seed = c2.number_input("Seed", min_value=0, value=0, step=1, key="orn_seed")
+    size = c3.selectbox("Per page", ORNAMENT_PAGE_SIZES, key="orn_size")
+    lab = ornament_lab(masks, st.session_state["style_name"], int(seed), tuple(kinds or ORNAMENT_KINDS), table)
+    pages = lab.pages(size)
+    axes = " × ".join(f"{n} {name}" for name, n in lab.describe().items())
+    st.caption(f"{len(lab):,} variants ({axes})")
+    page = st.number_input(f"Page (of {pages:,})", min_value=1, max_value=pages, value=1, step=1, key="orn_page")
+    variants = lab.page(page - 1, size)
+    st.dataframe([{"#": v.position + 1, "type": v.kind, "prompt": v.prompt, "id": v.id} for v in variants],
+                 hide_index=True, width="stretch")
+    st.download_button("Download this page (txt)", data=lambda: "\n".join(v.prompt for v in variants) + "\n",
+                       file_name=f"ornament_{to_token(st.session_state['style'], table)}_p{page}.txt", mime="text/plain")
+
+# -------------------------------
+# Urban Layout Lab
+# -------------------------------
+# A district generated from the style's Composition and Form. Layouts and
+# view tiles are cached in archstyle/urban.py, so panning, zooming and
+# returning to a recent seed redraw from cache.
+
+def urban_panel(table):
+    composition, forms = urban.style_params(unpack(st.session_state["style"], table), table)
+    st.caption(f"{composition} · {', '.join(forms) or 'no Form selected'}")
+    c1, c2, c3 = st.columns(3)
+    size = c1.selectbox("Grid", urban.SIZES, index=1, format_func=lambda n: f"{n:,} × {n:,}", key="urb_size")
+    seed = c2.number_input("Seed", min_value=0, value=0, step=1, key="urb_seed")
+    fit = -(-size // URBAN_VIEW)
+    steps = [fit] + [s for s in (8, 4, 2, 1) if s < fit]
+    step = fit
+    if len(steps) > 1:
+        step = c3.select_slider("Zoom (cells per pixel)", steps, format_func=lambda s: "fit" if s == fit else f"{s}",
+                                key="urb_step")
+    t0 = time.perf_counter()
+    d = urban.district(composition, forms, size, int(seed))
+    if step == fit:
+        cx = cy = size // 2
+    else:
+        c1, c2 = st.columns(2)
+        cx = c1.slider("Pan east–west", 0, size - 1, size // 2, key="urb_x")
+        cy = c2.slider("Pan north–south", 0, size - 1, size // 2, key="urb_y")
+    side = min(URBAN_VIEW, -(-size // step))
+    st.image(urban.view_png(d, cx, cy, step, side, side),
+             caption=f"{size:,} × {size:,} cells · drawn in {(time.perf_counter() - t0) * 1000:.0f} ms")
+    st.markdown(" ".join(f'<span style="color:{color}">■</span> {name}' for name, color in urban.legend()),
+                unsafe_allow_html=True)
+    name = f"district_{to_token(st.session_state['style'], table)}_{size}_{seed}"
+    c1, c2 = st.columns(2)
+    c1.download_button("Download layout (PNG)", data=lambda: urban.png_bytes(urban.indexed(d)),
+                       file_name=f"{name}.png", mime="image/png")
+    c2.download_button("Download layout (SVG)", data=lambda: urban.svg(d).encode("utf-8"),
+                       file_name=f"{name}.svg", mime="image/svg+xml")
+
+# -------------------------------
+# Preset Analytics
+# -------------------------------
+# Option popularity and co-occurrence (archstyle/analytics.py) over the
+# library, the current bulk import, or (opt-in) preset archives on the server.
+# Counting runs when asked for; only the counts are kept in the session.
+
+def histogram_chart(stats, table):
+    rows = [{"option": f"{key}: {label}", "slot": key, "presets": n, "share": share}
+            for key, options in stats.histograms(table).items() for label, n, share in options]
+    return {"data": {"values": rows}, "mark": "bar", "height": {"step": 14},
+            "encoding": {"y": {"field": "option", "type": "nominal", "sort": None, "title": None},
+                         "x": {"field": "share", "type": "quantitative", "title": "Share of presets",
+                               "axis": {"format": "%"}},
+                         "color": {"field": "slot", "type": "nominal", "legend": None},
+                         "tooltip": [{"field": "option"}, {"field": "presets", "format": ","},
+                                     {"field": "share", "format": ".1%"}]}}
+
+def heatmap_chart(stats, measure, slots, table):
+    names = analytics.option_names(table)
+    ids = [i for s in slots for i in table.slots[s].options]
+    values = stats.matrix(measure)
+    # A lift diagonal is just 1 / share; leave it blank so pairs set the scale.
+    rows = [{"a": names[i], "b": names[j], "value": float(values[i, j])}
+            for i in ids for j in ids if measure != "lift" or i != j]
+    order = [names[i] for i in ids]
+    scale = {"scheme": "blueorange", "domainMid": 1} if measure == "lift" else {"scheme": "blues"}
+    fmt = {"count": ",.0f", "share": ".2%", "lift": ".2f"}[measure]
+    return {"data": {"values": rows}, "mark": "rect", "width": {"step": 16}, "height": {"step": 16},
+            "encoding": {"x": {"field": "b", "type": "nominal", "sort": order, "title": None,
+                               "axis": {"labelAngle": -60}},
+                         "y": {"field": "a", "type": "nominal", "sort": order, "title": None},
+                         "color": {"field": "value", "type": "quantitative", "scale": scale, "title": measure},
+                         "tooltip": [{"field": "a", "title": "option"}, {"field": "b", "title": "with"},
+                                     {"field": "value", "title": measure, "format": fmt}]}}
+
+def analytics_files(text):
+    # The preset files named in text (paths relative to ANALYTICS_ROOT),
+    # folders expanded; (files, error). Nothing outside the root is read,
+    # symlinks included.
+    def inside(path):
+        real = os.path.realpath(path)
+        return real == ANALYTICS_ROOT or real.startswith(ANALYTICS_ROOT.rstrip(os.sep) + os.sep)
+    paths = [os.path.join(ANALYTICS_ROOT, p.strip().lstrip("/\\")) for p in text.splitlines() if p.strip()]
+    if not paths:
+        return [], "Enter a file or folder."
+    bad = [p for p in paths if not inside(p) or not os.path.exists(p)]
+    if bad:
+        return [], f"No such file or folder under the analytics root: {', '.join(os.path.relpath(p, ANALYTICS_ROOT) for p in bad)}"
+    return [f for f in analytics.iter_files(paths) if inside(f)], None
+
+def analytics_panel(pack):
+    table = pack.table
+    c1, c2 = st.columns([1, 2])
+    source = c1.radio("Presets", ANALYTICS_SOURCES, key="ana_source")
+    if source == ANALYTICS_FILES:
+        c2.text_area("Files or folders, one per line", key="ana_paths",
+                     placeholder=".json, .jsonl and .zip files, or folders of them",
+                     help="Paths are relative to the server's analytics folder.")
+    if st.button("Count options", key="ana_run"):
+        progress = st.empty()
+        t0 = time.perf_counter()
+        if source == ANALYTICS_SOURCES[0]:
+            stats = analytics.library_stats(preset_library(pack.name), table)
+        elif source == ANALYTICS_SOURCES[1]:
+            stats = analytics.code_stats(stored("import", (PresetList(table=table),))[0].iter_codes(), table)
+        else:
+            files, error = analytics_files(st.session_state.get("ana_paths", ""))
+            if error:
+                st.error(error)
+                return
+            stats, _ = analytics.scan(files, ANALYTICS_WORKERS, report=lambda done, rejected, rate: progress.caption(
+                f"{done:,} presets counted ({rejected:,} rejected) · {rate:,.0f} presets/s"), report_every=0.5,
+                pack=pack.name)
+        progress.empty()
+        store("analytics", (source, stats, time.perf_counter() - t0))
+    result = stored("analytics")
+    if not result:
+        st.caption("Choose where the presets are and click **Count options**.")
+        return
+    source, stats, elapsed = result
+    st.caption(f"{source}: {stats.summary()} in {elapsed:.1f}s")
+    if stats.errors:
+        with st.expander(f"Rejected presets ({stats.rejected:,}, first {len(stats.errors):,} shown)"):
+            st.dataframe([e._asdict() for e in stats.errors], hide_index=True)
+    if not stats.presets:
+        return
+
+    st.markdown("**Option popularity**")
+    st.vega_lite_chart(histogram_chart(stats, table), width="stretch")
+    st.markdown("**Options chosen together**")
+    c1, c2 = st.columns([1, 2])
+    measure = c1.selectbox("Measure", list(ANALYTICS_MEASURES), format_func=ANALYTICS_MEASURES.get, key="ana_measure")
+    slots = c2.multiselect("Stages", range(len(table.slots)), default=list(range(len(table.slots))),
+                           format_func=lambda i: table.slots[i].key, key="ana_slots")
+    if slots:
+        st.vega_lite_chart(heatmap_chart(stats, measure, sorted(slots), table))
+    c1, c2 = st.columns(2)
+    c1.download_button("Download option counts (CSV)", data=lambda: stats.histogram_csv(table).encode("utf-8"),
+                       file_name="option_counts.csv", mime="text/csv")
+    c2.download_button(f"Download co-occurrence matrix (CSV, {measure})",
+                       data=lambda: stats.matrix_csv(measure, table).encode("utf-8"),
+                       file_name=f"option_pairs_{measure}.csv", mime="text/csv")
 
 # -------------------------------
 # UI
 # -------------------------------
-init_state()
+if METRICS_ENABLED:
+    METRICS.inc("reruns_total", scope="full")
+pack = current_pack()
+init_state(pack)
 
 with st.sidebar:
-    st.markdown(f"### {APP_TITLE}")
+    st.markdown(f"### {pack.title}")
     st.caption("Part of the A.R. Framework (Diadems → Architecture)")
+    st.selectbox("Stage pack", list(dict.fromkeys([DEFAULT_PACK] + sorted(available_packs()))), key="pack",
+                 on_change=switch_pack, help="The taxonomy styles are built from. Switching starts a new style.")
 
     st.text_input("Style Name", key="style_name")
     st.text_input("World / Project Name (optional)", key="world_name")
@@ -385,104 +728,97 @@ with st.sidebar:
     st.divider()
 
     st.markdown("**Preset Manager**")
-    uploaded = st.file_uploader("Load preset (.json)", type=["json"], accept_multiple_files=False, label_visibility="collapsed")
-    if uploaded:
-        try:
-            data = json.load(uploaded)
-            st.session_state["style_name"] = data.get("style_name", st.session_state["style_name"])
-            st.session_state["notes"] = data.get("notes", st.session_state["notes"])
-            st.session_state["world_name"] = data.get("world_name", st.session_state["world_name"])
-            loaded_responses = data.get("responses", {})
-            if not loaded_responses and all(k in data for k in [s["id"] for s in STAGES]):
-                loaded_responses = {k: data[k] for k in [s["id"] for s in STAGES] if k in data}
-            st.session_state["responses"] = loaded_responses or st.session_state["responses"]
-            st.success("Preset loaded. Scroll the Builder to see selections updated.")
-        except Exception as e:
-            st.error(f"Could not load preset: {e}")
+    upload_key = f"preset_files_{st.session_state.get('upload_key', 0)}"
+    st.file_uploader("Load presets (.json, .jsonl, .zip)", type=["json", "jsonl", "ndjson", "zip"],
+                     accept_multiple_files=True, label_visibility="collapsed",
+                     key=upload_key, on_change=load_preset_files, args=(upload_key,))
+    st.text_input("Style code", key="style_code_input", placeholder="Paste a style code",
+                  on_change=load_style_code)
+    status = st.session_state.pop("preset_status", None)
+    if status:
+        getattr(st, status[0])(status[1])
+    imported, report = stored("import", (None, None))
+    if imported:
+        shown = min(len(imported), IMPORT_PICKER_LIMIT)
+        st.selectbox(f"Imported presets ({shown:,} of {len(imported):,} shown)", range(shown), index=None,
+                     format_func=lambda i: imported_label(imported, i), placeholder="Choose a preset to load",
+                     key="imported_pick", on_change=load_imported_preset)
+    if report and report.errors:
+        with st.expander(f"Import errors ({report.rejected:,})"):
+            st.dataframe([e._asdict() for e in report.errors[:IMPORT_PICKER_LIMIT]], hide_index=True)
+            if report.errors_dropped:
+                st.caption(f"{report.errors_dropped:,} further errors not kept.")
+            st.download_button("Download error report (CSV)", data=lambda: errors_csv(report).encode("utf-8"),
+                               file_name="preset_import_errors.csv", mime="text/csv")
     st.caption("Use 'Download Style JSON (Preset)' in the Builder to save your selections.")
 
+    st.markdown("**Preset Library**")
+    render_library(pack)
+
     st.divider()
     st.markdown("**About**")
+    if pack.description:
+        st.caption(f"Stage pack: **{pack.name}** — {pack.description}")
     st.caption("Use the Concept Guides to understand options before choosing. Build a style in 7 stages, export a Manifesto, AI prompts, and a World Outline.")
     st.caption("© Anselm Rajah 2025 – Co-produced with ChatGPT")
 
-st.title(APP_TITLE)
-tabs = st.tabs(["Builder", "Ornament Lab (placeholder)", "Urban Layout Lab (placeholder)"])
-
-with tabs[0]:
-    st.markdown("Use the **Concept Guide** under each stage to understand the options, then make your selections.")
-    st.progress(0.0)
-    progress_per_stage = 1.0 / len(STAGES)
-    done = True
-
-    for i, stage in enumerate(STAGES):
-        with st.container(border=True):
-            render_stage(stage)
-        st.progress((i + 1) * progress_per_stage)
-        resp = st.session_state["responses"].get(stage["id"])
-        if stage["type"] == "single":
-            if not resp or len(resp) != 1: done = False
-        elif stage["type"] == "multi":
-            if not resp or len(resp) < stage["min_selections"]: done = False
-        elif stage["type"] == "compound":
-            if not resp: done = False
-            else:
-                for grp in stage["groups"]:
-                    selections = resp.get(grp["id"], [])
-                    if len(selections) < grp["min_selections"]: done = False
-
-    st.divider()
-    col1, col2, col3 = st.columns([1,1,1])
-
-    if done:
-        manifesto = compose_manifesto(st.session_state["responses"], st.session_state["style_name"], st.session_state["notes"], st.session_state["world_name"])
-        prompts = compose_prompts(st.session_state["responses"], st.session_state["style_name"])
-        outline = compose_world_outline(st.session_state["responses"], st.session_state["world_name"])
-
-        with col1:
-            st.subheader("Manifesto")
-            st.markdown(manifesto)
-
-        with col2:
-            st.subheader("AI Image Prompts")
-            for k, v in prompts.items():
-                st.markdown(f"**{k}**")
-                st.code(v)
-
-        with col3:
-            st.subheader("Export")
-            ts = dt.datetime.now().strftime("%Y%m%d_%H%M%S")
-            base = (st.session_state['world_name'] or st.session_state['style_name']).replace(' ', '_')
-            st.download_button("Download Manifesto (Markdown)",
-                               data=manifesto.encode("utf-8"),
-                               file_name=f"{base}_manifesto_{ts}.md",
-                               mime="text/markdown")
-            payload = {"app_title": APP_TITLE, "style_name": st.session_state["style_name"],
-                       "world_name": st.session_state["world_name"],
-                       "notes": st.session_state["notes"], "responses": st.session_state["responses"],
-                       "prompts": prompts, "exported_at": ts}
-            st.download_button("Download Style JSON (Preset)",
-                               data=json.dumps(payload, indent=2).encode("utf-8"),
-                               file_name=f"{base}_style_{ts}.json",
-                               mime="application/json")
-
-        st.divider()
-        with st.container(border=True):
-            st.subheader("World Outline")
-            st.caption("A quick working document you can paste into your notebook or wiki.")
-            st.markdown(outline)
-            st.download_button("Download World Outline (Markdown)",
-                               data=outline.encode("utf-8"),
-                               file_name=f"{base}_world_outline_{ts}.md",
-                               mime="text/markdown")
-    else:
-        st.warning("Complete all stages to generate your manifesto, prompts, and outline.")
-        st.caption("Tip: Defaults are preselected — accept them and refine later.")
-
-with tabs[1]:
-    st.subheader("Ornament Lab (placeholder)")
-    st.caption("Future module for motif sheets and detail prompts.")
-
-with tabs[2]:
-    st.subheader("Urban Layout Lab (placeholder)")
-    st.caption("Future module for axes, plazas, and district logic.")
+    with st.expander("Render cache"):
+        stats = RENDER_CACHE.stats()
+        st.caption(f"{stats['size']:,} / {stats['maxsize']:,} styles cached · hit rate {stats['hit_rate']:.0%}")
+        st.caption(f"hits {stats['hits']:,} · misses {stats['misses']:,} · evictions {stats['evictions']:,}")
+
+    if METRICS_ENABLED:
+        with st.expander("Performance (debug)"):
+            render_metrics_panel()
+
+st.title(pack.title)
+# Only the open tab's content runs: the labs and analytics add no widgets to
+# a Builder rerun, and switching tabs reruns the app, so a lab opened after
+# a change in the Builder is drawn from the current style.
+tabs = st.tabs(TABS, key="tab", on_change="rerun")
+
+if tabs[0].open:
+    with tabs[0]:
+        st.markdown("Use the **Concept Guide** under each stage to understand the options, then make your selections.")
+        fragment(progress_panel, "progress")(pack.table)
+
+        for stage in pack.stages:
+            fragment(stage_panel, f"stage_{stage['id']}")(pack.table, stage)
+
+        fragment(artifacts_panel, "artifacts")(pack)
+
+if tabs[1].open:
+    with tabs[1]:
+        st.subheader("Ornament Lab")
+        st.caption("Motif-sheet and detail prompts expanded from your Ornament, Material and Light choices.")
+        fragment(ornament_panel, "ornament_lab")(pack.table)
+
+if tabs[2].open:
+    with tabs[2]:
+        st.subheader("Urban Layout Lab")
+        st.caption("A district plan generated from your Composition (street skeleton) and Form (modifiers) choices.")
+        fragment(urban_panel, "urban_lab")(pack.table)
+
+if tabs[3].open:
+    with tabs[3]:
+        st.subheader("Preset Analytics")
+        st.caption("Which options your presets actually choose, and which go together.")
+        fragment(analytics_panel, "analytics")(pack)
+
+if METRICS_ENABLED:
+    METRICS.observe(METRICS.key("script", {}), time.perf_counter() - script_started)
+    # Sizing a session pickles all of its values, so it is sampled after a
+    # run at most once per flush interval; the panel shows the last sample.
+    now = time.monotonic()
+    if now - st.session_state.get("_state_sampled", float("-inf")) >= FLUSH_SECONDS:
+        footprint = state_footprint({k: v for k, v in st.session_state.items()
+                                     if k not in ("_state_footprint", "_state_sampled")})
+        METRICS.set("session_state_bytes", sum(footprint.values()))
+        METRICS.set("session_state_keys", len(footprint))
+        stored_sizes = SESSION_STORE.footprint(st.session_state["sid"])
+        METRICS.set("session_stored_bytes", sum(stored_sizes.values()))
+        footprint.update((f"stored {name}", n) for name, n in stored_sizes.items())
+        st.session_state["_state_footprint"] = footprint
+        st.session_state["_state_sampled"] = now
+    for name, value in SESSION_STORE.stats().items():
+        METRICS.set(f"session_store_{name}", value)
@@ -0,0 +1,16 @@
+# Streamlit-free core of the Style Builder: stage data and concept guides
+# (of the default stage pack; stagepacks.load gives the others) and the
+# artifact composers. Safe to import from batch jobs, workers and tests.
+from .stages import APP_TITLE, STAGES, CONCEPT_GUIDE, DEFAULT_STYLE_NAME, PACK, TABLE
+from .table import OptionTable
+from .compose import (clean_label, compose_manifesto, compose_prompts, compose_world_outline,
+                      render_manifesto, render_prompts, render_outline, render_style)
+from .codec import pack, unpack, to_token, from_token, read_preset, compact_preset, expand_preset
+
+__all__ = [
+    "APP_TITLE", "STAGES", "CONCEPT_GUIDE", "DEFAULT_STYLE_NAME",
+    "TABLE", "OptionTable", "PACK",
+    "clean_label", "compose_manifesto", "compose_prompts", "compose_world_outline",
+    "render_manifesto", "render_prompts", "render_outline", "render_style",
+    "pack", "unpack", "to_token", "from_token", "read_preset", "compact_preset", "expand_preset",
+]
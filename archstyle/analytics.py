@@ -0,0 +1,342 @@
+import argparse
+import csv
+import functools
+import io
+import multiprocessing as mp
+import os
+import sys
+import time
+import zipfile
+from collections import deque, namedtuple
+
+import numpy as np
+
+from .stages import TABLE
+from .stagepacks import DEFAULT, load
+from .codec import code_bits
+from .importer import JSONL_SUFFIXES, ImportReport, iter_presets, validator
+
+# -------------------------------
+# Preset analytics
+# -------------------------------
+# Which options an archive of presets actually picks, and which pairs go
+# together. Each preset's style code becomes one row of option indicators
+# (a column per option id, across all slots); a chunk of rows adds its
+# column sums to the per-option counts and its X^T X to the co-occurrence
+# matrix, so the archive is never held in memory, only the counts are.
+#
+# Files are cut into work units of about SPAN_BYTES: large JSONL files into
+# byte ranges on line boundaries, zip archives into members, and small files
+# grouped together. Worker processes scan units through the bulk importer
+# (same formats, same validation) and send back their counts to be summed;
+# they are sent the stage pack's name and load its table themselves.
+
+SUFFIXES = JSONL_SUFFIXES + (".json", ".zip")
+SPAN_BYTES = 32 * 1024 * 1024
+CHUNK_ROWS = 1 << 16  # float32 X^T X stays exact below 2**24 rows
+MAX_ERRORS = 100
+MEASURES = ("count", "share", "lift")
+
+# One piece of a work unit: a whole file (stop None), a byte range of a
+# JSONL file, or one member of a zip archive.
+Part = namedtuple("Part", "path member start stop size")
+
+@functools.lru_cache(maxsize=None)
+def option_columns(table=TABLE):
+    # Bit position of every option (by id) in a packed style code.
+    shifts = []
+    shift = code_bits(table)
+    for width in table.widths:
+        shift -= width
+        shifts.append(shift)
+    return np.array([shifts[o.slot] + o.bit.bit_length() - 1 for o in table.options], dtype=np.intp)
+
+def indicators(codes, columns, bits):
+    # (len(codes), options) uint8: 1 where the preset selects the option.
+    n = len(codes)
+    words = np.empty((n, -(-bits // 64)), dtype="<u8")
+    if words.shape[1] == 1:
+        words[:, 0] = np.fromiter(codes, dtype=np.uint64, count=n)
+    else:
+        for w in range(words.shape[1]):
+            words[:, w] = np.fromiter(((c >> (64 * w)) & 0xFFFFFFFFFFFFFFFF for c in codes), dtype=np.uint64, count=n)
+    return np.unpackbits(words.view(np.uint8), axis=1, bitorder="little")[:, columns]
+
+class OptionStats:
+    # Per-option counts live on the diagonal of pairs. Holds no table, so it
+    # pickles small; pass the table the codes were packed with to the views.
+    def __init__(self, options=len(TABLE.options)):
+        self.presets = 0
+        self.rejected = 0
+        self.errors = []
+        self.pairs = np.zeros((options, options), dtype=np.int64)
+
+    @property
+    def counts(self):
+        return self.pairs.diagonal().copy()
+
+    def add_codes(self, codes, table=TABLE):
+        columns, bits = option_columns(table), code_bits(table)
+        for lo in range(0, len(codes), CHUNK_ROWS):
+            x = indicators(codes[lo:lo + CHUNK_ROWS], columns, bits).astype(np.float32)
+            self.pairs += (x.T @ x).astype(np.int64)
+        self.presets += len(codes)
+
+    def merge(self, other):
+        self.presets += other.presets
+        self.rejected += other.rejected
+        self.errors.extend(other.errors[:MAX_ERRORS - len(self.errors)])
+        self.pairs += other.pairs
+        return self
+
+    # -- views ------------------------------------------------------
+    def histograms(self, table=TABLE):
+        # {slot key: [(label, presets, share), ...]} in option order.
+        counts, n = self.counts, max(self.presets, 1)
+        return {s.key: [(table.options[i].label, int(counts[i]), counts[i] / n) for i in s.options]
+                for s in table.slots}
+
+    def matrix(self, measure="count"):
+        # count: presets with both options; share: the same over all presets;
+        # lift: observed over expected if the two were picked independently.
+        if measure == "count":
+            return self.pairs
+        if measure == "share":
+            return self.pairs / max(self.presets, 1)
+        counts = self.counts.astype(np.float64)
+        expected = np.outer(counts, counts) / max(self.presets, 1)
+        return np.divide(self.pairs, expected, out=np.zeros(self.pairs.shape), where=expected > 0)
+
+    def histogram_csv(self, table=TABLE):
+        out = io.StringIO()
+        writer = csv.writer(out)
+        writer.writerow(("slot", "option", "presets", "share"))
+        for key, rows in self.histograms(table).items():
+            writer.writerows((key, label, n, f"{share:.6f}") for label, n, share in rows)
+        return out.getvalue()
+
+    def matrix_csv(self, measure="count", table=TABLE):
+        labels = option_names(table)
+        values = self.matrix(measure)
+        out = io.StringIO()
+        writer = csv.writer(out)
+        writer.writerow(["option"] + labels)
+        for label, row in zip(labels, values):
+            writer.writerow([label] + ([int(v) for v in row] if measure == "count" else [f"{v:.6f}" for v in row]))
+        return out.getvalue()
+
+    def summary(self):
+        return f"{self.presets:,} presets counted, {self.rejected:,} rejected"
+
+def option_names(table=TABLE):
+    return [f"{table.slots[o.slot].key}: {o.label}" for o in table.options]
+
+def code_stats(codes, table=TABLE):
+    # Stats over codes already in hand (the library, an import).
+    stats = OptionStats(len(table.options))
+    stats.add_codes(list(codes), table)
+    return stats
+
+def library_stats(library, table=TABLE):
+    stats = OptionStats(len(table.options))
+    for _, codes in library.codes(CHUNK_ROWS):
+        stats.add_codes(codes, table)
+    return stats
+
+# -------------------------------
+# Work units
+# -------------------------------
+def iter_files(paths):
+    # Files with a preset suffix, directories walked in name order.
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(SUFFIXES) and not name.startswith("."):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+def _line_start(fp, offset):
+    # First line start at or after offset.
+    fp.seek(offset - 1)
+    fp.readline()
+    return fp.tell()
+
+def iter_parts(paths, span=SPAN_BYTES):
+    for path in iter_files(paths):
+        suffix = os.path.splitext(path)[1].lower()
+        size = os.path.getsize(path) if os.path.isfile(path) else 0
+        if suffix == ".zip" and zipfile.is_zipfile(path):
+            with zipfile.ZipFile(path) as archive:
+                for info in archive.infolist():
+                    if not info.is_dir() and not os.path.basename(info.filename).startswith((".", "__MACOSX")):
+                        yield Part(path, info.filename, 0, None, info.file_size)
+        elif suffix in JSONL_SUFFIXES and size > span:
+            with open(path, "rb") as fp:
+                start = 0
+                while start < size:
+                    stop = _line_start(fp, start + span) if start + span < size else size
+                    yield Part(path, None, start, stop, stop - start)
+                    start = stop
+        else:
+            yield Part(path, None, 0, None, size)
+
+def iter_units(paths, span=SPAN_BYTES):
+    # Parts grouped into units of about span bytes.
+    unit, size = [], 0
+    for part in iter_parts(paths, span):
+        unit.append(part)
+        size += part.size
+        if size >= span:
+            yield unit
+            unit, size = [], 0
+    if unit:
+        yield unit
+
+class _Span(io.RawIOBase):
+    # A byte range of a file, as a stream.
+    def __init__(self, fp, start, stop):
+        fp.seek(start)
+        self.fp, self.left = fp, stop - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = self.fp.readinto(memoryview(b)[:self.left]) if self.left else 0
+        self.left -= n
+        return n
+
+def _sources(part):
+    # (name, binary stream) pairs for iter_presets.
+    if part.member is not None:
+        with zipfile.ZipFile(part.path) as archive, archive.open(part.member) as stream:
+            yield f"{part.path}/{part.member}", stream
+    elif part.stop is not None:
+        with open(part.path, "rb", buffering=0) as fp, io.BufferedReader(_Span(fp, part.start, part.stop)) as stream:
+            yield part.path, stream
+    else:
+        with open(part.path, "rb") as fp:
+            yield part.path, fp
+
+def scan_unit(unit, table=TABLE):
+    stats = OptionStats(len(table.options))
+    report = ImportReport(MAX_ERRORS)
+    codes = []
+    for part in unit:
+        if not os.path.isfile(part.path):
+            report.total += 1
+            report.reject(part.path, 0, "no such file")
+            continue
+        kept = len(report.errors)
+        for preset in iter_presets(_sources(part), report, validator(table)):
+            codes.append(preset["code"])
+            if len(codes) == CHUNK_ROWS:
+                stats.add_codes(codes, table)
+                codes = []
+        if part.start:
+            # Record numbers in a byte range count from its first line.
+            report.errors[kept:] = [e._replace(source=f"{e.source} (from byte {part.start:,})")
+                                    for e in report.errors[kept:]]
+    stats.add_codes(codes, table)
+    stats.rejected, stats.errors = report.rejected, report.errors
+    return stats
+
+def _scan_pack_unit(unit, pack):
+    return scan_unit(unit, load(pack).table)
+
+# -------------------------------
+# Scanning
+# -------------------------------
+def scan(paths, workers=None, span=SPAN_BYTES, report=None, report_every=2.0, pack=DEFAULT):
+    # Stats over every preset in paths (files, directories or zip archives),
+    # read with the table of the stage pack named pack. report(presets,
+    # rejected, rate) is called every report_every seconds.
+    table = load(pack).table
+    stats = OptionStats(len(table.options))
+    t0 = last = time.perf_counter()
+
+    def add(result):
+        nonlocal last
+        stats.merge(result)
+        now = time.perf_counter()
+        if report and now - last >= report_every:
+            last = now
+            report(stats.presets, stats.rejected, stats.presets / (now - t0))
+
+    units = iter_units(paths, span)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1:
+        for unit in units:
+            add(scan_unit(unit, table))
+    else:
+        # forkserver: safe to start from a threaded process such as the app.
+        # A bounded window of units in flight keeps the parent's memory flat
+        # however many files there are.
+        context = mp.get_context("forkserver" if "forkserver" in mp.get_all_start_methods() else "spawn")
+        with context.Pool(workers) as pool:
+            pending = deque()
+            for unit in units:
+                pending.append(pool.apply_async(_scan_pack_unit, (unit, pack)))
+                if len(pending) >= workers * 4:
+                    add(pending.popleft().get())
+            while pending:
+                add(pending.popleft().get())
+    return stats, time.perf_counter() - t0
+
+# -------------------------------
+# CLI
+# -------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Option popularity and co-occurrence over preset archives.")
+    parser.add_argument("paths", nargs="*", help=".json, .jsonl and .zip files, or directories of them")
+    parser.add_argument("--db", help="Analyse a preset library instead of files")
+    parser.add_argument("--pack", default=DEFAULT, help=f"Stage pack of the presets (default: {DEFAULT})")
+    parser.add_argument("--workers", type=int, help="Worker processes (default: CPU count, 1 = inline)")
+    parser.add_argument("--histograms", metavar="CSV", help="Write per-option counts to CSV")
+    parser.add_argument("--pairs", metavar="CSV", help="Write the co-occurrence matrix to CSV")
+    parser.add_argument("--measure", choices=MEASURES, default="count", help="Co-occurrence values for --pairs")
+    parser.add_argument("--top", type=int, default=3, help="Options shown per slot")
+    args = parser.parse_args(argv)
+    if bool(args.paths) == bool(args.db):
+        parser.error("give preset files or --db, not both")
+
+    def report(done, rejected, rate):
+        print(f"{done:,} presets ({rejected:,} rejected)  {rate:,.0f} presets/s", file=sys.stderr)
+
+    table = load(args.pack).table
+    if args.db:
+        from .library import PresetLibrary
+        try:
+            library = PresetLibrary(args.db, table)
+        except ValueError as e:
+            raise SystemExit(str(e))
+        t0 = time.perf_counter()
+        stats = library_stats(library, table)
+        elapsed = time.perf_counter() - t0
+        library.close()
+    else:
+        missing = [p for p in args.paths if not os.path.exists(p)]
+        if missing:
+            raise SystemExit(f"No such file or directory: {', '.join(missing)}")
+        stats, elapsed = scan(args.paths, args.workers, report=report, pack=args.pack)
+
+    for e in stats.errors[:10]:
+        print(f"{e.source}:{e.record}: {e.message}", file=sys.stderr)
+    for key, rows in stats.histograms(table).items():
+        top = sorted(rows, key=lambda r: -r[1])[:args.top]
+        print(f"{key:>18}  " + "  ".join(f"{label} {share:.1%}" for label, _, share in top))
+    for path, text in ((args.histograms, lambda: stats.histogram_csv(table)),
+                       (args.pairs, lambda: stats.matrix_csv(args.measure, table))):
+        if path:
+            with open(path, "w", encoding="utf-8", newline="") as fp:
+                fp.write(text())
+    rate = (stats.presets + stats.rejected) / elapsed if elapsed else 0.0
+    print(f"{stats.summary()} in {elapsed:.2f}s ({rate:,.0f} presets/s)", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,278 @@
+import argparse
+import functools
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import time
+
+from aiohttp import web
+
+from .stages import PACK
+from .stagepacks import load
+from .codec import to_token
+from .cache import render_cached
+from .importer import validator
+from .metrics import METRICS, ENABLED as METRICS_ENABLED
+
+# -------------------------------
+# Render API
+# -------------------------------
+# A small HTTP service over the composers, for tools that want artifacts
+# without the Streamlit UI:
+#
+#   POST /render        one selection -> {"style", "manifesto", "prompts", "world_outline"}
+#   POST /render/batch  many selections -> JSON, or NDJSON streamed as it renders
+#   GET  /stages        a stage pack (what selections are validated against)
+#   GET  /health
+#   GET  /metrics       Prometheus text, when ARCHSTYLE_METRICS is on (per worker)
+#
+# A selection is a preset: {"style": "<code>"} or {"responses": {...}} (or
+# stage ids at the top level), plus optional style_name, world_name and
+# notes. It is validated strictly by the importer's validator for the stage
+# pack named by ?pack= (default: the server's, ARCHSTYLE_PACK; others are
+# loaded on first use), and errors come back as {"errors": [...]}.
+# "artifacts" limits the output to some of manifesto / prompts /
+# world_outline.
+#
+# Rendering goes through the shared render cache. A batch sent as NDJSON
+# (Content-Type: application/x-ndjson) is read line by line and answered
+# line by line, so neither side holds the batch. --workers starts that many
+# processes on one port (SO_REUSEPORT) and the kernel spreads connections
+# across them.
+#
+# Error bodies name what was wrong with the request, never server paths or
+# exception text; a pack that fails to load and any unexpected error are
+# logged here (logger "archstyle.api") and answered with a generic message.
+
+log = logging.getLogger(__name__)
+
+ARTIFACTS = ("manifesto", "prompts", "world_outline")
+NDJSON = "application/x-ndjson"
+MAX_BODY = 16 * 1024 * 1024
+MAX_JSON_BATCH = 1000  # larger batches must be streamed as NDJSON
+STREAM_CHUNK = 64  # result lines per write
+
+# Style codes repeat across requests; encoding one is a fifth of a cached render.
+_token = functools.lru_cache(maxsize=8192)(to_token)
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+def _json(value, status=200):
+    return web.Response(body=_dumps(value).encode("utf-8"), status=status, content_type="application/json",
+                        charset="utf-8")
+
+def _artifacts(value):
+    # Requested artifact names, or a list of errors.
+    if value is None:
+        return ARTIFACTS, []
+    if not isinstance(value, list) or not value or any(a not in ARTIFACTS for a in value):
+        return None, [f"artifacts: expected a non-empty list of {', '.join(ARTIFACTS)}"]
+    return tuple(a for a in ARTIFACTS if a in value), []
+
+def _pack(request):
+    # The stage pack named by ?pack=; only pack names, not paths, are taken.
+    name = request.query.get("pack")
+    if not name:
+        return PACK
+    if os.path.basename(name) != name or name.endswith(".json"):
+        raise web.HTTPBadRequest(body=_dumps({"errors": [f"pack: '{name}' is not a pack name"]}).encode("utf-8"),
+                                 content_type="application/json")
+    try:
+        return load(name)
+    except LookupError:
+        raise web.HTTPBadRequest(body=_dumps({"errors": [f"pack: no stage pack named '{name}'"]}).encode("utf-8"),
+                                 content_type="application/json")
+    except ValueError:
+        log.exception("stage pack %r failed to load", name)
+        raise web.HTTPInternalServerError(
+            body=_dumps({"errors": [f"pack: stage pack '{name}' could not be loaded"]}).encode("utf-8"),
+            content_type="application/json")
+
+def render_item(data, artifacts=ARTIFACTS, pack=PACK):
+    # One selection -> (result, errors); result is None whenever errors is non-empty.
+    preset, errors = validator(pack.table).validate(data)
+    if errors:
+        return None, errors
+    style_name = preset.get("style_name") or pack.default_style_name
+    world_name, notes = preset.get("world_name", ""), preset.get("notes", "")
+    rendered = render_cached(preset["code"], style_name, notes, world_name, table=pack.table)
+    result = {"style": _token(preset["code"], pack.table), "style_name": style_name}
+    for a in artifacts:
+        result[a] = rendered[a]
+    return result, []
+
+async def _body(request):
+    try:
+        return await request.json(loads=json.loads)
+    except ValueError:
+        raise web.HTTPBadRequest(body=_dumps({"errors": ["body is not valid JSON"]}).encode("utf-8"),
+                                 content_type="application/json")
+
+async def render(request):
+    pack = _pack(request)
+    data = await _body(request)
+    artifacts, errors = _artifacts(data.get("artifacts") if isinstance(data, dict) else None)
+    if errors:
+        return _json({"errors": errors}, 400)
+    result, errors = render_item(data, artifacts, pack)
+    return _json(result if not errors else {"errors": errors}, 200 if not errors else 400)
+
+async def _ndjson_items(request):
+    # Parsed lines of a streamed request body (blank lines skipped).
+    async for line in request.content:
+        line = line.strip()
+        if line:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield {"_invalid": "line is not valid JSON"}
+
+async def _aiter(items):
+    for item in items:
+        yield item
+
+def _render_line(index, item, artifacts, pack):
+    if isinstance(item, dict) and "_invalid" in item:
+        result, errors = None, [item["_invalid"]]
+    else:
+        result, errors = render_item(item, artifacts, pack)
+    row = {"index": index}
+    row.update(result if not errors else {"errors": errors})
+    return row
+
+async def render_batch(request):
+    # Items from a JSON body ({"items": [...], "artifacts": [...]} or a bare
+    # list) or from NDJSON lines (?artifacts=a,b). The answer is NDJSON when
+    # the request was, when the client accepts it, or with ?stream=1.
+    pack = _pack(request)
+    streamed_in = request.content_type == NDJSON
+    if streamed_in:
+        names = request.query.get("artifacts")
+        artifacts, errors = _artifacts(names.split(",") if names else None)
+        items = _ndjson_items(request)
+    else:
+        data = await _body(request)
+        if isinstance(data, dict):
+            items, (artifacts, errors) = data.get("items"), _artifacts(data.get("artifacts"))
+        else:
+            items, (artifacts, errors) = data, _artifacts(None)
+        if not errors and not isinstance(items, list):
+            errors = ["expected a list of items, or an object with 'items'"]
+    if errors:
+        return _json({"errors": errors}, 400)
+
+    stream = streamed_in or NDJSON in request.headers.get("Accept", "") or request.query.get("stream") == "1"
+    if not stream:
+        if len(items) > MAX_JSON_BATCH:
+            return _json({"errors": [f"{len(items):,} items: batches over {MAX_JSON_BATCH:,} must be streamed "
+                                     f"(send or accept {NDJSON})"]}, 413)
+        return _json({"results": [_render_line(i, item, artifacts, pack) for i, item in enumerate(items)]})
+
+    response = web.StreamResponse(headers={"Content-Type": f"{NDJSON}; charset=utf-8"})
+    response.enable_chunked_encoding()
+    await response.prepare(request)
+    lines = []
+    index = 0
+    async for item in (items if streamed_in else _aiter(items)):
+        lines.append(_dumps(_render_line(index, item, artifacts, pack)))
+        index += 1
+        if len(lines) >= STREAM_CHUNK:
+            await response.write(("\n".join(lines) + "\n").encode("utf-8"))
+            lines = []
+    if lines:
+        await response.write(("\n".join(lines) + "\n").encode("utf-8"))
+    await response.write_eof()
+    return response
+
+async def stages(request):
+    pack = _pack(request)
+    return _json({"pack": pack.name, "pack_id": pack.table.pack_id, "title": pack.title,
+                  "default_style_name": pack.default_style_name, "stages": pack.stages, "guide": pack.guide})
+
+async def health(request):
+    return _json({"status": "ok", "pack": PACK.name, "pid": os.getpid()})
+
+async def metrics(request):
+    return web.Response(text=METRICS.prometheus(), content_type="text/plain")
+
+@web.middleware
+async def errors(request, handler):
+    # Unexpected failures: details to the log, a generic 500 to the client.
+    try:
+        return await handler(request)
+    except web.HTTPException:
+        raise
+    except Exception:
+        log.exception("%s %s failed", request.method, request.path)
+        return _json({"errors": ["internal server error"]}, 500)
+
+@web.middleware
+async def timing(request, handler):
+    # Per-route latency, when ARCHSTYLE_METRICS is on (see metrics.py).
+    t0 = time.perf_counter()
+    try:
+        return await handler(request)
+    finally:
+        route = request.match_info.route.resource
+        METRICS.observe(METRICS.key("api_request", {"route": route.canonical if route else "unmatched"}),
+                        time.perf_counter() - t0)
+
+def make_app():
+    app = web.Application(client_max_size=MAX_BODY, middlewares=[timing, errors] if METRICS_ENABLED else [errors])
+    app.router.add_post("/render", render)
+    app.router.add_post("/render/batch", render_batch)
+    app.router.add_get("/stages", stages)
+    app.router.add_get("/health", health)
+    if METRICS_ENABLED:
+        app.router.add_get("/metrics", metrics)
+    return app
+
+def _worker(host, port, reuse_port):
+    web.run_app(make_app(), host=host, port=port, reuse_port=reuse_port, access_log=None, print=None)
+
+def serve(host="127.0.0.1", port=8766, workers=1):
+    # Blocks. With workers > 1, supervises that many worker processes and
+    # stops them all on SIGINT / SIGTERM.
+    if workers <= 1:
+        _worker(host, port, False)
+        return
+    if not hasattr(os, "fork") or port == 0:
+        raise SystemExit("--workers needs a fixed --port and a platform with SO_REUSEPORT")
+    procs = [multiprocessing.Process(target=_worker, args=(host, port, True), daemon=True) for _ in range(workers)]
+    for p in procs:
+        p.start()
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        while all(p.is_alive() for p in procs):
+            procs[0].join(0.5)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            p.join(5)
+    if any(p.exitcode not in (0, -signal.SIGTERM, None) for p in procs):
+        raise SystemExit("a worker exited unexpectedly")
+
+# -------------------------------
+# CLI
+# -------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the style composers over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--workers", type=int, default=1, help="Processes sharing the port (0: one per CPU)")
+    args = parser.parse_args(argv)
+    workers = args.workers or os.cpu_count() or 1
+    print(f"Render API on http://{args.host}:{args.port} ({workers} worker{'s' if workers > 1 else ''}, "
+          f"default stage pack '{PACK.name}')", file=sys.stderr)
+    serve(args.host, args.port, workers)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
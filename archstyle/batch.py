@@ -0,0 +1,234 @@
+import argparse
+import itertools
+import json
+import math
+import multiprocessing as mp
+import os
+import random
+import sys
+import time
+from collections import deque
+
+from .stages import DEFAULT_STYLE_NAME
+from .stages import TABLE
+from .compose import render_style
+from .codec import pack, to_token
+
+# -------------------------------
+# Combination space
+# -------------------------------
+def slot_choices(slot):
+    # Every valid bitmask for a slot, smallest selections first.
+    bits = range(len(slot.options))
+    choices = []
+    for n in range(slot.min_selections, slot.max_selections + 1):
+        choices.extend(sum(1 << b for b in c) for c in itertools.combinations(bits, n))
+    return choices
+
+def build_axes(table=TABLE, require=None):
+    # One axis per slot: each plain stage, plus one per compound group.
+    require = require or {}
+    unknown = require.keys() - {slot.key for slot in table.slots}
+    if unknown:
+        raise ValueError(f"Unknown stage(s): {', '.join(sorted(unknown))} "
+                         f"(one of {', '.join(slot.key for slot in table.slots)})")
+    axes = []
+    for slot in table.slots:
+        choices = slot_choices(slot)
+        wanted = require.get(slot.key)
+        if wanted:
+            unknown = wanted - table.label_bits[slot.index].keys()
+            if unknown:
+                raise ValueError(f"Unknown option(s) for '{slot.key}': {', '.join(sorted(unknown))}")
+            need = sum(table.label_bits[slot.index][label] for label in wanted)
+            choices = [m for m in choices if m & need == need]
+        if not choices:
+            raise ValueError(f"No valid selections left for '{slot.key}': it takes "
+                             f"{slot.min_selections}-{slot.max_selections} option(s)")
+        axes.append(choices)
+    return axes
+
+class CombinationSpace:
+    def __init__(self, axes, table=TABLE):
+        self.axes = axes
+        self.table = table
+        self.total = math.prod(len(choices) for choices in axes)
+
+    def masks(self, index):
+        # Mixed-radix decode; the last axis varies fastest.
+        picks = []
+        for choices in reversed(self.axes):
+            index, r = divmod(index, len(choices))
+            picks.append(choices[r])
+        return tuple(reversed(picks))
+
+    def responses(self, index):
+        return self.table.decode(self.masks(index))
+
+# -- seeded shuffle --------------------------------------------------
+# A keyed bijection on [0, total): a four-round Feistel network over two
+# digits (radices a and b, a * b just above total) with a splitmix64 round
+# function. The few values that land in [total, a * b) are walked through
+# the network again until they fall inside. Position n maps to its index
+# directly, so a shuffled walk needs no table, can start anywhere and never
+# repeats.
+
+_MASK64 = (1 << 64) - 1
+
+class Permutation:
+    def __init__(self, total, seed):
+        self.total = total
+        self.a = math.isqrt(max(total - 1, 0)) + 1
+        self.b = -(-total // self.a)
+        rng = random.Random(seed)
+        self.keys = tuple(rng.getrandbits(64) for _ in range(4))
+
+    def __call__(self, n):
+        a, b, total = self.a, self.b, self.total
+        x = n
+        while True:
+            left, right = divmod(x, b)
+            width, other = a, b
+            for k in self.keys:
+                z = right ^ k
+                z = (z ^ (z >> 30)) * 0xBF58476D1CE4E5B9 & _MASK64
+                z = (z ^ (z >> 27)) * 0x94D049BB133111EB & _MASK64
+                left, right = right, (left + (z ^ (z >> 31))) % width
+                width, other = other, width
+            x = left * b + right
+            if x < total:
+                return x
+
+# -------------------------------
+# Rendering
+# -------------------------------
+_space = None
+_params = None
+
+def _init_worker(require, params):
+    global _space, _params
+    _space = CombinationSpace(build_axes(require=require))
+    _params = params
+
+def render_record(index, masks, style_name, world_name, notes):
+    record = {"index": index, "style": to_token(pack(masks)), "style_name": style_name,
+              "world_name": world_name, "responses": TABLE.decode(masks)}
+    record.update(render_style(masks, style_name, notes, world_name))
+    return record
+
+def render_chunk(start, stop):
+    style_name, world_name, notes, shuffle = _params
+    lines = []
+    for n in range(start, stop):
+        index = shuffle(n) if shuffle else n
+        record = render_record(index, _space.masks(index), style_name, world_name, notes)
+        lines.append(json.dumps(record, ensure_ascii=False))
+    return stop - start, "\n".join(lines) + "\n"
+
+def chunk_ranges(start, stop, size):
+    for lo in range(start, stop, size):
+        yield lo, min(lo + size, stop)
+
+def generate(out, require=None, style_name=DEFAULT_STYLE_NAME, world_name="", notes="",
+             start=0, limit=None, sample=None, seed=0, workers=None, chunk_size=512,
+             report=None, report_every=2.0):
+    space = CombinationSpace(build_axes(require=require))
+    shuffle = Permutation(space.total, seed) if sample is not None else None
+    count = sample if sample is not None else space.total - start
+    if limit is not None:
+        count = min(count, limit)
+    stop = start + max(0, min(count, space.total - start))
+    params = (style_name, world_name, notes, shuffle)
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    written = 0
+    t0 = last = time.perf_counter()
+
+    def emit(result):
+        nonlocal written, last
+        n, text = result
+        out.write(text)
+        written += n
+        now = time.perf_counter()
+        if report and now - last >= report_every:
+            last = now
+            report(written, stop - start, written / (now - t0))
+
+    ranges = chunk_ranges(start, stop, chunk_size)
+    if workers <= 1:
+        _init_worker(require, params)
+        for lo, hi in ranges:
+            emit(render_chunk(lo, hi))
+    else:
+        # Keep a bounded window of in-flight chunks so memory stays flat
+        # however large the space is; results are written in order.
+        with mp.Pool(workers, initializer=_init_worker, initargs=(require, params)) as pool:
+            pending = deque()
+            for lo, hi in ranges:
+                pending.append(pool.apply_async(render_chunk, (lo, hi)))
+                if len(pending) >= workers * 4:
+                    emit(pending.popleft().get())
+            while pending:
+                emit(pending.popleft().get())
+
+    elapsed = time.perf_counter() - t0
+    return written, elapsed
+
+# -------------------------------
+# CLI
+# -------------------------------
+def parse_require(items):
+    require = {}
+    for item in items or []:
+        key, _, label = item.partition("=")
+        if not label:
+            raise SystemExit(f"--require expects STAGE[.GROUP]=LABEL, got '{item}'")
+        require.setdefault(key.strip(), set()).add(label.strip())
+    return require
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stream manifestos, prompts and world outlines for every valid style as JSONL.")
+    parser.add_argument("-o", "--output", default="-", help="Output JSONL file (default: stdout)")
+    parser.add_argument("--require", action="append", metavar="STAGE[.GROUP]=LABEL",
+                        help="Only keep styles whose selection includes LABEL, e.g. composition='Radial Sanctum' or material.tone='Charcoal and Ash'")
+    parser.add_argument("--style-name", default=DEFAULT_STYLE_NAME)
+    parser.add_argument("--world-name", default="")
+    parser.add_argument("--notes", default="")
+    parser.add_argument("--start", type=int, default=0, help="First position in the (possibly shuffled) space")
+    parser.add_argument("--limit", type=int, help="Stop after this many records")
+    parser.add_argument("--sample", type=int, help="Emit N distinct styles in a seeded random order")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, help="Worker processes (default: CPU count, 1 = inline)")
+    parser.add_argument("--chunk-size", type=int, default=512)
+    parser.add_argument("--count", action="store_true", help="Print the size of the selection space and exit")
+    args = parser.parse_args(argv)
+
+    require = parse_require(args.require)
+    try:
+        space = CombinationSpace(build_axes(require=require))
+    except ValueError as e:
+        parser.error(str(e))
+    if args.count:
+        print(space.total)
+        return 0
+
+    def report(done, total, rate):
+        print(f"{done:,}/{total:,} records  {rate:,.0f} rec/s", file=sys.stderr)
+
+    out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    try:
+        written, elapsed = generate(out, require=require, style_name=args.style_name,
+                                    world_name=args.world_name, notes=args.notes,
+                                    start=args.start, limit=args.limit, sample=args.sample,
+                                    seed=args.seed, workers=args.workers,
+                                    chunk_size=args.chunk_size, report=report)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    rate = written / elapsed if elapsed else 0.0
+    print(f"Wrote {written:,} records in {elapsed:.2f}s ({rate:,.0f} rec/s)", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
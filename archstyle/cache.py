@@ -0,0 +1,76 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from .stages import TABLE
+from .codec import unpack
+from .compose import render_style
+
+# -------------------------------
+# Render cache
+# -------------------------------
+# One process-wide LRU of rendered artifacts. Streamlit imports this module
+# once per server, so every session shares it: identical styles render once.
+# Keys include the table's pack_id, as a code renders differently per pack,
+# and the selection order where it is not the options' own.
+
+def fingerprint(code, style_name, world_name, notes, pack_id=TABLE.pack_id, order=None):
+    key = [pack_id, code, style_name, world_name, notes]
+    if order:
+        key.append(sorted(order.items()))
+    canonical = json.dumps(key, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.blake2b(canonical.encode("utf-8"), digest_size=16).hexdigest()
+
+class RenderCache:
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, compute):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+            self.misses += 1
+        # Render outside the lock; a concurrent miss on the same key just
+        # renders twice and the second result wins.
+        value = compute()
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits,
+                    "misses": self.misses, "evictions": self.evictions,
+                    "hit_rate": self.hits / lookups if lookups else 0.0}
+
+RENDER_CACHE = RenderCache(int(os.environ.get("ARCHSTYLE_RENDER_CACHE_SIZE", "4096")))
+
+def render_cached(code, style_name, notes, world_name, cache=None, table=TABLE, order=None):
+    # Artifacts plus their UTF-8 download payloads; treat the result as read-only.
+    cache = RENDER_CACHE if cache is None else cache
+    def compute():
+        artifacts = render_style(unpack(code, table), style_name, notes, world_name, table, order)
+        artifacts["manifesto_bytes"] = artifacts["manifesto"].encode("utf-8")
+        artifacts["world_outline_bytes"] = artifacts["world_outline"].encode("utf-8")
+        return artifacts
+    return cache.get(fingerprint(code, style_name, world_name, notes, table.pack_id, order), compute)
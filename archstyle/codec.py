@@ -0,0 +1,154 @@
+import json
+
+from .stages import APP_TITLE
+from .stagepacks import loaded_pack
+from .stages import TABLE
+from .compose import render_prompts
+
+# -------------------------------
+# Compact style codes
+# -------------------------------
+# A style packs into one integer: the per-slot bitmasks laid end to end,
+# first slot in the highest bits (5 options x 8 slots = 40 bits today). The
+# shareable token is that integer in fixed-width Crockford base32, then a
+# dash and the table's pack_id, so a token read with another stage pack's
+# table is refused instead of decoding to a different style. Untagged
+# tokens (from before pack ids) are still read.
+
+ALPHABET = "0123456789abcdefghjkmnpqrstvwxyz"
+_DIGITS = {c: i for i, c in enumerate(ALPHABET)}
+_DIGITS.update({c.upper(): i for c, i in _DIGITS.items()})
+
+def code_bits(table=TABLE):
+    return sum(table.widths)
+
+def token_length(table=TABLE):
+    return -(-code_bits(table) // 5)
+
+def pack(masks, table=TABLE):
+    code = 0
+    for width, mask in zip(table.widths, masks):
+        if mask >> width:
+            raise ValueError(f"Mask {mask:#x} does not fit in {width} bits")
+        code = (code << width) | mask
+    return code
+
+def unpack(code, table=TABLE):
+    if code < 0 or code >> code_bits(table):
+        raise ValueError(f"Style code {code} is out of range")
+    masks = []
+    for width in reversed(table.widths):
+        masks.append(code & ((1 << width) - 1))
+        code >>= width
+    return tuple(reversed(masks))
+
+def with_slot(code, slot, mask, table=TABLE):
+    # Replace one slot's bits without unpacking the whole code.
+    widths = table.widths
+    width = widths[slot]
+    shift = sum(widths[slot + 1:])
+    return (code & ~(((1 << width) - 1) << shift)) | (mask << shift)
+
+def to_token(code, table=TABLE):
+    chars = []
+    for _ in range(token_length(table)):
+        code, r = divmod(code, 32)
+        chars.append(ALPHABET[r])
+    return "".join(reversed(chars)) + "-" + table.pack_id
+
+def check_pack(pack_id, table=TABLE):
+    if pack_id.lower() != table.pack_id:
+        raise ValueError(f"Style '{pack_id}' belongs to a different stage pack (this one is '{table.pack_id}')")
+
+def from_token(token, table=TABLE):
+    token = token.strip().replace("-", "")
+    length = token_length(table)
+    if len(token) == length + len(table.pack_id):
+        check_pack(token[length:], table)
+        token = token[:length]
+    if len(token) != length:
+        raise ValueError(f"Style code must be {length} characters, got '{token}'")
+    code = 0
+    for c in token:
+        if c not in _DIGITS:
+            raise ValueError(f"Invalid character '{c}' in style code '{token}'")
+        code = code * 32 + _DIGITS[c]
+    unpack(code, table)
+    return code
+
+def encode_responses(responses, table=TABLE):
+    return pack(table.encode(responses), table)
+
+def decode_responses(code, table=TABLE):
+    return table.decode(unpack(code, table))
+
+# -------------------------------
+# Presets
+# -------------------------------
+# Two on-disk forms are accepted:
+#   compact: {"style": "<token>", "style_name": ..., ...}
+#   full:    {"responses": {...}, "prompts": {...}, ...} (or stage ids at the top level)
+# Both carry "pack" (the table's pack_id) when written here; a preset whose
+# pack differs from the reading table's is refused. A full preset keeps the
+# order its selections were made in: read back, it carries "order" (see
+# OptionTable.picks) for the slots not listed in option order.
+
+PRESET_FIELDS = ("style_name", "world_name", "notes")
+
+def read_preset(data, table=TABLE):
+    # Normalize either preset form to {"code", "style_name", "world_name", "notes", "exported_at"};
+    # fields missing from the file are left out.
+    if not isinstance(data, dict):
+        raise ValueError("Preset must be a JSON object")
+    preset = {k: data[k] for k in PRESET_FIELDS + ("exported_at",) if isinstance(data.get(k), str)}
+    if data.get("pack") is not None:
+        check_pack(str(data["pack"]), table)
+    if data.get("style"):
+        preset["code"] = from_token(str(data["style"]), table)
+        return preset
+    responses = data.get("responses") or {}
+    stage_ids = [s["id"] for s in table.stages]
+    if not responses and all(k in data for k in stage_ids):
+        responses = {k: data[k] for k in stage_ids}
+    if not isinstance(responses, dict) or not responses:
+        raise ValueError("Preset has no 'style' code or 'responses'")
+    preset["code"] = encode_responses(responses, table)
+    order = table.picks(responses)[1]
+    if order:
+        preset["order"] = order
+    return preset
+
+def app_title(table=TABLE):
+    # The title of the pack the table belongs to (the default pack's for a
+    # table built outside stagepacks.load).
+    pack = loaded_pack(table.pack_id)
+    return pack.title if pack else APP_TITLE
+
+def compact_preset(code, style_name, world_name="", notes="", exported_at=None, table=TABLE):
+    payload = {"app_title": app_title(table), "pack": table.pack_id, "style": to_token(code, table),
+               "style_name": style_name, "world_name": world_name, "notes": notes}
+    if exported_at:
+        payload["exported_at"] = exported_at
+    return payload
+
+def expand_preset(code, style_name, world_name="", notes="", exported_at=None, table=TABLE, order=None):
+    # Today's full JSON layout, reproduced from the code (and selection order).
+    masks = unpack(code, table)
+    responses = table.decode(masks)
+    for slot, texts in (order or {}).items():
+        s = table.slots[slot]
+        if s.group_id:
+            responses[s.stage_id][s.group_id] = list(texts)
+        else:
+            responses[s.stage_id] = list(texts)
+    payload = {"app_title": app_title(table), "pack": table.pack_id, "style_name": style_name,
+               "world_name": world_name, "notes": notes, "responses": responses,
+               "prompts": render_prompts(masks, style_name, table, order)}
+    if exported_at:
+        payload["exported_at"] = exported_at
+    return payload
+
+def dumps_preset(payload, compact=True):
+    if compact:
+        return json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+    return json.dumps(payload, indent=2)
@@ -0,0 +1,124 @@
+import functools
+
+from .stages import TABLE
+from .table import short_label
+
+# -------------------------------
+# Composers
+# -------------------------------
+# The render_* functions take a style as a tuple of per-slot bitmasks (see
+# table.py) and only index precomputed joins of the table it was encoded
+# with; compose_* keep the original responses-dict API on top of them.
+# A style may carry an order ({slot: texts}, see OptionTable.picks) for
+# slots whose selections were made in another order than the options'
+# (or include text the table does not know); those render as given.
+
+@functools.lru_cache(maxsize=None)
+def _layout(table):
+    # (soul, heritage, form, texture, tone, light, ornament, composition,
+    # " + " joins, ", " joins) for one table.
+    slots = tuple(table.slot_index[k] for k in
+                  ("soul", "heritage", "form", "material.texture", "material.tone", "light", "ornament", "composition"))
+    return slots + (table.joined[" + "], table.joined[", "])
+
+def _ordered_layout(table, masks, order):
+    # _layout with the joins of the ordered slots replaced for this style.
+    layout = _layout(table)
+    if not order:
+        return layout
+    plus, comma = list(layout[-2]), list(layout[-1])
+    for slot, texts in order.items():
+        labels = [short_label(t) for t in texts]
+        plus[slot] = {masks[slot]: " + ".join(labels)}
+        comma[slot] = {masks[slot]: ", ".join(labels)}
+    return layout[:-2] + (plus, comma)
+
+def clean_label(s):
+    return short_label(s)
+
+def render_manifesto(masks, style_name, notes, world_name, table=TABLE, order=None):
+    _SOUL, _HERITAGE, _FORM, _TEXTURE, _TONE, _LIGHT, _ORNAMENT, _COMPOSITION, _PLUS, _COMMA = _ordered_layout(table, masks, order)
+    header = f"# {style_name}"
+    if world_name.strip():
+        header += f" — for **{world_name.strip()}**"
+
+    return f"""{header}
+
+**Soul / Ideology:** {_PLUS[_SOUL][masks[_SOUL]]}
+**Time / Heritage:** {_PLUS[_HERITAGE][masks[_HERITAGE]]}
+**Form / Gesture:** {_PLUS[_FORM][masks[_FORM]]}
+**Material / Flesh:** {_COMMA[_TEXTURE][masks[_TEXTURE]]}
+**Tone / Palette:** {_COMMA[_TONE][masks[_TONE]]}
+**Light / Emotion:** {_PLUS[_LIGHT][masks[_LIGHT]]}
+**Ornament / Voice:** {_PLUS[_ORNAMENT][masks[_ORNAMENT]]}
+**Composition / Signature:** {_PLUS[_COMPOSITION][masks[_COMPOSITION]]}
+
+---
+**Designer Notes:** {notes or "—"}
+"""
+
+def render_prompts(masks, style_name, table=TABLE, order=None):
+    _, _HERITAGE, _FORM, _TEXTURE, _TONE, _LIGHT, _ORNAMENT, _COMPOSITION, _, _COMMA = _ordered_layout(table, masks, order)
+    composition = _COMMA[_COMPOSITION][masks[_COMPOSITION]]
+    base = (f"{style_name} architecture, {_COMMA[_FORM][masks[_FORM]]}, "
+            f"materials: {_COMMA[_TEXTURE][masks[_TEXTURE]]}, palette: {_COMMA[_TONE][masks[_TONE]]}, "
+            f"light: {_COMMA[_LIGHT][masks[_LIGHT]]}, ornament: {_COMMA[_ORNAMENT][masks[_ORNAMENT]]}, "
+            f"heritage: {_COMMA[_HERITAGE][masks[_HERITAGE]]}")
+
+    return {
+        "Sacred Interior": f"interior sanctum, {base}, processional stillness, cinematic volumetric light, hyperreal detail",
+        "Façade & Approach": f"monumental façade along a {composition.lower()}, {base}, wide-angle perspective, serene and mathematical",
+        "Civic Plaza": f"civic plaza mixing temple and senate hall, {base}, atmospheric realism, human scale and cosmic order"
+    }
+
+def render_outline(masks, world_name, table=TABLE, order=None):
+    _SOUL, _HERITAGE, _FORM, _TEXTURE, _TONE, _LIGHT, _ORNAMENT, _COMPOSITION, _, _COMMA = _ordered_layout(table, masks, order)
+    name = world_name.strip() or "Unnamed World"
+    def pick(slot):
+        return _COMMA[slot][masks[slot]] or "—"
+
+    return f"""# World Outline — {name}
+
+## Essence
+- **Soul:** {pick(_SOUL)}
+- **Heritage:** {pick(_HERITAGE)}
+
+## Form & Light
+- **Form:** {pick(_FORM)}
+- **Light:** {pick(_LIGHT)}
+
+## Material Language
+- **Textures:** {pick(_TEXTURE)}
+- **Palette:** {pick(_TONE)}
+
+## Voice & Composition
+- **Ornament:** {pick(_ORNAMENT)}
+- **Composition:** {pick(_COMPOSITION)}
+
+## Sites to Sketch
+- [ ] Sacred interior (altar/chamber)
+- [ ] Façade + processional approach
+- [ ] Civic plaza / forum variant
+
+## Notes
+_Add references, locations, climate, patrons, time period, typologies…_"""
+
+def render_style(masks, style_name, notes, world_name, table=TABLE, order=None):
+    # All three artifacts from one encoded style.
+    return {
+        "manifesto": render_manifesto(masks, style_name, notes, world_name, table, order),
+        "prompts": render_prompts(masks, style_name, table, order),
+        "world_outline": render_outline(masks, world_name, table, order),
+    }
+
+def compose_manifesto(responses, style_name, notes, world_name, table=TABLE):
+    masks, order = table.picks(responses)
+    return render_manifesto(masks, style_name, notes, world_name, table, order)
+
+def compose_prompts(responses, style_name, table=TABLE):
+    masks, order = table.picks(responses)
+    return render_prompts(masks, style_name, table, order)
+
+def compose_world_outline(responses, world_name, table=TABLE):
+    masks, order = table.picks(responses)
+    return render_outline(masks, world_name, table, order)
@@ -0,0 +1,506 @@
+import argparse
+import asyncio
+import bisect
+import hashlib
+import json
+import math
+import mimetypes
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import deque, namedtuple
+
+import aiohttp
+
+from .stages import DEFAULT_STYLE_NAME, TABLE
+from .codec import unpack, to_token
+from .compose import render_prompts
+
+# -------------------------------
+# Image-generation dispatcher
+# -------------------------------
+# Sends the prompts of one style or of a whole batch to an HTTP image
+# backend: one JSON POST per prompt ({"prompt", "style", "title"} plus any
+# fixed params) over a single pooled session. A bounded queue feeds a fixed
+# number of workers, so a million-style batch is generated lazily; a token
+# bucket caps the request rate; 429/5xx answers and connection errors are
+# retried with jittered exponential backoff (or the server's Retry-After,
+# capped at the same maximum). Each finished job is appended to a JSONL
+# progress file, and a rerun with the same file skips every job already
+# done. Memory stays flat however long the batch: done jobs are remembered
+# as ranges of offsets, repeats within a run are caught in a window of
+# recent ids, and latencies go into a log-scale histogram.
+
+DEFAULT_CONCURRENCY = 8
+RECENT_JOBS = 65536  # ids kept to drop a job repeated within one run
+LATENCY_FLOOR = 1e-4  # seconds: upper bound of the first latency bucket
+LATENCY_GROWTH = 1.02  # each latency bucket 2% wider than the one before
+RETRY_STATUSES = frozenset({408, 425, 429, 500, 502, 503, 504})
+URL_ENV = "ARCHSTYLE_IMAGE_URL"
+TOKEN_ENV = "ARCHSTYLE_IMAGE_TOKEN"
+
+Job = namedtuple("Job", "id style title prompt")
+
+def _slug(text):
+    return re.sub(r"[^a-z0-9]+", "-", text.lower()).strip("-") or "prompt"
+
+def style_jobs(preset, titles=None, table=TABLE):
+    # One job per prompt. Ids depend only on the style code, the prompt
+    # title and the prompt text (which differs between packs), so the same
+    # prompt is never sent twice; they leave out the token's pack tag to
+    # stay valid for progress logs written before it.
+    token = to_token(preset["code"], table)
+    code = token.partition("-")[0]
+    prompts = render_prompts(unpack(preset["code"], table), preset.get("style_name") or DEFAULT_STYLE_NAME, table,
+                             preset.get("order"))
+    for title, prompt in prompts.items():
+        if titles and title not in titles:
+            continue
+        digest = hashlib.blake2b(prompt.encode("utf-8"), digest_size=4).hexdigest()
+        yield Job(f"{code}-{_slug(title)}-{digest}", token, title, prompt)
+
+def iter_jobs(presets, titles=None, table=TABLE):
+    for preset in presets:
+        yield from style_jobs(preset, titles, table)
+
+def library_jobs(presets, titles=None, table=TABLE):
+    # (offset, Job) pairs for library presets: the k jobs of preset id i sit
+    # at offsets i * k .. i * k + k - 1, so a resume finds them however the
+    # library changed in between. Walked oldest first (ascending ids), done
+    # jobs still merge into a few ranges.
+    per_style = 0
+    for preset in presets:
+        jobs = list(style_jobs(preset, titles, table))
+        per_style = per_style or len(jobs)
+        for k, job in enumerate(jobs):
+            yield preset["id"] * per_style + k, job
+
+class TokenBucket:
+    # rate requests per second on average, up to burst at once; rate 0 = unlimited.
+    def __init__(self, rate=0.0, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if not self.rate:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class OffsetRanges:
+    # Disjoint [start, stop) ranges of job offsets, merged as offsets are
+    # added. Jobs finish roughly in order, so a long run is a few ranges.
+    def __init__(self):
+        self.starts, self.stops = [], []
+
+    def __contains__(self, n):
+        i = bisect.bisect_right(self.starts, n) - 1
+        return i >= 0 and n < self.stops[i]
+
+    def __len__(self):
+        return len(self.starts)
+
+    def add(self, n):
+        i = bisect.bisect_right(self.starts, n) - 1
+        if i >= 0 and n < self.stops[i]:
+            return
+        left = i >= 0 and self.stops[i] == n
+        right = i + 1 < len(self.starts) and self.starts[i + 1] == n + 1
+        if left and right:
+            self.stops[i] = self.stops.pop(i + 1)
+            del self.starts[i + 1]
+        elif left:
+            self.stops[i] = n + 1
+        elif right:
+            self.starts[i + 1] = n
+        else:
+            self.starts.insert(i + 1, n)
+            self.stops.insert(i + 1, n + 1)
+
+class ProgressLog:
+    # Append-only JSONL of finished jobs. Each entry records its run and its
+    # offset n. For a plain job stream the run is the id of its first job
+    # and n the position in the stream, so a resume must be given the same
+    # jobs in the same order; a different batch with the same file starts
+    # afresh. Sources that can change between runs (the library) give each
+    # job a stable offset and name the run themselves (see library_jobs).
+    # Entries without an offset (older logs) are matched by id.
+    def __init__(self, path=None):
+        self.path = path
+        self.run = None
+        self.done = OffsetRanges()
+        self._runs = {}  # run -> OffsetRanges, until start() picks one
+        self._legacy = set()
+        self._fp = None
+        if not path:
+            return
+        line = b""
+        if os.path.exists(path):
+            with open(path, "rb") as fp:
+                for line in fp:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # a line cut short by a crash
+                    if entry.get("status") != "done":
+                        continue
+                    if "n" in entry:
+                        self._runs.setdefault(entry.get("run"), OffsetRanges()).add(entry["n"])
+                    else:
+                        self._legacy.add(entry["id"])
+        self._fp = open(path, "a", encoding="utf-8")
+        if line and not line.endswith(b"\n"):
+            self._fp.write("\n")
+
+    def start(self, run):
+        self.run = run
+        self.done = self._runs.get(run) or OffsetRanges()
+        self._runs = {}
+
+    def is_done(self, n, job_id):
+        return n in self.done or job_id in self._legacy
+
+    def record(self, n, entry):
+        if self._fp:
+            self._fp.write(json.dumps(dict(entry, run=self.run, n=n), ensure_ascii=False) + "\n")
+            self._fp.flush()
+
+    def close(self):
+        if self._fp:
+            self._fp.close()
+            self._fp = None
+
+class DispatchReport:
+    def __init__(self):
+        self.done = 0
+        self.failed = 0
+        self.skipped = 0
+        self.retries = 0
+        self.latencies = {}  # log-scale bucket -> requests (see LATENCY_GROWTH)
+        self.elapsed = 0.0
+
+    def observe(self, seconds):
+        b = max(0, math.ceil(math.log(max(seconds, LATENCY_FLOOR) / LATENCY_FLOOR, LATENCY_GROWTH)))
+        self.latencies[b] = self.latencies.get(b, 0) + 1
+
+    def percentile(self, p):
+        # The upper bound of the bucket holding the p-th percentile (within 2%).
+        total = sum(self.latencies.values())
+        if not total:
+            return 0.0
+        rank, seen = min(total, max(1, round(p / 100 * total))), 0
+        for b in sorted(self.latencies):
+            seen += self.latencies[b]
+            if seen >= rank:
+                return LATENCY_FLOOR * LATENCY_GROWTH ** b
+
+    @property
+    def throughput(self):
+        return self.done / self.elapsed if self.elapsed else 0.0
+
+    def summary(self):
+        p50, p90, p99 = (self.percentile(p) * 1000 for p in (50, 90, 99))
+        return (f"{self.done:,} done, {self.failed:,} failed, {self.skipped:,} already done, "
+                f"{self.retries:,} retries in {self.elapsed:.1f}s ({self.throughput:,.1f} images/s) | "
+                f"latency p50 {p50:.0f} ms, p90 {p90:.0f} ms, p99 {p99:.0f} ms")
+
+def _retry_after(headers):
+    try:
+        return max(0.0, float(headers.get("Retry-After", "")))
+    except ValueError:
+        return None
+
+class Dispatcher:
+    def __init__(self, url, concurrency=DEFAULT_CONCURRENCY, rate=0.0, burst=None, retries=4, backoff=0.5,
+                 max_backoff=30.0, timeout=120.0, headers=None, params=None, out_dir=None, progress=None):
+        self.url = url
+        self.concurrency = concurrency
+        self.rate, self.burst = rate, burst
+        self.retries = retries
+        self.backoff, self.max_backoff = backoff, max_backoff
+        self.timeout = timeout
+        self.headers = dict(headers or {})
+        self.params = dict(params or {})
+        self.out_dir = out_dir
+        self.progress = progress
+
+    def _delay(self, attempt):
+        # Full jitter: uniform in [0, backoff * 2^(attempt - 1)], capped.
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+
+    def _success(self, job, attempt, latency, content_type, data):
+        entry = {"id": job.id, "status": "done", "style": job.style, "title": job.title, "attempts": attempt,
+                 "latency_ms": round(latency * 1000, 1)}
+        if content_type.startswith("image/") and self.out_dir:
+            path = os.path.join(self.out_dir, job.id + (mimetypes.guess_extension(content_type) or ".img"))
+            with open(path, "wb") as fp:
+                fp.write(data)
+            entry["file"] = path
+        elif content_type == "application/json":
+            try:
+                entry["result"] = json.loads(data)
+            except ValueError:
+                pass
+        return entry
+
+    async def _send(self, session, job, bucket, report):
+        body = dict(self.params, prompt=job.prompt, style=job.style, title=job.title)
+        attempt = 0
+        while True:
+            attempt += 1
+            await bucket.acquire()
+            status = retry_after = None
+            t0 = time.perf_counter()
+            try:
+                async with session.post(self.url, json=body) as resp:
+                    data = await resp.read()
+                    status, content_type = resp.status, resp.content_type
+                    retry_after = _retry_after(resp.headers)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = f"{type(e).__name__}: {e}"
+            else:
+                latency = time.perf_counter() - t0
+                if status < 300:
+                    report.done += 1
+                    report.observe(latency)
+                    return self._success(job, attempt, latency, content_type, data)
+                error = f"HTTP {status}: {data[:200].decode('utf-8', 'replace')}"
+            if (status is not None and status not in RETRY_STATUSES) or attempt > self.retries:
+                report.failed += 1
+                return {"id": job.id, "status": "failed", "style": job.style, "title": job.title,
+                        "attempts": attempt, "error": error}
+            report.retries += 1
+            await asyncio.sleep(min(retry_after, self.max_backoff) if retry_after is not None
+                                else self._delay(attempt))
+
+    async def _worker(self, session, queue, bucket, log, report):
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            n, job = item
+            log.record(n, await self._send(session, job, bucket, report))
+
+    async def _produce(self, jobs, run, queue, log, report, workers):
+        recent, order = set(), deque()
+        if run is not None:
+            log.start(run)
+        for n, job in (jobs if run is not None else enumerate(jobs)):
+            if run is None and not n:
+                log.start(job.id)
+            if log.is_done(n, job.id) or job.id in recent:
+                report.skipped += 1
+                continue
+            recent.add(job.id)
+            order.append(job.id)
+            if len(order) > RECENT_JOBS:
+                recent.discard(order.popleft())
+            await queue.put((n, job))
+        for _ in range(workers):
+            await queue.put(None)
+
+    async def run(self, jobs, report=None, run=None):
+        # jobs: iterable of Job, consumed lazily; or, with run (a key naming
+        # the batch in the progress log), of (offset, Job) pairs with stable
+        # offsets. Returns the DispatchReport.
+        report = DispatchReport() if report is None else report
+        if self.out_dir:
+            os.makedirs(self.out_dir, exist_ok=True)
+        log = ProgressLog(self.progress)
+        bucket = TokenBucket(self.rate, self.burst)
+        queue = asyncio.Queue(self.concurrency * 2)
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        t0 = time.perf_counter()
+        try:
+            async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers=self.headers) as session:
+                workers = [asyncio.create_task(self._worker(session, queue, bucket, log, report))
+                           for _ in range(self.concurrency)]
+                producer = asyncio.create_task(self._produce(jobs, run, queue, log, report, len(workers)))
+                try:
+                    # Stops at the first task that raises (a worker that cannot
+                    # write the progress file or an image, a failing job
+                    # source), so the producer is never left waiting on a full
+                    # queue nobody drains.
+                    done, _ = await asyncio.wait([producer] + workers, return_when=asyncio.FIRST_EXCEPTION)
+                    for task in done:
+                        if task.exception():
+                            raise task.exception()
+                finally:
+                    for task in [producer] + workers:
+                        task.cancel()
+        finally:
+            log.close()
+            report.elapsed = time.perf_counter() - t0
+        return report
+
+def dispatch(jobs, url, **options):
+    # Blocking entry point: runs the dispatcher on a fresh event loop.
+    return asyncio.run(Dispatcher(url, **options).run(jobs))
+
+# -- background runs -------------------------------------------------
+# For the app: a dispatch on its own thread and event loop, registered
+# process-wide under a key (its progress file), so a page can start one,
+# return at once and poll its report. Starting a key that is still running
+# returns the running one; finished runs beyond BACKGROUND_KEEP are dropped.
+
+BACKGROUND_KEEP = 256
+
+class BackgroundDispatch:
+    def __init__(self, jobs, url, **options):
+        self.jobs = list(jobs)
+        self.report = DispatchReport()
+        self.error = None
+        self._thread = threading.Thread(target=self._run, args=(url, options), name="archstyle-dispatch",
+                                        daemon=True)
+
+    def _run(self, url, options):
+        try:
+            asyncio.run(Dispatcher(url, **options).run(self.jobs, self.report))
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    @property
+    def total(self):
+        return len(self.jobs)
+
+    @property
+    def finished(self):
+        r = self.report
+        return r.done + r.failed + r.skipped
+
+    @property
+    def running(self):
+        return self._thread.is_alive()
+
+_background = {}
+_background_lock = threading.Lock()
+
+def start_background(key, jobs, url, **options):
+    with _background_lock:
+        task = _background.get(key)
+        if task is None or not task.running:
+            if len(_background) >= BACKGROUND_KEEP:
+                for old in [k for k, t in _background.items() if not t.running]:
+                    del _background[old]
+            task = _background[key] = BackgroundDispatch(jobs, url, **options).start()
+    return task
+
+def background(key):
+    with _background_lock:
+        return _background.get(key)
+
+# -------------------------------
+# CLI
+# -------------------------------
+def _params(items):
+    params = {}
+    for item in items or []:
+        key, sep, value = item.partition("=")
+        if not sep:
+            raise SystemExit(f"--param expects KEY=VALUE, got '{item}'")
+        try:
+            params[key] = json.loads(value)
+        except ValueError:
+            params[key] = value
+    return params
+
+def main(argv=None):
+    from .batch import parse_require
+    from .codec import from_token
+    from .importer import ImportReport, iter_presets, validator
+    from .library import PresetLibrary, library_path
+    from .stagepacks import DEFAULT, load
+
+    parser = argparse.ArgumentParser(description="Send style prompts to an HTTP image-generation backend.")
+    parser.add_argument("files", nargs="*", help="Preset files (.json, .jsonl, .zip); default: the preset library")
+    parser.add_argument("--style", action="append", metavar="CODE", help="Style code(s) instead of files")
+    parser.add_argument("--style-name", default=DEFAULT_STYLE_NAME, help="Style name for --style codes")
+    parser.add_argument("--url", default=os.environ.get(URL_ENV), help=f"Backend endpoint (default: ${URL_ENV})")
+    parser.add_argument("--header", action="append", metavar="NAME: VALUE", default=[])
+    parser.add_argument("--param", action="append", metavar="KEY=VALUE",
+                        help="Extra JSON body field (VALUE parsed as JSON if it can be)")
+    parser.add_argument("--prompt", action="append", dest="titles", metavar="TITLE",
+                        help='Only these prompts, e.g. "Civic Plaza"')
+    parser.add_argument("-c", "--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--rate", type=float, default=0.0, help="Requests per second (0 = unlimited)")
+    parser.add_argument("--burst", type=float, help="Token bucket size (default: one second of --rate)")
+    parser.add_argument("--retries", type=int, default=4)
+    parser.add_argument("--timeout", type=float, default=120.0, help="Seconds per request")
+    parser.add_argument("--progress", default="dispatch.progress.jsonl", help="Resumable progress log")
+    parser.add_argument("--out", help="Directory for returned image files")
+    parser.add_argument("--pack", default=DEFAULT, help=f"Stage pack (default: {DEFAULT})")
+    parser.add_argument("--db", help="Library file (default: the pack's library)")
+    parser.add_argument("--require", action="append", metavar="STAGE[.GROUP]=LABEL")
+    parser.add_argument("--world-name", default="", help="Library world name prefix")
+    args = parser.parse_args(argv)
+    if not args.url:
+        parser.error(f"--url or ${URL_ENV} is required")
+
+    headers = {}
+    if os.environ.get(TOKEN_ENV):
+        headers["Authorization"] = f"Bearer {os.environ[TOKEN_ENV]}"
+    for item in args.header:
+        name, sep, value = item.partition(":")
+        if not sep:
+            raise SystemExit(f"--header expects 'NAME: VALUE', got '{item}'")
+        headers[name.strip()] = value.strip()
+
+    table = load(args.pack).table
+    library = run = None
+    report = ImportReport()
+    if args.style:
+        try:
+            presets = [{"code": from_token(s, table), "style_name": args.style_name} for s in args.style]
+        except ValueError as e:
+            raise SystemExit(str(e))
+    elif args.files:
+        def sources():
+            for path in args.files:
+                with open(path, "rb") as fp:
+                    yield path, fp
+        presets = iter_presets(sources(), report, validator(table))
+    else:
+        try:
+            library = PresetLibrary(args.db or library_path(args.pack), table)
+        except ValueError as e:
+            raise SystemExit(str(e))
+        presets = library.iter_matches(oldest_first=True, require=parse_require(args.require),
+                                       world_name=args.world_name)
+        run = f"library:{os.path.abspath(library.path)}:{table.pack_id}:{','.join(args.titles or ())}"
+
+    dispatcher = Dispatcher(args.url, args.concurrency, args.rate, args.burst, args.retries,
+                            timeout=args.timeout, headers=headers, params=_params(args.param),
+                            out_dir=args.out, progress=args.progress)
+    try:
+        jobs = iter_jobs(presets, args.titles, table) if run is None else library_jobs(presets, args.titles, table)
+        result = asyncio.run(dispatcher.run(jobs, run=run))
+    except KeyboardInterrupt:
+        raise SystemExit(f"Interrupted; rerun with --progress {args.progress} to resume")
+    finally:
+        if library:
+            library.close()
+    for e in report.errors:
+        print(f"{e.source}:{e.record}: {e.message}", file=sys.stderr)
+    print(result.summary(), file=sys.stderr)
+    return 1 if result.failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,242 @@
+import argparse
+import datetime as dt
+import re
+import struct
+import sys
+import tempfile
+import time
+import zlib
+
+from .stages import TABLE
+from .compose import render_style
+from .codec import unpack, to_token, compact_preset, dumps_preset
+
+# -------------------------------
+# Streaming zip export
+# -------------------------------
+# One archive holding, per style, a folder with the manifesto, the prompts,
+# the world outline and the compact preset. Styles are rendered and written
+# one at a time. The zip writer below never seeks (it can write to a pipe or
+# a socket) and spools its central directory to a temporary file, so memory
+# stays flat whether the archive holds one style or a million. zipfile
+# itself keeps a ZipInfo per member until close, which does not.
+
+SPOOL_BYTES = 4 * 1024 * 1024
+COPY_BYTES = 1024 * 1024
+_MAX32 = 0xFFFFFFFF
+_MAX16 = 0xFFFF
+
+class StreamingZip:
+    def __init__(self, fp, compresslevel=6):
+        self.fp = fp
+        self.compresslevel = compresslevel
+        self.offset = 0
+        self.count = 0
+        self._central = tempfile.SpooledTemporaryFile(SPOOL_BYTES)
+        self._central_size = 0
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _write(self, data):
+        self.fp.write(data)
+        self.offset += len(data)
+
+    def add(self, name, data, date_time=None):
+        # One member, compressed in memory (members are a few kB of text) so
+        # its sizes and CRC go straight into the local header.
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        name = name.encode("utf-8")
+        y, mo, d, h, mi, s = (date_time or dt.datetime.now().timetuple())[:6]
+        dostime = (h << 11) | (mi << 5) | (s // 2)
+        dosdate = ((max(y, 1980) - 1980) << 9) | (mo << 5) | d
+        packer = zlib.compressobj(self.compresslevel, zlib.DEFLATED, -15)
+        body = packer.compress(data) + packer.flush()
+        crc = zlib.crc32(data)
+        header_offset = self.offset
+        self._write(struct.pack("<IHHHHHIIIHH", 0x04034B50, 20, 0x800, 8, dostime, dosdate,
+                                crc, len(body), len(data), len(name), 0) + name)
+        self._write(body)
+
+        extra = b""
+        if header_offset > _MAX32:
+            extra = struct.pack("<HHQ", 0x0001, 8, header_offset)
+        record = struct.pack("<IHHHHHHIIIHHHHHII", 0x02014B50, (3 << 8) | 45, 45 if extra else 20, 0x800, 8,
+                             dostime, dosdate, crc, len(body), len(data), len(name), len(extra), 0, 0, 0,
+                             0o100644 << 16, min(header_offset, _MAX32)) + name + extra
+        self._central.write(record)
+        self._central_size += len(record)
+        self.count += 1
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        start = self.offset
+        self._central.seek(0)
+        while True:
+            chunk = self._central.read(COPY_BYTES)
+            if not chunk:
+                break
+            self._write(chunk)
+        self._central.close()
+        size = self._central_size
+        if self.count > _MAX16 or start > _MAX32 or size > _MAX32:
+            end64 = self.offset
+            self._write(struct.pack("<IQHHIIQQQQ", 0x06064B50, 44, 45, 45, 0, 0,
+                                    self.count, self.count, size, start))
+            self._write(struct.pack("<IIQI", 0x07064B50, 0, end64, 1))
+        self._write(struct.pack("<IHHHHIIH", 0x06054B50, 0, 0, min(self.count, _MAX16), min(self.count, _MAX16),
+                                min(size, _MAX32), min(start, _MAX32), 0))
+        if hasattr(self.fp, "flush"):
+            self.fp.flush()
+
+# -- artifacts -------------------------------------------------------
+
+def folder_name(preset, used=None, table=TABLE):
+    # Readable and unique within one archive: "<world or style>_<style code>".
+    base = (preset.get("world_name") or preset.get("style_name") or "style").strip()
+    base = re.sub(r"[^\w\-]+", "_", base).strip("_")[:60] or "style"
+    name = f"{base}_{to_token(preset['code'], table)}"
+    if used is not None:
+        n = used.get(name, 0)
+        used[name] = n + 1
+        if n:
+            name = f"{name}-{n + 1}"
+    return name
+
+def prompts_markdown(prompts, style_name):
+    lines = [f"# AI Image Prompts — {style_name}", ""]
+    for title, prompt in prompts.items():
+        lines += [f"## {title}", "", prompt, ""]
+    return "\n".join(lines)
+
+def style_members(preset, folder, table=TABLE):
+    style_name = preset.get("style_name", "")
+    world_name = preset.get("world_name", "")
+    notes = preset.get("notes", "")
+    artifacts = render_style(unpack(preset["code"], table), style_name, notes, world_name, table, preset.get("order"))
+    payload = compact_preset(preset["code"], style_name, world_name, notes, preset.get("exported_at"), table)
+    return [
+        (f"{folder}/manifesto.md", artifacts["manifesto"]),
+        (f"{folder}/prompts.md", prompts_markdown(artifacts["prompts"], style_name)),
+        (f"{folder}/world_outline.md", artifacts["world_outline"]),
+        (f"{folder}/preset.json", dumps_preset(payload, compact=False)),
+    ]
+
+def write_archive(presets, fp, compresslevel=6, table=TABLE):
+    # presets: iterable of read_preset-style dicts, consumed lazily.
+    # Returns the number of styles written.
+    used = {}
+    styles = 0
+    now = dt.datetime.now().timetuple()
+    with StreamingZip(fp, compresslevel) as archive:
+        for preset in presets:
+            for name, text in style_members(preset, folder_name(preset, used, table), table):
+                archive.add(name, text, now)
+            styles += 1
+    return styles
+
+class _Chunks:
+    def __init__(self):
+        self.parts = []
+        self.size = 0
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.size += len(data)
+
+    def take(self):
+        data = b"".join(self.parts)
+        self.parts = []
+        self.size = 0
+        return data
+
+def iter_archive(presets, compresslevel=6, chunk_bytes=COPY_BYTES, table=TABLE):
+    # The same archive as a generator of byte chunks, for streaming responses.
+    sink = _Chunks()
+    used = {}
+    now = dt.datetime.now().timetuple()
+    archive = StreamingZip(sink, compresslevel)
+    for preset in presets:
+        for name, text in style_members(preset, folder_name(preset, used, table), table):
+            archive.add(name, text, now)
+        if sink.size >= chunk_bytes:
+            yield sink.take()
+    archive.close()
+    yield sink.take()
+
+def spool_archive(presets, compresslevel=6, table=TABLE):
+    # The archive as bytes, for st.download_button (its deferred data must
+    # be bytes or a BytesIO, not a spooled file). Written through a temporary
+    # file (in memory up to SPOOL_BYTES, then on disk) and read back once.
+    with tempfile.SpooledTemporaryFile(SPOOL_BYTES) as out:
+        write_archive(presets, out, compresslevel, table)
+        out.seek(0)
+        return out.read()
+
+# -------------------------------
+# CLI
+# -------------------------------
+def main(argv=None):
+    from .batch import parse_require
+    from .importer import ImportReport, iter_presets, validator
+    from .library import PresetLibrary, library_path
+    from .stagepacks import DEFAULT, load
+
+    parser = argparse.ArgumentParser(description="Export manifestos, prompts, outlines and presets as one zip archive.")
+    parser.add_argument("files", nargs="*", help="Preset files (.json, .jsonl, .zip); default: the preset library")
+    parser.add_argument("-o", "--output", default="-", help="Output zip (default: stdout)")
+    parser.add_argument("--pack", default=DEFAULT, help=f"Stage pack (default: {DEFAULT})")
+    parser.add_argument("--db", help="Library file (default: the pack's library)")
+    parser.add_argument("--require", action="append", metavar="STAGE[.GROUP]=LABEL",
+                        help="Only library presets whose selection includes LABEL")
+    parser.add_argument("--style-name", default="", help="Library style name prefix")
+    parser.add_argument("--world-name", default="", help="Library world name prefix")
+    parser.add_argument("--since", help="Exported on or after (YYYY-MM-DD or timestamp)")
+    parser.add_argument("--until", help="Exported on or before (YYYY-MM-DD or timestamp)")
+    parser.add_argument("--compresslevel", type=int, default=6)
+    args = parser.parse_args(argv)
+
+    table = load(args.pack).table
+    library = None
+    report = ImportReport()
+    if args.files:
+        def sources():
+            for path in args.files:
+                with open(path, "rb") as fp:
+                    yield path, fp
+        presets = iter_presets(sources(), report, validator(table))
+    else:
+        try:
+            library = PresetLibrary(args.db or library_path(args.pack), table)
+        except ValueError as e:
+            raise SystemExit(str(e))
+        presets = library.iter_matches(require=parse_require(args.require), style_name=args.style_name,
+                                       world_name=args.world_name, since=args.since, until=args.until)
+
+    out = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    t0 = time.perf_counter()
+    try:
+        styles = write_archive(presets, out, args.compresslevel, table)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+        if library:
+            library.close()
+    elapsed = time.perf_counter() - t0
+    for e in report.errors:
+        print(f"{e.source}:{e.record}: {e.message}", file=sys.stderr)
+    print(f"Exported {styles:,} styles in {elapsed:.2f}s ({styles / elapsed if elapsed else 0:,.0f} styles/s)",
+          file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+import argparse
+import asyncio
+import base64
+import hashlib
+import random
+import sys
+
+from aiohttp import web
+
+# -------------------------------
+# Stub image backend
+# -------------------------------
+# A local stand-in for an image-generation API, for trying and benchmarking
+# the dispatcher: POST /generate with {"prompt": ...} answers after a
+# simulated render delay with a JSON job record (or, with --png, a 1x1
+# PNG). A share of requests can be answered 429 (with Retry-After) or 503
+# to exercise retries. GET /stats reports what it has seen.
+
+PNG = base64.b64decode("iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR4nGNgYGD4DwABBAEAwS2OUAAAAABJRU5ErkJggg==")
+
+def make_app(latency=0.05, jitter=0.01, fail_rate=0.0, throttle_rate=0.0, retry_after=0, png=False, seed=None):
+    rng = random.Random(seed)
+    stats = {"requests": 0, "ok": 0, "failed": 0, "throttled": 0, "bad": 0}
+
+    async def generate(request):
+        stats["requests"] += 1
+        try:
+            body = await request.json()
+            prompt = str(body["prompt"])
+        except (ValueError, KeyError, TypeError):
+            stats["bad"] += 1
+            return web.json_response({"error": "expected a JSON object with 'prompt'"}, status=400)
+        await asyncio.sleep(max(0.0, rng.gauss(latency, jitter)))
+        roll = rng.random()
+        if roll < throttle_rate:
+            stats["throttled"] += 1
+            return web.json_response({"error": "rate limited"}, status=429, headers={"Retry-After": str(retry_after)})
+        if roll < throttle_rate + fail_rate:
+            stats["failed"] += 1
+            return web.json_response({"error": "backend unavailable"}, status=503)
+        stats["ok"] += 1
+        if png:
+            return web.Response(body=PNG, content_type="image/png")
+        image_id = hashlib.blake2b(prompt.encode("utf-8"), digest_size=8).hexdigest()
+        return web.json_response({"id": image_id, "url": f"/images/{image_id}.png", "prompt": prompt})
+
+    async def get_stats(request):
+        return web.json_response(stats)
+
+    app = web.Application()
+    app["stats"] = stats
+    app.router.add_post("/generate", generate)
+    app.router.add_get("/stats", get_stats)
+    return app
+
+async def start(host="127.0.0.1", port=0, **options):
+    # Serves on the running loop. Returns (runner, url); port 0 picks a free port.
+    runner = web.AppRunner(make_app(**options), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    return runner, f"http://{host}:{port}/generate"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a local stub image-generation backend.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="Mean simulated render time")
+    parser.add_argument("--jitter-ms", type=float, default=10.0)
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Share of requests answered 503")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of requests answered 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with 429")
+    parser.add_argument("--png", action="store_true", help="Answer with an image instead of JSON")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args(argv)
+    app = make_app(args.latency_ms / 1000, args.jitter_ms / 1000, args.fail_rate, args.throttle_rate,
+                   args.retry_after, args.png, args.seed)
+    print(f"Stub image backend on http://{args.host}:{args.port}/generate", file=sys.stderr)
+    web.run_app(app, host=args.host, port=args.port, print=None, access_log=None)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,318 @@
+import csv
+import functools
+import io
+import json
+import os
+import zipfile
+from collections import namedtuple
+
+from .stages import TABLE
+from .codec import PRESET_FIELDS, _DIGITS, code_bits, token_length, from_token
+
+# -------------------------------
+# Bulk preset import
+# -------------------------------
+# Presets arrive as any mix of .json files (one preset, or a list of them),
+# newline-delimited .jsonl / .ndjson files, and .zip archives of either.
+# Sources are read as streams: JSONL one line at a time and zip members one
+# member at a time, so memory stays bounded by the largest single document.
+# Every record is validated strictly against the option table and either
+# becomes a normalized preset (see codec.read_preset) or an error row.
+
+JSONL_SUFFIXES = (".jsonl", ".ndjson")
+JSONL_BATCH = 1024
+MAX_DOCUMENT_BYTES = 8 * 1024 * 1024
+MAX_ERRORS = 10000
+CHUNK_BITS = 12
+
+RecordError = namedtuple("RecordError", "source record message")
+
+class PresetValidator:
+    # Per slot: where its selections live in a responses dict, its option
+    # text -> bit map and its selection limits, computed once per table.
+    def __init__(self, table=TABLE):
+        self.table = table
+        self.stage_ids = [s["id"] for s in table.stages]
+        self.specs = [(s.stage_id, s.group_id, s.key, table.text_bits[s.index], s.min_selections, s.max_selections)
+                      for s in table.slots]
+        # The same limits as (key, shift, width mask, lo, hi) over a packed code.
+        self.fields = []
+        self.bits = shift = code_bits(table)
+        self.token_length = token_length(table)
+        self.token_tag = "-" + table.pack_id
+        for s, width in zip(table.slots, table.widths):
+            shift -= width
+            self.fields.append((s.key, shift, (1 << width) - 1, s.min_selections, s.max_selections))
+        # Neighbouring slots grouped into chunks of up to CHUNK_BITS bits, each
+        # with a lookup of which chunk values keep every slot in its limits,
+        # so a valid code is checked in a few indexing operations.
+        self.chunks = []
+        group = []
+        for field in self.fields + [None]:
+            width = field and field[2].bit_length()
+            if group and (field is None or sum(f[2].bit_length() for f in group) + width > CHUNK_BITS):
+                low = group[-1][1]
+                bits = group[0][1] + group[0][2].bit_length() - low
+                ok = bytearray(1 << bits)
+                for value in range(1 << bits):
+                    ok[value] = all(lo <= ((value << low >> sh) & wm).bit_count() <= hi
+                                    for _, sh, wm, lo, hi in group)
+                self.chunks.append((low, (1 << bits) - 1, bytes(ok)))
+                group = []
+            if field:
+                group.append(field)
+
+    def validate(self, data):
+        # Returns (preset, errors); preset is None whenever errors is non-empty.
+        if not isinstance(data, dict):
+            return None, ["preset must be a JSON object"]
+        errors = []
+        preset = {}
+        for k in PRESET_FIELDS + ("exported_at",):
+            v = data.get(k)
+            if v is None:
+                continue
+            if isinstance(v, str):
+                preset[k] = v
+            else:
+                errors.append(f"{k}: expected a string")
+        pack_id = data.get("pack")
+        if pack_id is not None and pack_id != self.table.pack_id:
+            return None, errors + [f"pack: preset is for stage pack '{pack_id}', not '{self.table.pack_id}'"]
+
+        token = data.get("style")
+        if token:
+            code = self._decode_token(token)
+            if code is None:
+                # Slow path: separators and whitespace, or an error message.
+                try:
+                    code = from_token(str(token), self.table)
+                except ValueError as e:
+                    return None, errors + [str(e)]
+            for shift, width_mask, ok in self.chunks:
+                if not ok[(code >> shift) & width_mask]:
+                    self._count_errors(code, errors)
+                    break
+        else:
+            responses = data.get("responses")
+            if not responses and all(k in data for k in self.stage_ids):
+                responses = data
+            if not isinstance(responses, dict) or not responses:
+                return None, errors + ["preset has no 'style' code or 'responses'"]
+            order = {}
+            code = self._encode(responses, errors, order)
+            if order:
+                preset["order"] = order
+
+        if errors:
+            return None, errors
+        preset["code"] = code
+        return preset, errors
+
+    def _count_errors(self, code, errors):
+        for key, shift, width_mask, lo, hi in self.fields:
+            n = ((code >> shift) & width_mask).bit_count()
+            if n < lo or n > hi:
+                errors.append(_count_error(key, n, lo, hi))
+
+    def _decode_token(self, token):
+        # codec.from_token without the exceptions, for "<code>-<pack_id>" and
+        # untagged tokens; None if invalid.
+        if not isinstance(token, str):
+            return None
+        if len(token) != self.token_length:
+            if len(token) != self.token_length + len(self.token_tag) or not token.endswith(self.token_tag):
+                return None
+            token = token[:self.token_length]
+        digits = _DIGITS
+        code = 0
+        for c in token:
+            d = digits.get(c)
+            if d is None:
+                return None
+            code = code * 32 + d
+        return None if code >> self.bits else code
+
+    def _encode(self, responses, errors, order):
+        # Also fills order as OptionTable.picks does.
+        code = 0
+        for slot, (stage_id, group_id, key, bits, lo, hi) in enumerate(self.specs):
+            value = responses.get(stage_id)
+            if group_id:
+                value = value.get(group_id) if isinstance(value, dict) else None
+            code <<= len(bits)
+            if value is None:
+                errors.append(f"{key}: missing")
+                continue
+            if isinstance(value, str):
+                value = [value]
+            elif not isinstance(value, list):
+                errors.append(f"{key}: expected a list of options")
+                continue
+            mask = 0
+            for text in value:
+                bit = bits.get(text) if isinstance(text, str) else None
+                if bit is None:
+                    errors.append(f"{key}: unknown option {text!r}")
+                elif mask & bit:
+                    errors.append(f"{key}: duplicate option {text!r}")
+                else:
+                    if bit < mask:
+                        order[slot] = tuple(value)
+                    mask |= bit
+            n = mask.bit_count()
+            if n < lo or n > hi:
+                errors.append(_count_error(key, n, lo, hi))
+            code |= mask
+        return code
+
+def _count_error(key, n, lo, hi):
+    expected = str(lo) if lo == hi else f"{lo}-{hi}"
+    return f"{key}: {n} selected, expected {expected}"
+
+@functools.lru_cache(maxsize=None)
+def validator(table):
+    return PresetValidator(table)
+
+VALIDATOR = validator(TABLE)
+
+# -- readers ---------------------------------------------------------
+# Each yields (source, record number, parsed value or None, error or None).
+
+def iter_records(name, fp):
+    suffix = os.path.splitext(name)[1].lower()
+    if suffix == ".zip":
+        yield from _iter_zip(name, fp)
+    elif suffix in JSONL_SUFFIXES:
+        yield from _iter_jsonl(name, fp)
+    elif suffix == ".json":
+        yield from _iter_json(name, fp)
+    else:
+        yield name, 0, None, f"unsupported file type '{suffix or name}'"
+
+def _iter_zip(name, fp):
+    try:
+        archive = zipfile.ZipFile(fp)
+    except zipfile.BadZipFile as e:
+        yield name, 0, None, f"not a zip archive: {e}"
+        return
+    with archive:
+        for info in archive.infolist():
+            if info.is_dir() or os.path.basename(info.filename).startswith((".", "__MACOSX")):
+                continue
+            member = f"{name}/{info.filename}"
+            if os.path.splitext(info.filename)[1].lower() not in JSONL_SUFFIXES + (".json", ".zip"):
+                yield member, 0, None, "unsupported file type"
+                continue
+            with archive.open(info) as stream:
+                yield from iter_records(member, stream)
+
+def _iter_jsonl(name, fp):
+    # Each line goes straight to the JSON scanner (a fraction of a json.loads
+    # call), and its value is taken only if it starts at the line's first
+    # character and is followed by nothing but whitespace, so one value can
+    # never span two lines or one line hold two. A batch with any other line
+    # is re-parsed with json.loads to pin down the bad records.
+    text = io.TextIOWrapper(fp, encoding="utf-8", errors="replace")
+    try:
+        batch = []
+        for n, line in enumerate(text, 1):
+            if line.strip():
+                batch.append((n, line))
+                if len(batch) == JSONL_BATCH:
+                    yield from _parse_batch(name, batch)
+                    batch = []
+        yield from _parse_batch(name, batch)
+    finally:
+        text.detach()
+
+_scan = json.JSONDecoder().scan_once
+
+def _parse_batch(name, batch):
+    if not batch:
+        return
+    values = []
+    try:
+        for _, line in batch:
+            value, end = _scan(line, len(line) - len(line.lstrip()))
+            if line[end:].strip():
+                break
+            values.append(value)
+    except (ValueError, StopIteration):
+        pass
+    if len(values) == len(batch):
+        for (n, _), value in zip(batch, values):
+            yield name, n, value, None
+        return
+    for n, line in batch:
+        try:
+            yield name, n, json.loads(line), None
+        except ValueError as e:
+            yield name, n, None, f"invalid JSON: {e}"
+
+def _iter_json(name, fp):
+    raw = fp.read(MAX_DOCUMENT_BYTES + 1)
+    if len(raw) > MAX_DOCUMENT_BYTES:
+        yield name, 0, None, f"larger than {MAX_DOCUMENT_BYTES // (1024 * 1024)} MB; use JSONL for large batches"
+        return
+    try:
+        data = json.loads(raw)
+    except ValueError as e:
+        yield name, 0, None, f"invalid JSON: {e}"
+        return
+    if isinstance(data, list):
+        for n, item in enumerate(data, 1):
+            yield name, n, item, None
+    else:
+        yield name, 1, data, None
+
+# -- import ----------------------------------------------------------
+
+class ImportReport:
+    def __init__(self, max_errors=MAX_ERRORS):
+        self.max_errors = max_errors
+        self.total = 0
+        self.valid = 0
+        self.rejected = 0
+        self.errors = []
+        self.errors_dropped = 0
+
+    def reject(self, source, record, message):
+        self.rejected += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append(RecordError(source, record, message))
+        else:
+            self.errors_dropped += 1
+
+    def summary(self):
+        return f"{self.valid:,} of {self.total:,} presets valid, {self.rejected:,} rejected"
+
+def iter_presets(sources, report=None, validator=VALIDATOR):
+    # sources: iterable of (name, binary file object). Yields valid presets
+    # in input order; rejected records are counted into report.
+    report = ImportReport() if report is None else report
+    validate = validator.validate
+    for name, fp in sources:
+        for source, n, data, error in iter_records(name, fp):
+            if error is None:
+                preset, errors = validate(data)
+                if preset is not None:
+                    report.total += 1
+                    report.valid += 1
+                    yield preset
+                    continue
+                error = "; ".join(errors)
+            report.total += 1
+            report.reject(source, n, error)
+
+def import_presets(sources, validator=VALIDATOR, max_errors=MAX_ERRORS):
+    report = ImportReport(max_errors)
+    presets = list(iter_presets(sources, report, validator))
+    return presets, report
+
+def errors_csv(report):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(RecordError._fields)
+    writer.writerows(report.errors)
+    return out.getvalue()
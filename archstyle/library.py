@@ -0,0 +1,403 @@
+import argparse
+import datetime as dt
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+from .stages import TABLE
+from .stagepacks import DEFAULT, load
+from .codec import code_bits, compact_preset, dumps_preset
+
+# -------------------------------
+# Preset library
+# -------------------------------
+# Presets stored in one local SQLite file. Each preset row keeps its packed
+# style code; preset_options holds one (option, preset) row per selected
+# option, keyed option-first, so every stage option has its own index into
+# the presets that use it. A query walks the posting list of its rarest
+# requested option and checks the remaining options against the code's bits.
+
+# Style codes are only meaningful within one stage pack, so every pack but
+# "default" keeps its own file, and a library records the pack_id of the
+# table it was created with and refuses to open with any other.
+# Libraries live in the data directory (ARCHSTYLE_DATA_DIR, default data/
+# next to app.py), never relative to the working directory, so the app and
+# the CLIs find the same file wherever they are started from.
+DATA_DIR = os.environ.get("ARCHSTYLE_DATA_DIR") or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+LIBRARY_PATH = os.environ.get("ARCHSTYLE_LIBRARY") or os.path.join(DATA_DIR, "presets.db")
+BATCH_SIZE = 5000
+CACHE_KB = 64 * 1024
+MAX_ID = (1 << 63) - 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS options (
+    id INTEGER PRIMARY KEY,
+    slot TEXT NOT NULL,
+    label TEXT NOT NULL,
+    text TEXT NOT NULL,
+    preset_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS presets (
+    id INTEGER PRIMARY KEY,
+    code INTEGER NOT NULL,
+    style_name TEXT NOT NULL DEFAULT '' COLLATE NOCASE,
+    world_name TEXT NOT NULL DEFAULT '' COLLATE NOCASE,
+    notes TEXT NOT NULL DEFAULT '',
+    exported_at TEXT,
+    added_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS preset_options (
+    option_id INTEGER NOT NULL REFERENCES options(id),
+    preset_id INTEGER NOT NULL REFERENCES presets(id) ON DELETE CASCADE,
+    PRIMARY KEY (option_id, preset_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS presets_style_name ON presets(style_name);
+CREATE INDEX IF NOT EXISTS presets_world_name ON presets(world_name);
+CREATE INDEX IF NOT EXISTS presets_exported_at ON presets(exported_at);
+"""
+
+COLUMNS = "p.id, p.code, p.style_name, p.world_name, p.notes, p.exported_at"
+
+_APP_STAMP = re.compile(r"(\d{4})(\d\d)(\d\d)_(\d\d)(\d\d)(\d\d)")
+_ISO_STAMP = re.compile(r"\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d")
+
+def normalize_timestamp(value):
+    # The app stamps exports as YYYYmmdd_HHMMSS; store ISO so ranges compare as text.
+    if not value:
+        return None
+    m = _APP_STAMP.fullmatch(value)
+    if m:
+        return "{}-{}-{}T{}:{}:{}".format(*m.groups())
+    if _ISO_STAMP.fullmatch(value):
+        return value
+    for fmt in ("%Y%m%d_%H%M%S", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d"):
+        try:
+            return dt.datetime.strptime(value[:19], fmt).strftime("%Y-%m-%dT%H:%M:%S")
+        except ValueError:
+            continue
+    return None
+
+def library_path(pack_name=DEFAULT):
+    if pack_name == "default":
+        return LIBRARY_PATH
+    root, ext = os.path.splitext(LIBRARY_PATH)
+    return f"{root}.{pack_name}{ext}"
+
+DEFAULT_PATH = library_path()
+
+def _like_prefix(text):
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+class PresetLibrary:
+    def __init__(self, path=DEFAULT_PATH, table=TABLE):
+        self.path = path
+        self.table = table
+        self._lock = threading.Lock()
+        self.writes = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.execute(f"PRAGMA cache_size=-{CACHE_KB}")
+        self._conn.executescript(SCHEMA)
+        self._conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('pack', ?)", (table.pack_id,))
+        stored = self._conn.execute("SELECT value FROM meta WHERE key = 'pack'").fetchone()[0]
+        if stored != table.pack_id:
+            self._conn.close()
+            raise ValueError(f"{path} holds presets of stage pack '{stored}', not '{table.pack_id}'")
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO options (id, slot, label, text) VALUES (?, ?, ?, ?)",
+            [(o.id, table.slots[o.slot].key, o.label, o.text) for o in table.options])
+
+        # Per slot: (shift, width mask, option ids for every mask value).
+        self._slots = []
+        shift = code_bits(table)
+        for s, width in zip(table.slots, table.widths):
+            shift -= width
+            ids = [[table.options[i].id for i in s.options if mask & table.options[i].bit]
+                   for mask in range(1 << width)]
+            self._slots.append((shift, (1 << width) - 1, ids))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # -- writes -----------------------------------------------------
+    def add(self, presets, batch_size=BATCH_SIZE):
+        # presets: iterable of read_preset-style dicts; consumed lazily and
+        # written batch_size at a time, one transaction per batch.
+        added = 0
+        batch = []
+        for preset in presets:
+            batch.append(preset)
+            if len(batch) >= batch_size:
+                added += self._add_batch(batch)
+                batch = []
+        if batch:
+            added += self._add_batch(batch)
+        return added
+
+    def _add_batch(self, batch):
+        now = dt.datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Ids are never reused, so a derived copy (the similar-styles
+                # index) can tell new presets from replaced ones.
+                next_id = conn.execute("SELECT MAX(COALESCE((SELECT MAX(id) FROM presets), 0), "
+                                       "COALESCE((SELECT value FROM meta WHERE key = 'last_id'), 0)) + 1").fetchone()[0]
+                rows, postings, counts = [], [], {}
+                for pid, p in enumerate(batch, next_id):
+                    code = p["code"]
+                    rows.append((pid, code, p.get("style_name", ""), p.get("world_name", ""), p.get("notes", ""),
+                                 normalize_timestamp(p.get("exported_at")), now))
+                    for shift, width_mask, ids in self._slots:
+                        for oid in ids[(code >> shift) & width_mask]:
+                            postings.append((oid, pid))
+                            counts[oid] = counts.get(oid, 0) + 1
+                conn.executemany("INSERT INTO presets (id, code, style_name, world_name, notes, exported_at, added_at) "
+                                 "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+                conn.executemany("INSERT INTO preset_options (option_id, preset_id) VALUES (?, ?)", postings)
+                conn.executemany("UPDATE options SET preset_count = preset_count + ? WHERE id = ?",
+                                 [(n, oid) for oid, n in counts.items()])
+                conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('last_id', ?)",
+                             (next_id + len(batch) - 1,))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            self.writes += 1
+        return len(batch)
+
+    def delete(self, preset_id):
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("UPDATE options SET preset_count = preset_count - 1 WHERE id IN "
+                             "(SELECT option_id FROM preset_options WHERE preset_id = ?)", (preset_id,))
+                deleted = conn.execute("DELETE FROM presets WHERE id = ?", (preset_id,)).rowcount
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            self.writes += 1
+        return deleted
+
+    # -- reads ------------------------------------------------------
+    def resolve(self, require):
+        # {"composition": {"Radial Sanctum"}, ...} (labels or full texts, as in
+        # batch --require) -> (option ids, required code bits).
+        ids, need = [], 0
+        shifts = {s.key: sh for s, (sh, _, _) in zip(self.table.slots, self._slots)}
+        for key, wanted in (require or {}).items():
+            if key not in self.table.slot_index:
+                raise ValueError(f"Unknown stage '{key}'")
+            slot = self.table.slots[self.table.slot_index[key]]
+            for name in wanted:
+                bit = self.table.label_bits[slot.index].get(name) or self.table.text_bits[slot.index].get(name)
+                if not bit:
+                    raise ValueError(f"Unknown option '{name}' for '{key}'")
+                ids.append(next(i for i in slot.options if self.table.options[i].bit == bit))
+                need |= bit << shifts[key]
+        return ids, need
+
+    def _where(self, require, style_name, world_name, since, until):
+        ids, need = self.resolve(require)
+        clauses, params = [], []
+        if need:
+            clauses.append("(p.code & ?) = ?")
+            params += [need, need]
+        if style_name:
+            clauses.append("p.style_name LIKE ? ESCAPE '\\'")
+            params.append(_like_prefix(style_name))
+        if world_name:
+            clauses.append("p.world_name LIKE ? ESCAPE '\\'")
+            params.append(_like_prefix(world_name))
+        if since:
+            clauses.append("p.exported_at >= ?")
+            params.append(normalize_timestamp(since) or since)
+        if until:
+            bound = normalize_timestamp(until) or until
+            clauses.append("p.exported_at <= ?")
+            params.append(bound.replace("T00:00:00", "T23:59:59") if len(until) == 10 else bound)
+        source = "presets p"
+        if ids:
+            with self._lock:
+                counts = dict(self._conn.execute(
+                    f"SELECT id, preset_count FROM options WHERE id IN ({','.join('?' * len(ids))})", ids).fetchall())
+            rarest = min(ids, key=lambda i: counts.get(i, 0))
+            # CROSS JOIN keeps the posting list as the outer loop.
+            source = "preset_options po CROSS JOIN presets p ON p.id = po.preset_id"
+            clauses.insert(0, "po.option_id = ?")
+            params.insert(0, rarest)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        return source, where, params, bool(ids)
+
+    def query(self, require=None, style_name="", world_name="", since=None, until=None, limit=100, offset=0,
+              before=None, after=None, oldest_first=False):
+        # Newest first, unless oldest_first. Names match case-insensitively
+        # by prefix; since/until bound exported_at and take dates or
+        # timestamps. before / after (an id) page without OFFSET.
+        source, where, params, by_option = self._where(require, style_name, world_name, since, until)
+        # Page through ids first, so a name or date filter can be answered from
+        # its covering index and only the page's rows are read from presets.
+        key = "po.preset_id" if by_option else "p.id"
+        for op, bound in (("<", before), (">", after)):
+            if bound is not None:
+                where += f"{' AND' if where else ' WHERE'} {key} {op} ?"
+                params.append(bound)
+        order = "ASC" if oldest_first else "DESC"
+        sql = (f"SELECT {COLUMNS} FROM presets p WHERE p.id IN "
+               f"(SELECT {key} FROM {source}{where} ORDER BY {key} {order} LIMIT ? OFFSET ?) ORDER BY p.id {order}")
+        with self._lock:
+            rows = self._conn.execute(sql, params + [limit, offset]).fetchall()
+        return [_row_preset(r) for r in rows]
+
+    def iter_matches(self, chunk=1000, oldest_first=False, **filters):
+        # Every match, newest first unless oldest_first, chunk rows in memory
+        # at a time.
+        page = {}
+        while True:
+            rows = self.query(limit=chunk, oldest_first=oldest_first, **page, **filters)
+            yield from rows
+            if len(rows) < chunk:
+                return
+            page = {"after" if oldest_first else "before": rows[-1]["id"]}
+
+    def count(self, require=None, style_name="", world_name="", since=None, until=None):
+        ids, _ = self.resolve(require)
+        if len(ids) == 1 and not (style_name or world_name or since or until):
+            with self._lock:
+                return self._conn.execute("SELECT preset_count FROM options WHERE id = ?", ids).fetchone()[0]
+        source, where, params, _ = self._where(require, style_name, world_name, since, until)
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM {source}{where}", params).fetchone()[0]
+
+    def get(self, preset_id):
+        with self._lock:
+            row = self._conn.execute(f"SELECT {COLUMNS} FROM presets p WHERE p.id = ?", (preset_id,)).fetchone()
+        return _row_preset(row) if row else None
+
+    def option_counts(self):
+        with self._lock:
+            return self._conn.execute("SELECT slot, label, preset_count FROM options ORDER BY id").fetchall()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM presets").fetchone()[0]
+
+    def stamp(self, upto=None):
+        # (preset count, highest id), of presets with ids up to upto if given:
+        # enough to tell whether a derived copy is current.
+        with self._lock:
+            return tuple(self._conn.execute("SELECT COUNT(*), COALESCE(MAX(id), 0) FROM presets WHERE id <= ?",
+                                            (MAX_ID if upto is None else upto,)).fetchone())
+
+    def version(self):
+        # Changes whenever any connection, this one included, commits a write.
+        with self._lock:
+            return self._conn.execute("PRAGMA data_version").fetchone()[0], self.writes
+
+    def codes(self, chunk=100000, after=0):
+        # (ids, codes) lists in id order, chunk rows at a time, from the
+        # first id above after.
+        last = after
+        while True:
+            with self._lock:
+                rows = self._conn.execute("SELECT id, code FROM presets WHERE id > ? ORDER BY id LIMIT ?",
+                                          (last, chunk)).fetchall()
+            if not rows:
+                return
+            ids, codes = zip(*rows)
+            yield ids, codes
+            last = ids[-1]
+
+def _row_preset(row):
+    pid, code, style_name, world_name, notes, exported_at = row
+    preset = {"id": pid, "code": code, "style_name": style_name, "world_name": world_name, "notes": notes}
+    if exported_at:
+        preset["exported_at"] = exported_at
+    return preset
+
+# -------------------------------
+# CLI
+# -------------------------------
+def _open_sources(paths):
+    for path in paths:
+        with open(path, "rb") as fp:
+            yield path, fp
+
+def main(argv=None):
+    from .batch import parse_require
+    from .importer import ImportReport, iter_presets, validator
+
+    parser = argparse.ArgumentParser(description="Store and search presets in a local SQLite library.")
+    parser.add_argument("--pack", default=DEFAULT, help=f"Stage pack (default: {DEFAULT})")
+    parser.add_argument("--db", help=f"Library file (default: {LIBRARY_PATH}, or presets.<pack>.db for other packs)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    add = commands.add_parser("import", help="Add presets from .json, .jsonl or .zip files")
+    add.add_argument("files", nargs="+")
+    find = commands.add_parser("query", help="Print matching presets as compact JSONL")
+    find.add_argument("--require", action="append", metavar="STAGE[.GROUP]=LABEL",
+                      help="Only presets whose selection includes LABEL, e.g. composition='Radial Sanctum'")
+    find.add_argument("--style-name", default="", help="Style name prefix")
+    find.add_argument("--world-name", default="", help="World name prefix")
+    find.add_argument("--since", help="Exported on or after (YYYY-MM-DD or timestamp)")
+    find.add_argument("--until", help="Exported on or before (YYYY-MM-DD or timestamp)")
+    find.add_argument("--limit", type=int, default=100)
+    find.add_argument("--count", action="store_true", help="Print the number of matches instead")
+    commands.add_parser("stats", help="Print preset and per-option counts")
+    args = parser.parse_args(argv)
+
+    table = load(args.pack).table
+    args.db = args.db or library_path(args.pack)
+    try:
+        library = PresetLibrary(args.db, table)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    if args.command == "import":
+        report = ImportReport()
+        t0 = time.perf_counter()
+        missing = [path for path in args.files if not os.path.isfile(path)]
+        if missing:
+            raise SystemExit(f"No such file: {', '.join(missing)}")
+        sources = _open_sources(args.files)
+        added = library.add(iter_presets(sources, report, validator(table)))
+        elapsed = time.perf_counter() - t0
+        for e in report.errors:
+            print(f"{e.source}:{e.record}: {e.message}", file=sys.stderr)
+        print(f"Added {added:,} presets in {elapsed:.2f}s ({report.summary()})", file=sys.stderr)
+    elif args.command == "query":
+        filters = dict(require=parse_require(args.require), style_name=args.style_name,
+                       world_name=args.world_name, since=args.since, until=args.until)
+        try:
+            if args.count:
+                print(library.count(**filters))
+            else:
+                for p in library.query(limit=args.limit, **filters):
+                    payload = {"id": p["id"]}
+                    payload.update(compact_preset(p["code"], p["style_name"], p["world_name"], p["notes"],
+                                                  p.get("exported_at"), table))
+                    print(dumps_preset(payload))
+        except ValueError as e:
+            raise SystemExit(str(e))
+    else:
+        print(f"{len(library):,} presets in {args.db}")
+        for slot, label, n in library.option_counts():
+            print(f"{slot:>18}  {label:<28} {n:>10,}")
+    library.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,226 @@
+import functools
+import os
+import pickle
+import sys
+import threading
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+
+# -------------------------------
+# Opt-in instrumentation
+# -------------------------------
+# Process-wide timers, counters and gauges for the app's hot paths, off
+# unless ARCHSTYLE_METRICS is set. When off, timed() hands back the function
+# it was given and timer() a shared null context, so instrumented code runs
+# as before. When on, every observation lands in a histogram, the sidebar
+# debug panel reads a snapshot, and, with ARCHSTYLE_METRICS_FILE set, a
+# daemon thread rewrites that file in Prometheus text format every
+# ARCHSTYLE_METRICS_INTERVAL seconds (for node_exporter's textfile collector
+# or any scraper that reads files).
+
+ENABLED = os.environ.get("ARCHSTYLE_METRICS", "").lower() not in ("", "0", "false", "no", "off")
+METRICS_FILE = os.environ.get("ARCHSTYLE_METRICS_FILE", "")
+FLUSH_SECONDS = float(os.environ.get("ARCHSTYLE_METRICS_INTERVAL", "15"))
+PREFIX = "archstyle"
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+_NULL = nullcontext()
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+
+class _Timer:
+    __slots__ = ("registry", "key", "t0")
+
+    def __init__(self, registry, key):
+        self.registry = registry
+        self.key = key
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.registry.observe(self.key, time.perf_counter() - self.t0)
+
+class Metrics:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.started = time.time()
+        # (section, labels) -> [bucket counts..., count, sum, max, last]
+        self._timings = {}
+        self._counters = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(name, labels):
+        return (name, tuple(sorted(labels.items())))
+
+    def observe(self, key, seconds):
+        n = len(self.buckets)
+        with self._lock:
+            row = self._timings.get(key)
+            if row is None:
+                row = self._timings[key] = [0] * n + [0, 0.0, 0.0, 0.0]
+            i = bisect_left(self.buckets, seconds)
+            if i < n:
+                row[i] += 1
+            row[n] += 1
+            row[n + 1] += seconds
+            row[n + 2] = max(row[n + 2], seconds)
+            row[n + 3] = seconds
+
+    def timer(self, section, **labels):
+        return _Timer(self, self.key(section, labels))
+
+    def inc(self, name, value=1, **labels):
+        key = self.key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._gauges[self.key(name, labels)] = value
+
+    def clear(self):
+        with self._lock:
+            self._timings.clear()
+            self._counters.clear()
+            self._gauges.clear()
+
+    def snapshot(self):
+        # {"timings": [(section, labels, count, total_s, max_s, last_s)], "counters": {...}, "gauges": {...}},
+        # for the debug panel.
+        n = len(self.buckets)
+        with self._lock:
+            timings = [(name, dict(labels), row[n], row[n + 1], row[n + 2], row[n + 3])
+                       for (name, labels), row in self._timings.items()]
+            counters = {(name, labels): v for (name, labels), v in self._counters.items()}
+            gauges = {(name, labels): v for (name, labels), v in self._gauges.items()}
+        return {"timings": sorted(timings, key=lambda t: -t[3]), "counters": counters, "gauges": gauges}
+
+    def prometheus(self):
+        n = len(self.buckets)
+        with self._lock:
+            timings = sorted((k, list(v)) for k, v in self._timings.items())
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+        lines = [f"# HELP {PREFIX}_section_seconds Time spent in instrumented app sections.",
+                 f"# TYPE {PREFIX}_section_seconds histogram"]
+        for (section, labels), row in timings:
+            base = (("section", section),) + labels
+            cumulative = 0
+            for le, count in zip(self.buckets, row):
+                cumulative += count
+                lines.append(f"{PREFIX}_section_seconds_bucket{_label_text(base + (('le', le),))} {cumulative}")
+            lines.append(f"{PREFIX}_section_seconds_bucket{_label_text(base + (('le', '+Inf'),))} {row[n]}")
+            lines.append(f"{PREFIX}_section_seconds_sum{_label_text(base)} {row[n + 1]:.9f}")
+            lines.append(f"{PREFIX}_section_seconds_count{_label_text(base)} {row[n]}")
+        for kind, items in (("counter", counters), ("gauge", gauges)):
+            declared = set()
+            for (name, labels), value in items:
+                if name not in declared:
+                    declared.add(name)
+                    lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+                lines.append(f"{PREFIX}_{name}{_label_text(labels)} {value}")
+        lines.append(f"# TYPE {PREFIX}_process_start_time_seconds gauge")
+        lines.append(f"{PREFIX}_process_start_time_seconds {self.started:.3f}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        # Written beside the target and renamed, so a scraper never reads half a file.
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as fp:
+            fp.write(self.prometheus())
+        os.replace(tmp, path)
+
+METRICS = Metrics()
+
+# -- instrumentation helpers ----------------------------------------
+
+def timer(section, **labels):
+    return METRICS.timer(section, **labels) if ENABLED else _NULL
+
+def timed(section, labels=None):
+    # Decorator timing every call as `section`. labels: a dict of extra
+    # labels, or a function of the call's arguments returning one. The
+    # identity when off.
+    def wrap(fn):
+        if not ENABLED:
+            return fn
+        if not callable(labels):
+            key = METRICS.key(section, labels or {})
+
+            @functools.wraps(fn)
+            def inner(*args, **kwargs):
+                t0 = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    METRICS.observe(key, time.perf_counter() - t0)
+        else:
+            @functools.wraps(fn)
+            def inner(*args, **kwargs):
+                t0 = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    METRICS.observe(METRICS.key(section, labels(*args, **kwargs)), time.perf_counter() - t0)
+        return inner
+    return wrap
+
+def instrument(module, names, section):
+    # Swap module-level functions for timed versions (labelled by name), so
+    # callers inside that module are timed too. Does nothing when off.
+    if not ENABLED:
+        return
+    for name in names:
+        fn = getattr(module, name)
+        if not getattr(fn, "__wrapped__", None):
+            setattr(module, name, timed(section, {"name": name})(fn))
+
+def state_footprint(state):
+    # Approximate bytes per key of a session state mapping: each value's
+    # pickle size, or its shallow size when it does not pickle (uploaded
+    # files, open handles).
+    sizes = {}
+    for key, value in state.items():
+        try:
+            sizes[key] = len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        except Exception:
+            sizes[key] = sys.getsizeof(value)
+    return sizes
+
+def state_size(state):
+    return sum(state_footprint(state).values())
+
+# -- periodic flush --------------------------------------------------
+
+_flusher = None
+_flusher_lock = threading.Lock()
+
+def _flush_loop(path, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            METRICS.write(path)
+        except OSError:
+            pass
+
+def start_flusher(path=None, interval=None):
+    # One daemon thread per process; a no-op when off, without a file, or
+    # when already running.
+    global _flusher
+    path = path or METRICS_FILE
+    if not ENABLED or not path:
+        return False
+    with _flusher_lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_loop, args=(path, interval or FLUSH_SECONDS),
+                                        name="archstyle-metrics", daemon=True)
+            _flusher.start()
+    return True
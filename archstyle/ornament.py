@@ -0,0 +1,230 @@
+import argparse
+import functools
+import hashlib
+import json
+import re
+import sys
+import time
+from collections import namedtuple
+from itertools import islice
+
+from .stages import DEFAULT_STYLE_NAME
+from .stages import TABLE
+from .table import short_label
+from .batch import Permutation
+
+# -------------------------------
+# Ornament Lab
+# -------------------------------
+# Motif-sheet and detail prompts expanded from a style's ornament, material
+# and light selections. Every selected option contributes phrases (its
+# label, the clauses of its description and of its concept-guide entry)
+# to one axis; fixed vocabularies add the sheet or detail type, layout and
+# rendering medium. Phrases are deduplicated per axis by a hash of their
+# normalized text, so every point of the axes' product is a distinct
+# prompt and no per-variant bookkeeping is needed.
+#
+# The product is walked in a seeded shuffle (batch.Permutation),
+# so variant n is computed directly from n: generation is lazy, paging is
+# random access, memory is flat, and the same style and seed always give
+# the same order.
+
+SHEETS = (
+    "motif sheet", "pattern plate", "ornament catalogue page", "repeat study",
+    "stencil sheet", "frieze design board",
+)
+DETAILS = (
+    "capital detail", "door surround", "frieze band", "window tracery", "ceiling coffer", "floor inlay",
+    "column base", "corner junction", "balustrade panel", "niche and canopy", "rainwater spout",
+    "threshold stone",
+)
+LAYOUTS = (
+    "single panel", "repeating tile", "running border", "radial rosette", "mirrored pair", "corner piece",
+    "progressive sequence",
+)
+MEDIA = (
+    "orthographic drawing on vellum", "measured drawing with annotations", "plaster cast study photograph",
+    "raking-light relief photograph", "macro close-up, shallow depth of field", "graphite rubbing",
+    "watercolour elevation", "isometric cutaway",
+)
+KINDS = ("sheet", "detail")
+_MASK64 = (1 << 64) - 1
+
+Variant = namedtuple("Variant", "position id kind prompt")
+
+def _normalize(text):
+    return re.sub(r"\s+", " ", text.strip().casefold())
+
+def _digest(text):
+    return int.from_bytes(hashlib.blake2b(_normalize(text).encode("utf-8"), digest_size=8).digest(), "little")
+
+def _clauses(text):
+    # "a, b; c." -> ["a", "b", "c"]
+    return [c.strip(" .") for c in re.split(r"[,;]| — |\.\s", text) if c.strip(" .")]
+
+def option_phrases(option):
+    label = option.label.lower()
+    description = option.text.partition(" — ")[2]
+    yield label
+    for clause in _clauses(description) + _clauses(option.guide):
+        yield f"{label}: {clause.lower()}"
+
+class Axis:
+    # Distinct phrases (first spelling wins) with their 64-bit digests.
+    def __init__(self, name, phrases):
+        self.name = name
+        seen = set()
+        self.phrases, self.digests = [], []
+        for phrase in phrases:
+            d = _digest(phrase)
+            if d not in seen:
+                seen.add(d)
+                self.phrases.append(phrase)
+                self.digests.append(d)
+
+    def __len__(self):
+        return len(self.phrases)
+
+def _selected(masks, slot_key, table):
+    slot = table.slots[table.slot_index[slot_key]]
+    return [table.options[i] for i in slot.options if masks[slot.index] & table.options[i].bit]
+
+class OrnamentLab:
+    def __init__(self, masks, style_name=DEFAULT_STYLE_NAME, seed=0, kinds=KINDS, table=TABLE):
+        kinds = tuple(k for k in KINDS if k in kinds) or KINDS
+        types = [(k, t) for k in kinds for t in (SHEETS if k == "sheet" else DETAILS)]
+        self.style_name = style_name or DEFAULT_STYLE_NAME
+        self.kinds = kinds
+        self._kind_of = {t: k for k, t in types}
+        self.axes = [
+            Axis("type", [t for _, t in types]),
+            Axis("motif", [p for o in _selected(masks, "ornament", table) for p in option_phrases(o)]),
+            Axis("material", [p for o in _selected(masks, "material.texture", table) for p in option_phrases(o)]),
+            Axis("palette", [short_label(o.text).lower() for o in _selected(masks, "material.tone", table)]),
+            Axis("light", [p for o in _selected(masks, "light", table) for p in option_phrases(o)]),
+            Axis("layout", LAYOUTS),
+            Axis("medium", MEDIA),
+        ]
+        self.radices = [len(a) for a in self.axes]
+        self.total = 1
+        for r in self.radices:
+            self.total *= r
+        # Seeded by content, not by style code: styles that share these
+        # selections and name produce the same variants in the same order.
+        signature = hashlib.blake2b(repr([a.digests for a in self.axes]).encode() + self.style_name.encode("utf-8"),
+                                    digest_size=8).hexdigest()
+        self.signature = signature
+        self.seed = seed
+        self._shuffle = Permutation(self.total, f"{signature}:{seed}")
+        self._phrases = [a.phrases for a in self.axes]
+        self._digests = [a.digests for a in self.axes]
+
+    def __len__(self):
+        return self.total
+
+    def variant(self, position):
+        # The variant at a position of this lab's order, in O(1). Unrolled
+        # over the seven axes: this is the generator's inner loop.
+        index = self._shuffle(position)
+        r_motif, r_material, r_palette, r_light, r_layout, r_medium = self.radices[1:]
+        index, medium = divmod(index, r_medium)
+        index, layout = divmod(index, r_layout)
+        index, light = divmod(index, r_light)
+        index, palette = divmod(index, r_palette)
+        index, material = divmod(index, r_material)
+        kind_type, motif = divmod(index, r_motif)
+        picks = (kind_type, motif, material, palette, light, layout, medium)
+        h = 0xCBF29CE484222325
+        for digests, i in zip(self._digests, picks):
+            h = ((h ^ digests[i]) * 0x100000001B3) & _MASK64
+        p = self._phrases
+        kind_type = p[0][kind_type]
+        prompt = (f"{kind_type}, {self.style_name} ornament — motif: {p[1][motif]}; material: {p[2][material]}, "
+                  f"{p[3][palette]} palette; light: {p[4][light]}; {p[5][layout]}, {p[6][medium]}")
+        return Variant(position, f"{h:016x}", self._kind_of[kind_type], prompt)
+
+    def index(self, position):
+        # The point of the axes' product (mixed radix, "medium" fastest)
+        # shown at a position.
+        return self._shuffle(position)
+
+    def variants(self, start=0, stop=None):
+        # Lazy stream of variants in positions [start, stop).
+        stop = self.total if stop is None else min(stop, self.total)
+        return map(self.variant, range(max(0, start), stop))
+
+    def page(self, number, size):
+        return list(self.variants(number * size, (number + 1) * size))
+
+    def pages(self, size):
+        return -(-self.total // size)
+
+    def describe(self):
+        return {a.name: len(a) for a in self.axes}
+
+@functools.lru_cache(maxsize=64)
+def ornament_lab(masks, style_name=DEFAULT_STYLE_NAME, seed=0, kinds=KINDS, table=TABLE):
+    # Shared labs for the app: building one hashes every phrase once.
+    return OrnamentLab(masks, style_name, seed, kinds, table)
+
+def unique(variants, seen=None):
+    # Drops variants whose id was already seen. One lab never repeats
+    # itself; this is for merging the streams of several styles, and its
+    # memory grows with the number of distinct ids.
+    seen = set() if seen is None else seen
+    for v in variants:
+        if v.id not in seen:
+            seen.add(v.id)
+            yield v
+
+# -------------------------------
+# CLI
+# -------------------------------
+def main(argv=None):
+    from .codec import from_token, unpack
+
+    parser = argparse.ArgumentParser(description="Stream motif-sheet and detail prompt variants for one or more styles.")
+    parser.add_argument("styles", nargs="+", metavar="CODE", help="Style codes")
+    parser.add_argument("--style-name", default=DEFAULT_STYLE_NAME)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--kind", choices=KINDS, action="append", help="Only sheets or only details")
+    parser.add_argument("--start", type=int, default=0)
+    parser.add_argument("--limit", type=int, help="Variants per style")
+    parser.add_argument("--jsonl", action="store_true", help="JSON records instead of one prompt per line")
+    parser.add_argument("-o", "--output", default="-")
+    args = parser.parse_args(argv)
+
+    try:
+        labs = [OrnamentLab(unpack(from_token(s)), args.style_name, args.seed, tuple(args.kind or KINDS))
+                for s in args.styles]
+    except ValueError as e:
+        raise SystemExit(str(e))
+    stream = (v for lab in labs
+              for v in lab.variants(args.start, None if args.limit is None else args.start + args.limit))
+    if len(labs) > 1:
+        stream = unique(stream)
+
+    out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    t0 = time.perf_counter()
+    n = 0
+    try:
+        while True:
+            chunk = list(islice(stream, 4096))
+            if not chunk:
+                break
+            if args.jsonl:
+                out.write("".join(json.dumps(v._asdict(), ensure_ascii=False) + "\n" for v in chunk))
+            else:
+                out.write("".join(v.prompt + "\n" for v in chunk))
+            n += len(chunk)
+    except BrokenPipeError:
+        pass
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    elapsed = time.perf_counter() - t0
+    print(f"{n:,} variants in {elapsed:.2f}s ({n / elapsed if elapsed else 0:,.0f}/s)", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,5 @@
+import sys
+
+from archstyle.stagepacks import main
+
+sys.exit(main())
@@ -0,0 +1,257 @@
+import atexit
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+import zlib
+
+from .stages import TABLE
+from .codec import PRESET_FIELDS, code_bits
+
+# -------------------------------
+# Compact preset lists
+# -------------------------------
+# How a session keeps a bulk import: the style codes as fixed-width bytes,
+# and the text fields as one zlib-compressed JSON array per BLOCK presets.
+# A preset dict is rebuilt on access (the last block read stays decoded), so
+# a large import costs a few bytes per preset instead of a dict and four
+# strings each.
+
+BLOCK = 1024
+FIELDS = PRESET_FIELDS + ("exported_at", "order")
+
+class PresetList:
+    def __init__(self, presets=(), table=TABLE):
+        self.width = -(-code_bits(table) // 8)
+        codes = bytearray()
+        self.blocks = []
+        rows = []
+        for preset in presets:
+            codes += preset["code"].to_bytes(self.width, "big")
+            rows.append([preset.get(k) for k in FIELDS])
+            if len(rows) == BLOCK:
+                self.blocks.append(zlib.compress(json.dumps(rows).encode("utf-8"), 1))
+                rows = []
+        if rows:
+            self.blocks.append(zlib.compress(json.dumps(rows).encode("utf-8"), 1))
+        self.codes = bytes(codes)
+        self._block = (None, None)
+
+    def __len__(self):
+        return len(self.codes) // self.width
+
+    def code(self, i):
+        return int.from_bytes(self.codes[i * self.width:(i + 1) * self.width], "big")
+
+    def iter_codes(self):
+        w = self.width
+        return (int.from_bytes(self.codes[lo:lo + w], "big") for lo in range(0, len(self.codes), w))
+
+    def _rows(self, b):
+        index, rows = self._block
+        if index != b:
+            rows = json.loads(zlib.decompress(self.blocks[b]))
+            self._block = (b, rows)
+        return rows
+
+    def __getitem__(self, i):
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        preset = {k: v for k, v in zip(FIELDS, self._rows(i // BLOCK)[i % BLOCK]) if v is not None}
+        if "order" in preset:
+            preset["order"] = {int(slot): texts for slot, texts in preset["order"].items()}
+        preset["code"] = self.code(i)
+        return preset
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getstate__(self):
+        return {k: v for k, v in self.__dict__.items() if k != "_block"}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state, _block=(None, None))
+
+# -------------------------------
+# Session store
+# -------------------------------
+# Bulky per-session values (a bulk import, analytics results) live here
+# rather than in st.session_state, under a session id the app keeps in its
+# state. A session's values stay in memory while it is in use. A daemon
+# thread writes the values of sessions idle for IDLE_SECONDS to one pickle
+# per session and drops them from memory; the session's next get() reads
+# them back. Files of sessions not seen for TTL_SECONDS are deleted. Values
+# are replaced, never mutated in place, so a spill can pickle them while the
+# session runs. Disk I/O happens outside the store's lock: a restore claims
+# the session's file under it and reads it after, so sessions never wait on
+# each other's files.
+
+STORE_DIR = os.environ.get("ARCHSTYLE_SESSION_DIR", "")  # default: a private temporary directory
+IDLE_SECONDS = float(os.environ.get("ARCHSTYLE_SESSION_IDLE", "300"))
+TTL_SECONDS = float(os.environ.get("ARCHSTYLE_SESSION_TTL", "86400"))
+
+class SessionStore:
+    def __init__(self, directory=STORE_DIR, idle_seconds=IDLE_SECONDS, ttl_seconds=TTL_SECONDS):
+        self.directory = directory
+        self.idle_seconds = idle_seconds
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._dir_lock = threading.Lock()
+        self._resident = {}  # sid -> {name: value}
+        self._seen = {}  # sid -> last use (monotonic)
+        self._on_disk = {}  # sid -> bytes written
+        self._restoring = {}  # sid -> Event set once its file has been read back
+        self.spills = 0
+        self.restores = 0
+
+    def _path(self, sid):
+        with self._dir_lock:
+            if not self.directory:
+                self.directory = tempfile.mkdtemp(prefix="archstyle-sessions-")
+                atexit.register(shutil.rmtree, self.directory, True)
+            os.makedirs(self.directory, exist_ok=True)
+        return os.path.join(self.directory, f"{sid}.pickle")
+
+    def _restore(self, sid):
+        # Makes the session's values resident, reading them back if spilled.
+        # A second caller for a session being read back waits for the first.
+        while True:
+            with self._lock:
+                if sid in self._resident:
+                    return
+                pending = self._restoring.get(sid)
+                if pending is None:
+                    if self._on_disk.pop(sid, None) is None:
+                        self._resident[sid] = {}
+                        return
+                    pending = self._restoring[sid] = threading.Event()
+                    break
+            pending.wait()
+        values = None
+        try:
+            path = self._path(sid)
+            with open(path, "rb") as fp:
+                values = pickle.loads(fp.read())
+            os.remove(path)
+        finally:
+            with self._lock:
+                self._resident[sid] = {} if values is None else values
+                self._seen[sid] = time.monotonic()
+                self.restores += values is not None
+                del self._restoring[sid]
+            pending.set()
+
+    def _use(self, sid, fn):
+        # fn(values) under the lock, once the session is resident.
+        while True:
+            self._restore(sid)
+            with self._lock:
+                values = self._resident.get(sid)
+                if values is not None:  # else spilled again in between
+                    self._seen[sid] = time.monotonic()
+                    return fn(values)
+
+    def get(self, sid, name, default=None):
+        return self._use(sid, lambda values: values.get(name, default))
+
+    def put(self, sid, name, value):
+        self._use(sid, lambda values: values.__setitem__(name, value))
+
+    def pop(self, sid, name, default=None):
+        return self._use(sid, lambda values: values.pop(name, default))
+
+    def touch(self, sid):
+        with self._lock:
+            self._seen[sid] = time.monotonic()
+
+    def spill_idle(self, idle_seconds=None):
+        # Moves sessions idle for idle_seconds to disk; returns how many.
+        idle = self.idle_seconds if idle_seconds is None else idle_seconds
+        now = time.monotonic()
+        with self._lock:
+            idle_sids = [sid for sid in self._resident if now - self._seen.get(sid, 0) >= idle]
+        spilled = 0
+        for sid in idle_sids:
+            with self._lock:
+                values, seen = self._resident.get(sid), self._seen.get(sid)
+                values = None if values is None else dict(values)
+            if values is None:
+                continue
+            path = self._path(sid)
+            data = pickle.dumps(values, protocol=pickle.HIGHEST_PROTOCOL) if values else b""
+            if data:
+                with open(path + ".tmp", "wb") as fp:
+                    fp.write(data)
+                os.replace(path + ".tmp", path)
+            with self._lock:
+                # A session used while it was being written stays in memory.
+                used = self._seen.get(sid) != seen
+                if not used:
+                    del self._resident[sid]
+                    if data:
+                        self._on_disk[sid] = len(data)
+                        self.spills += 1
+                    spilled += 1
+            if used and data:
+                os.remove(path)
+        return spilled
+
+    def expire(self):
+        # Forgets sessions not seen for ttl_seconds and deletes their files.
+        now = time.monotonic()
+        with self._lock:
+            gone = [sid for sid, seen in self._seen.items()
+                    if now - seen >= self.ttl_seconds and sid not in self._restoring]
+            files = []
+            for sid in gone:
+                del self._seen[sid]
+                self._resident.pop(sid, None)
+                if self._on_disk.pop(sid, None) is not None:
+                    files.append(sid)
+        for sid in files:
+            try:
+                os.remove(self._path(sid))
+            except OSError:
+                pass
+        return len(gone)
+
+    def footprint(self, sid):
+        # Approximate bytes per value of a session in memory (pickle size).
+        with self._lock:
+            values = dict(self._resident.get(sid) or {})
+        return {name: len(pickle.dumps(v, protocol=pickle.HIGHEST_PROTOCOL)) for name, v in values.items()}
+
+    def stats(self):
+        with self._lock:
+            return {"sessions": len(self._seen), "resident": len(self._resident), "spilled": len(self._on_disk),
+                    "spilled_bytes": sum(self._on_disk.values()), "spills": self.spills, "restores": self.restores}
+
+STORE = SessionStore()
+
+# -- reaper ----------------------------------------------------------
+
+_reaper = None
+_reaper_lock = threading.Lock()
+
+def _reap_loop(store, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            store.spill_idle()
+            store.expire()
+        except OSError:
+            pass
+
+def start_reaper(store=STORE):
+    # One daemon thread per process; a no-op when already running.
+    global _reaper
+    with _reaper_lock:
+        if _reaper is None:
+            _reaper = threading.Thread(target=_reap_loop, args=(store, max(1.0, min(60.0, store.idle_seconds / 4))),
+                                       name="archstyle-sessions", daemon=True)
+            _reaper.start()
+    return True
@@ -0,0 +1,316 @@
+import argparse
+import contextlib
+import fcntl
+import io
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+from .stages import TABLE
+from .codec import code_bits, from_token, to_token
+
+# -------------------------------
+# Similar styles
+# -------------------------------
+# Every preset in the library as a packed bit vector: its style code (one bit
+# per option across all slots, material texture and tone included) split
+# into uint64 words, one matrix row per preset. The matrix and the matching
+# preset ids live in .npy files next to the library, named with the table's
+# pack_id so an index is never read with another pack's layout, and are
+# opened as memory maps, so every worker process shares the OS page cache instead of
+# holding its own copy. Search is a chunked popcount over the whole matrix.
+
+CHUNK_ROWS = 1 << 18
+METRICS = ("jaccard", "hamming")
+
+def word_count(table=TABLE):
+    return -(-code_bits(table) // 64)
+
+def code_words(codes, words):
+    # Little-endian uint64 words: column 0 holds the code's lowest 64 bits.
+    codes = [int(c) for c in codes]
+    out = np.empty((len(codes), words), dtype=np.uint64)
+    for w in range(words):
+        out[:, w] = [(c >> (64 * w)) & 0xFFFFFFFFFFFFFFFF for c in codes]
+    return out
+
+def _popcount(a):
+    # Per-row set bits as uint8 (codes are far below 256 bits).
+    counts = np.bitwise_count(a)
+    return counts[:, 0] if a.shape[1] == 1 else counts.sum(axis=1, dtype=np.uint8)
+
+def _rank_tables(bits):
+    # Every (shared, combined) option count pair a Jaccard comparison can
+    # produce, as one small integer cell, mapped to the rank of its score
+    # (0 = identical). Search then works on small integers throughout:
+    # a lookup, a bincount and one pass to collect the top-k candidates.
+    side = bits + 1
+    inter, union = np.divmod(np.arange(side * side), side)
+    score = np.where(union > 0, inter / np.maximum(union, 1), 1.0)
+    score[inter > union] = -1.0  # impossible cells
+    values, rank = np.unique(-score, return_inverse=True)
+    return rank.astype(np.uint16), -values
+
+def _append_rows(path, rows, array):
+    # Writes array after the first rows rows of the .npy file at path, then
+    # rewrites its header for the new length. numpy pads .npy headers so the
+    # first dimension can grow without moving the data; a file without that
+    # room raises ValueError.
+    with open(path, "r+b") as fp:
+        version = np.lib.format.read_magic(fp)
+        read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+        shape, fortran_order, dtype = read_header(fp)
+        offset = fp.tell()
+        header = io.BytesIO()
+        np.lib.format.write_array_header_1_0(header, {"descr": np.lib.format.dtype_to_descr(dtype),
+                                                      "fortran_order": fortran_order,
+                                                      "shape": (rows + len(array),) + shape[1:]})
+        if fortran_order or dtype != array.dtype or len(header.getvalue()) != offset:
+            raise ValueError(f"{path} cannot be appended to in place")
+        fp.seek(offset + rows * dtype.itemsize * int(np.prod(shape[1:])))
+        fp.write(array.tobytes())
+        fp.truncate()
+        fp.flush()
+        fp.seek(0)
+        fp.write(header.getvalue())
+
+def _best(keys, k, offset=0, rows=None):
+    # The k lowest keys as (rows, keys), sorted; ties go to the later row,
+    # i.e. the newer preset, so results do not shuffle between calls.
+    if len(keys) > k:
+        kth = np.searchsorted(np.cumsum(np.bincount(keys)), k)
+        cand = np.flatnonzero(keys <= kth)
+        keys = keys[cand]
+        rows = cand + offset if rows is None else rows[cand]
+    elif rows is None:
+        rows = np.arange(offset, offset + len(keys))
+    order = np.lexsort((-rows, keys))[:k]
+    return rows[order], keys[order]
+
+class SimilarityIndex:
+    def __init__(self, path, table=TABLE):
+        # path: the library file; the index is stored beside it.
+        self.table = table
+        self.words = word_count(table)
+        self.bits = code_bits(table)
+        self.vectors_path = f"{path}.{table.pack_id}.vectors.npy"
+        self.ids_path = f"{path}.{table.pack_id}.ids.npy"
+        self.lock_path = f"{path}.{table.pack_id}.index.lock"
+        self._jaccard_rank, self._jaccard_scores = _rank_tables(self.bits)
+        self.version = None
+        self.rebuilding = None  # the background rebuild's thread, while it runs
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self.vectors = np.zeros((0, self.words), dtype=np.uint64)
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.row_bits = np.zeros(0, dtype=np.uint8)
+        self._inode = None
+        self._open()
+
+    def _open(self):
+        # Maps the files as they are now. Rows are appended vectors first,
+        # ids second, so only rows with an id are used; rows appended since
+        # the last open of the same file only need their bit counts added.
+        vectors, ids, row_bits, inode = self.vectors[:0], self.ids[:0], self.row_bits[:0], None
+        if os.path.exists(self.vectors_path) and os.path.exists(self.ids_path):
+            on_disk = np.load(self.vectors_path, mmap_mode="r")
+            on_disk_ids = np.load(self.ids_path, mmap_mode="r")
+            if on_disk.shape[1:] == (self.words,) and len(on_disk_ids) <= len(on_disk):
+                ids, vectors = on_disk_ids, on_disk[:len(on_disk_ids)]
+                inode = os.stat(self.vectors_path).st_ino
+                known = len(self.ids) if inode == self._inode and len(ids) >= len(self.ids) else 0
+                row_bits = np.concatenate([self.row_bits[:known], _popcount(np.asarray(vectors[known:]))])
+        with self._lock:
+            self.vectors, self.ids, self.row_bits, self._inode = vectors, ids, row_bits, inode
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        # Serializes writers across processes (the app, the CLI).
+        with open(self.lock_path, "a") as fp:
+            fcntl.flock(fp, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fp, fcntl.LOCK_UN)
+
+    def __len__(self):
+        return len(self.ids)
+
+    # -- build ------------------------------------------------------
+    def build(self, chunks, total):
+        # chunks: iterable of (ids, codes) sequences adding up to total rows.
+        # Written to temporary files and swapped in, so readers never see a
+        # half-built index.
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        vectors = np.lib.format.open_memmap(self.vectors_path + suffix, mode="w+", dtype=np.uint64,
+                                            shape=(total, self.words))
+        ids = np.lib.format.open_memmap(self.ids_path + suffix, mode="w+", dtype=np.int64, shape=(total,))
+        n = 0
+        for chunk_ids, chunk_codes in chunks:
+            m = min(len(chunk_ids), total - n)
+            ids[n:n + m] = chunk_ids[:m]
+            vectors[n:n + m] = code_words(chunk_codes[:m], self.words)
+            n += m
+        vectors.flush()
+        ids.flush()
+        del vectors, ids
+        with self._file_lock():
+            os.replace(self.vectors_path + suffix, self.vectors_path)
+            os.replace(self.ids_path + suffix, self.ids_path)
+            self._open()
+        return n
+
+    def append(self, chunks):
+        # Adds (ids, codes) chunks after the last row, in place; returns the
+        # rows added. Callers hold the file lock and have just opened the
+        # files, so the last row is the last one on disk.
+        if not os.path.exists(self.vectors_path) or not os.path.exists(self.ids_path):
+            np.save(self.vectors_path, np.zeros((0, self.words), dtype=np.uint64))
+            np.save(self.ids_path, np.zeros(0, dtype=np.int64))
+        n = rows = len(self.ids)
+        for chunk_ids, chunk_codes in chunks:
+            _append_rows(self.vectors_path, n, code_words(chunk_codes, self.words))
+            _append_rows(self.ids_path, n, np.asarray(chunk_ids, dtype=np.int64))
+            n += len(chunk_ids)
+        if n > rows:
+            self._open()
+        return n - rows
+
+    def sync(self, library, background=True):
+        # Brings the index up to date with the library; returns the rows
+        # added. Presets only ever get ids above the last one, so new ones
+        # are appended in place. Once presets have been deleted the index
+        # is rebuilt: in a background thread unless background is False,
+        # serving the current index (callers skip ids the library no longer
+        # has) until the new one is swapped in.
+        with self._sync_lock:
+            version = library.version()
+            if version == self.version or self.rebuilding:
+                return 0
+            with self._file_lock():
+                self._open()
+                try:
+                    added = self.append(library.codes(after=int(self.ids[-1]) if len(self.ids) else 0))
+                    grown = True
+                except ValueError:  # a header without room to grow: rebuild
+                    added, grown = 0, False
+            # Ids are never reused, so the index is current if every id up to
+            # its last one is still in the library.
+            last = int(self.ids[-1]) if len(self.ids) else 0
+            if grown and library.stamp(upto=last)[0] == len(self.ids):
+                self.version = version
+                return added
+            total = library.stamp()[0]
+            if not background:
+                self.build(library.codes(), total)
+                self.version = version
+                return added
+            self.rebuilding = threading.Thread(target=self._rebuild, args=(library, total),
+                                               name="archstyle-similar", daemon=True)
+            self.rebuilding.start()
+            return added
+
+    def _rebuild(self, library, total):
+        try:
+            self.build(library.codes(), total)
+        finally:
+            with self._sync_lock:
+                # Presets added during the rebuild are appended by the next sync.
+                self.version = self.rebuilding = None
+
+    # -- search -----------------------------------------------------
+    def search(self, codes, k=10, metric="jaccard", exclude_exact=False):
+        # Top-k rows for each query code: a list of (preset ids, scores),
+        # best first. Jaccard scores are similarities in [0, 1]; Hamming
+        # scores are differing option counts.
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric '{metric}', expected one of {', '.join(METRICS)}")
+        queries = code_words(codes, self.words)
+        with self._lock:
+            vectors, ids, row_bits = self.vectors, self.ids, self.row_bits
+        k = min(k, len(ids))
+        excluded = len(self._jaccard_scores) if metric == "jaccard" else self.bits + 1
+        best = [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint16)) for _ in codes]
+        if not k:
+            return best
+        query_bits = _popcount(queries).astype(np.uint16)
+        for lo in range(0, len(ids), CHUNK_ROWS):
+            block = np.asarray(vectors[lo:lo + CHUNK_ROWS])
+            block_bits = row_bits[lo:lo + CHUNK_ROWS].astype(np.uint16)
+            for qi, q in enumerate(queries):
+                inter = _popcount(block & q).astype(np.uint16)
+                if metric == "jaccard":
+                    # Cell of (shared, combined): inter * (bits + 1) + union, with
+                    # union = row bits + query bits - inter.
+                    keys = self._jaccard_rank[inter * self.bits + block_bits + query_bits[qi]]
+                else:
+                    keys = block_bits + query_bits[qi] - 2 * inter
+                if exclude_exact:
+                    keys[(inter == block_bits) & (inter == query_bits[qi])] = excluded
+                rows, keys = _best(keys, k, lo)
+                prev_rows, prev_keys = best[qi]
+                best[qi] = _best(np.concatenate([prev_keys, keys]), k, rows=np.concatenate([prev_rows, rows]))
+        results = []
+        for rows, keys in best:
+            keep = keys < excluded
+            rows, keys = rows[keep], keys[keep]
+            scores = self._jaccard_scores[keys] if metric == "jaccard" else keys.astype(np.int64)
+            results.append((ids[rows].astype(np.int64), scores))
+        return results
+
+    def nearest(self, code, k=10, metric="jaccard", exclude_exact=False):
+        return self.search([code], k, metric, exclude_exact)[0]
+
+# -------------------------------
+# CLI
+# -------------------------------
+def main(argv=None):
+    from .library import PresetLibrary, library_path
+    from .stagepacks import DEFAULT, load
+
+    parser = argparse.ArgumentParser(description="Build and query the similar-styles index of a preset library.")
+    parser.add_argument("--pack", default=DEFAULT, help=f"Stage pack (default: {DEFAULT})")
+    parser.add_argument("--db", help="Library file (default: the pack's library)")
+    parser.add_argument("styles", nargs="*", help="Style codes to find neighbours for (none: just sync the index)")
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--metric", choices=METRICS, default="jaccard")
+    args = parser.parse_args(argv)
+
+    table = load(args.pack).table
+    args.db = args.db or library_path(args.pack)
+    try:
+        library = PresetLibrary(args.db, table)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    index = SimilarityIndex(args.db, table)
+    t0 = time.perf_counter()
+    added = index.sync(library, background=False)
+    print(f"Index of {len(index):,} presets ({added:,} added) synced in {time.perf_counter() - t0:.2f}s",
+          file=sys.stderr)
+    try:
+        codes = [from_token(s, table) for s in args.styles]
+    except ValueError as e:
+        raise SystemExit(str(e))
+    if codes:
+        t0 = time.perf_counter()
+        results = index.search(codes, args.k, args.metric)
+        elapsed = (time.perf_counter() - t0) * 1000
+        for token, (ids, scores) in zip(args.styles, results):
+            print(f"# {token}")
+            for pid, score in zip(ids, scores):
+                preset = library.get(int(pid))
+                shown = f"{score:.3f}" if args.metric == "jaccard" else str(score)
+                if preset is None:
+                    # Deleted since the index last synced (e.g. by another process).
+                    print(f"{shown:>6}  #{pid}  (no longer in the library)")
+                    continue
+                print(f"{shown:>6}  {to_token(preset['code'], table)}  #{pid}  {preset['style_name']}")
+        print(f"Searched in {elapsed:.1f} ms", file=sys.stderr)
+    library.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,327 @@
+import marshal
+import os
+import struct
+import sys
+import threading
+import time
+from collections import namedtuple
+
+from .table import OptionTable
+
+# -------------------------------
+# Stage packs
+# -------------------------------
+# A stage pack is a JSON file holding one taxonomy: the stages, their
+# options and defaults, and the concept guide. Packs live in
+# archstyle/packs/ and in the directories of ARCHSTYLE_PACK_PATH
+# (os.pathsep-separated, searched first); the file name is the pack name.
+# Any number of packs can be in use at once, each loaded when first asked
+# for; ARCHSTYLE_PACK names the default one (archstyle.PACK / TABLE), used
+# where no pack is chosen.
+#
+# A pack is validated and compiled once (parsed, checked, built into an
+# OptionTable) and the result is marshalled next to the source, like a .pyc:
+# __pycache__/<name>.pack, or ARCHSTYLE_PACK_CACHE when set. The compiled
+# file records the source's mtime and size and is rebuilt only when they
+# change. Nothing is read until a pack is asked for, so a server with dozens
+# of packs pays only for the one it loads. This module is imported with the
+# package, so json and argparse are only imported when needed.
+
+PACK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "packs")
+PACK_PATH = [p for p in os.environ.get("ARCHSTYLE_PACK_PATH", "").split(os.pathsep) if p] + [PACK_DIR]
+CACHE_DIR = os.environ.get("ARCHSTYLE_PACK_CACHE", "")
+DEFAULT = os.environ.get("ARCHSTYLE_PACK", "default")
+
+FORMAT = 1
+# Bump when the schema or OptionTable changes, so stale compiled packs are rebuilt.
+COMPILED_VERSION = 2
+MAGIC = b"ASPK"
+HEADER = struct.Struct(">4sHqq")  # magic, compiled version, source mtime_ns, source size
+
+STAGE_TYPES = ("single", "multi", "compound")
+MAX_OPTIONS = 12  # OptionTable precomputes every mask of a slot: 2**n entries
+# Slots the composers, the Ornament Lab and the Urban Layout Lab read.
+REQUIRED_SLOTS = ("soul", "heritage", "form", "material.texture", "material.tone", "light", "ornament",
+                  "composition")
+
+Pack = namedtuple("Pack", "name title default_style_name description stages guide table")
+
+class PackError(ValueError):
+    def __init__(self, source, errors):
+        self.source, self.errors = source, errors
+        shown = "\n  ".join(errors[:20]) + (f"\n  ... {len(errors) - 20} more" if len(errors) > 20 else "")
+        super().__init__(f"Invalid stage pack {source}:\n  {shown}")
+
+# -- validation ------------------------------------------------------
+
+def _text(value):
+    return isinstance(value, str) and value.strip() != ""
+
+def _count(value):
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+def _check_options(where, spec, lo, hi, single, errors):
+    options = spec.get("options")
+    if not isinstance(options, list) or not options or not all(_text(o) for o in options):
+        errors.append(f"{where}.options: expected a non-empty list of strings")
+        return
+    if len(options) > MAX_OPTIONS:
+        errors.append(f"{where}.options: {len(options)} options, at most {MAX_OPTIONS} allowed")
+    labels = [o.split(" — ")[0].strip() for o in options]
+    for label in sorted({l for l in labels if labels.count(l) > 1}):
+        errors.append(f"{where}.options: label '{label}' appears more than once")
+    default = spec.get("default")
+    if single:
+        if default not in options:
+            errors.append(f"{where}.default: expected one of the options")
+        return
+    if not (_count(lo) and _count(hi) and 1 <= hi and lo <= hi <= len(options)):
+        errors.append(f"{where}: expected 0 <= min_selections <= max_selections <= {len(options)}, max at least 1")
+        return
+    if not isinstance(default, list) or any(d not in options for d in default):
+        errors.append(f"{where}.default: expected a list of the options")
+    elif not lo <= len(default) <= hi or len(set(default)) != len(default):
+        errors.append(f"{where}.default: expected {lo} to {hi} distinct options")
+
+def validate(data):
+    # All problems found in a parsed pack, as "path: message" strings.
+    if not isinstance(data, dict):
+        return ["expected a JSON object"]
+    errors = []
+    known = {"format", "title", "default_style_name", "description", "stages", "guide"}
+    errors += [f"{k}: unknown key" for k in sorted(set(data) - known)]
+    if data.get("format", FORMAT) != FORMAT:
+        errors.append(f"format: expected {FORMAT}")
+    for key in ("title", "default_style_name"):
+        if not _text(data.get(key)):
+            errors.append(f"{key}: expected a non-empty string")
+    if not isinstance(data.get("description", ""), str):
+        errors.append("description: expected a string")
+    stages = data.get("stages")
+    if not isinstance(stages, list) or not stages:
+        return errors + ["stages: expected a non-empty list"]
+
+    slot_labels = {}  # guide key -> option labels
+    slot_keys = set()
+    for i, stage in enumerate(stages):
+        where = f"stages[{i}]"
+        if not isinstance(stage, dict):
+            errors.append(f"{where}: expected an object")
+            continue
+        sid = stage.get("id")
+        if not (_text(sid) and sid.isidentifier()):
+            errors.append(f"{where}.id: expected an identifier")
+            continue
+        where = f"stages[{i}] ({sid})"
+        if sid in slot_keys:
+            errors.append(f"{where}.id: duplicate stage id")
+        for key in ("title", "prompt"):
+            if not _text(stage.get(key)):
+                errors.append(f"{where}.{key}: expected a non-empty string")
+        kind = stage.get("type")
+        if kind not in STAGE_TYPES:
+            errors.append(f"{where}.type: expected one of {', '.join(STAGE_TYPES)}")
+            continue
+        slot_keys.add(sid)
+        if kind != "compound":
+            _check_options(where, stage, stage.get("min_selections"), stage.get("max_selections"),
+                           kind == "single", errors)
+            slot_labels[sid] = [o.split(" — ")[0].strip() for o in stage.get("options") or [] if _text(o)]
+            continue
+        groups = stage.get("groups")
+        if not isinstance(groups, list) or not groups:
+            errors.append(f"{where}.groups: expected a non-empty list")
+            continue
+        for j, group in enumerate(groups):
+            gwhere = f"{where}.groups[{j}]"
+            if not isinstance(group, dict) or not (_text(group.get("id")) and group["id"].isidentifier()):
+                errors.append(f"{gwhere}: expected an object with an identifier id")
+                continue
+            key = f"{sid}.{group['id']}"
+            if key in slot_keys:
+                errors.append(f"{gwhere}.id: duplicate group id")
+            slot_keys.add(key)
+            if not _text(group.get("label")):
+                errors.append(f"{gwhere}.label: expected a non-empty string")
+            _check_options(gwhere, group, group.get("min_selections"), group.get("max_selections"), False, errors)
+            slot_labels[f"{sid}_{group['id']}"] = [o.split(" — ")[0].strip() for o in group.get("options") or []
+                                                   if _text(o)]
+    errors += [f"stages: missing required slot '{k}'" for k in REQUIRED_SLOTS if k not in slot_keys]
+    if any(isinstance(s, dict) and s.get("id") == "composition" and s.get("type") != "single" for s in stages):
+        errors.append("stages (composition): expected type 'single'")
+
+    guide = data.get("guide", {})
+    if not isinstance(guide, dict):
+        return errors + ["guide: expected an object"]
+    for key, entries in guide.items():
+        if key not in slot_labels:
+            errors.append(f"guide.{key}: no such stage or group (groups are keyed stage_group)")
+        elif not isinstance(entries, dict) or not all(_text(v) for v in entries.values()):
+            errors.append(f"guide.{key}: expected an object of option label -> text")
+        else:
+            errors += [f"guide.{key}.{label}: no such option" for label in entries if label not in slot_labels[key]]
+    return errors
+
+# -- compiling and caching -------------------------------------------
+
+def compile_pack(name, source):
+    import json
+
+    with open(source, "rb") as fp:
+        try:
+            data = json.loads(fp.read().decode("utf-8"))
+        except (UnicodeDecodeError, ValueError) as e:
+            raise PackError(source, [f"not valid JSON: {e}"]) from None
+    errors = validate(data)
+    if errors:
+        raise PackError(source, errors)
+    guide = data.get("guide", {})
+    return Pack(name, data["title"].strip(), data["default_style_name"].strip(), data.get("description", ""),
+                data["stages"], guide, OptionTable(data["stages"], guide))
+
+def compiled_path(name, source):
+    directory = CACHE_DIR or os.path.join(os.path.dirname(source), "__pycache__")
+    return os.path.join(directory, f"{name}.pack")
+
+def _read_compiled(path, stat):
+    try:
+        with open(path, "rb") as fp:
+            header = fp.read(HEADER.size)
+            if len(header) != HEADER.size or HEADER.unpack(header) != (MAGIC, COMPILED_VERSION, stat.st_mtime_ns,
+                                                                       stat.st_size):
+                return None
+            state = marshal.loads(fp.read())  # marshal.load(fp) reads in tiny chunks
+        return Pack(*state["pack"], OptionTable.from_state(state["table"]))
+    except (OSError, EOFError, ValueError, TypeError, KeyError):
+        return None
+
+def _write_compiled(path, stat, pack):
+    # Best effort, like .pyc files: a read-only install just compiles on load.
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp, "wb") as fp:
+            fp.write(HEADER.pack(MAGIC, COMPILED_VERSION, stat.st_mtime_ns, stat.st_size))
+            marshal.dump({"pack": tuple(pack[:-1]), "table": pack.table.state()}, fp)
+        os.replace(tmp, path)
+        return True
+    except OSError:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        return False
+
+def available():
+    # {name: source path} of every pack on the search path, without reading any.
+    packs = {}
+    for directory in PACK_PATH:
+        try:
+            names = sorted(os.listdir(directory))
+        except OSError:
+            continue
+        for filename in names:
+            name, ext = os.path.splitext(filename)
+            if ext == ".json" and name not in packs:
+                packs[name] = os.path.join(directory, filename)
+    return packs
+
+def find(name):
+    if name.endswith(".json"):
+        return os.path.splitext(os.path.basename(name))[0], name
+    for directory in PACK_PATH:
+        source = os.path.join(directory, f"{name}.json")
+        if os.path.isfile(source):
+            return name, source
+    raise LookupError(f"No stage pack named '{name}' (searched {os.pathsep.join(PACK_PATH)})")
+
+_loaded = {}
+_lock = threading.RLock()
+
+def load(name=DEFAULT):
+    # The compiled pack, from memory, then from its compiled file while the
+    # source is unchanged, else compiled afresh (and the compiled file rewritten).
+    pack = _loaded.get(name)
+    if pack is not None:
+        return pack
+    with _lock:
+        if name in _loaded:
+            return _loaded[name]
+        pack_name, source = find(name)
+        stat = os.stat(source)
+        path = compiled_path(pack_name, source)
+        pack = _read_compiled(path, stat)
+        if pack is None:
+            pack = compile_pack(pack_name, source)
+            _write_compiled(path, stat, pack)
+        _loaded[name] = pack
+        return pack
+
+def loaded_pack(pack_id):
+    # The pack loaded in this process whose table has pack_id, or None.
+    for pack in list(_loaded.values()):
+        if pack.table.pack_id == pack_id:
+            return pack
+    return None
+
+# -------------------------------
+# CLI
+# -------------------------------
+def main(argv=None):
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="List, validate and precompile stage packs.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="Packs on the search path")
+    check = sub.add_parser("check", help="Validate pack files without compiling them")
+    check.add_argument("files", nargs="+")
+    build = sub.add_parser("compile", help="Compile packs now (default: all), e.g. at deploy time")
+    build.add_argument("names", nargs="*")
+    build.add_argument("--force", action="store_true", help="Rebuild even if the compiled file is current")
+    args = parser.parse_args(argv)
+
+    if args.command == "list":
+        for name, source in available().items():
+            stat = os.stat(source)
+            path = compiled_path(name, source)
+            state = "compiled" if _read_compiled(path, stat) is not None else "not compiled"
+            print(f"{name}{' (default)' if name == DEFAULT else ''}\t{source}\t{state}")
+        return 0
+
+    failed = 0
+    if args.command == "check":
+        for source in args.files:
+            try:
+                with open(source, "rb") as fp:
+                    errors = validate(json.loads(fp.read().decode("utf-8")))
+            except (OSError, UnicodeDecodeError, ValueError) as e:
+                errors = [str(e)]
+            failed += bool(errors)
+            print(f"{source}: {'ok' if not errors else f'{len(errors)} problem(s)'}")
+            for e in errors:
+                print(f"  {e}")
+        return 1 if failed else 0
+
+    for name in args.names or list(available()):
+        try:
+            pack_name, source = find(name)
+            stat = os.stat(source)
+            path = compiled_path(pack_name, source)
+            if not args.force and _read_compiled(path, stat) is not None:
+                print(f"{pack_name}: up to date ({path})")
+                continue
+            t0 = time.perf_counter()
+            pack = compile_pack(pack_name, source)
+            written = _write_compiled(path, stat, pack)
+        except (LookupError, OSError, PackError) as e:
+            failed += 1
+            print(e, file=sys.stderr)
+            continue
+        print(f"{pack_name}: {len(pack.table.slots)} slots, {len(pack.table.options)} options, compiled in "
+              f"{(time.perf_counter() - t0) * 1000:.1f} ms{f' -> {path}' if written else ' (cache not writable)'}")
+    return 1 if failed else 0
+
+# Run as `python -m archstyle.packs` (archstyle/packs/__main__.py): the
+# package imports this module on startup, so `-m archstyle.stagepacks`
+# would execute it twice.
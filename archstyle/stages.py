@@ -0,0 +1,15 @@
+from .stagepacks import DEFAULT, load
+
+# ----------------------------------
+# Data & Concept Guides
+# ----------------------------------
+# The default stage pack (ARCHSTYLE_PACK, default archstyle/packs/default.json;
+# see stagepacks.py), used wherever no other pack is chosen: module-level
+# defaults of table= arguments, batch tools and the CLIs.
+
+PACK = load(DEFAULT)
+TABLE = PACK.table
+APP_TITLE = PACK.title
+STAGES = PACK.stages
+CONCEPT_GUIDE = PACK.guide
+DEFAULT_STYLE_NAME = PACK.default_style_name
@@ -0,0 +1,176 @@
+import hashlib
+from collections import namedtuple
+
+# -------------------------------
+# Compiled option table
+# -------------------------------
+# A stage pack's stages and concept guide are compiled once into integer
+# option IDs and one "slot" per selectable list (each plain stage, plus one
+# per compound group).
+# A style is then a tuple of per-slot bitmasks, and every label join the
+# composers need is precomputed per mask, so rendering does no string parsing.
+# pack_id hashes what a packed code means (slot keys and option texts, in
+# order), so codes, tokens and stored presets can be checked against the
+# table they are read with.
+
+Option = namedtuple("Option", "id slot bit text label guide")
+Slot = namedtuple("Slot", "index stage_id group_id key guide_key min_selections max_selections options")
+
+SEPARATORS = (" + ", ", ")
+
+def short_label(text):
+    return text.split(" — ")[0].strip()
+
+def layout_id(slots, options):
+    layout = "\x1e".join(s.key + "\x1f" + "\x1f".join(options[i].text for i in s.options) for s in slots)
+    return hashlib.blake2b(layout.encode("utf-8"), digest_size=3).hexdigest()
+
+def _slot_specs(stages):
+    for stage in stages:
+        if stage["type"] == "compound":
+            for grp in stage["groups"]:
+                yield (stage["id"], grp["id"], grp["options"], grp["min_selections"], grp["max_selections"])
+        elif stage["type"] == "single":
+            yield (stage["id"], None, stage["options"], 1, 1)
+        else:
+            yield (stage["id"], None, stage["options"], stage["min_selections"], stage["max_selections"])
+
+class OptionTable:
+    def __init__(self, stages, guide):
+        self.stages = stages
+        self.options = []
+        self.slots = []
+        self.ids = {}
+        for stage_id, group_id, texts, lo, hi in _slot_specs(stages):
+            index = len(self.slots)
+            guide_key = f"{stage_id}_{group_id}" if group_id else stage_id
+            ids = []
+            for i, text in enumerate(texts):
+                label = short_label(text)
+                opt = Option(len(self.options), index, 1 << i, text, label, guide.get(guide_key, {}).get(label, ""))
+                self.options.append(opt)
+                self.ids[text] = opt.id
+                ids.append(opt.id)
+            key = f"{stage_id}.{group_id}" if group_id else stage_id
+            self.slots.append(Slot(index, stage_id, group_id, key, guide_key, lo, hi, tuple(ids)))
+        self.slot_index = {s.key: s.index for s in self.slots}
+        self.widths = tuple(len(s.options) for s in self.slots)
+        self.pack_id = layout_id(self.slots, self.options)
+        self.stage_slots = {}
+        for s in self.slots:
+            self.stage_slots.setdefault(s.stage_id, []).append(s)
+        self.label_bits = [{self.options[i].label: self.options[i].bit for i in s.options} for s in self.slots]
+        self.text_bits = [{self.options[i].text: self.options[i].bit for i in s.options} for s in self.slots]
+
+        # Per slot, per mask: selected full texts, and the label joins.
+        self.values = []
+        self.joined = {sep: [] for sep in SEPARATORS}
+        for s in self.slots:
+            opts = [self.options[i] for i in s.options]
+            values = []
+            for mask in range(1 << len(opts)):
+                values.append([o.text for o in opts if mask & o.bit])
+            self.values.append(values)
+            for sep in SEPARATORS:
+                self.joined[sep].append([sep.join(short_label(t) for t in v) for v in values])
+        self.empty = tuple(0 for _ in self.slots)
+
+    # -- compiled form ----------------------------------------------
+    # Everything above as plain containers, for marshal (see stagepacks.py).
+    def state(self):
+        return {"stages": self.stages, "options": [tuple(o) for o in self.options],
+                "slots": [tuple(s) for s in self.slots], "ids": self.ids, "label_bits": self.label_bits,
+                "text_bits": self.text_bits, "values": self.values, "joined": self.joined,
+                "pack_id": self.pack_id}
+
+    @classmethod
+    def from_state(cls, state):
+        self = cls.__new__(cls)
+        self.stages = state["stages"]
+        self.options = [Option(*o) for o in state["options"]]
+        self.slots = [Slot(*s) for s in state["slots"]]
+        self.ids, self.label_bits, self.text_bits = state["ids"], state["label_bits"], state["text_bits"]
+        self.values, self.joined = state["values"], state["joined"]
+        self.slot_index = {s.key: s.index for s in self.slots}
+        self.widths = tuple(len(s.options) for s in self.slots)
+        self.pack_id = state["pack_id"]
+        self.stage_slots = {}
+        for s in self.slots:
+            self.stage_slots.setdefault(s.stage_id, []).append(s)
+        self.empty = tuple(0 for _ in self.slots)
+        return self
+
+    # -- selections -------------------------------------------------
+    def encode(self, responses):
+        # For validating paths: selections come back in option order, and a
+        # string that is not one of the slot's options raises ValueError.
+        masks = []
+        for s in self.slots:
+            value = responses.get(s.stage_id) or []
+            if s.group_id:
+                value = value.get(s.group_id) or [] if isinstance(value, dict) else []
+            bits = self.text_bits[s.index]
+            mask = 0
+            for text in value:
+                bit = bits.get(text)
+                if bit is None:
+                    raise ValueError(f"{s.key}: unknown option {text!r}")
+                mask |= bit
+            masks.append(mask)
+        return tuple(masks)
+
+    def picks(self, responses):
+        # The tolerant form of encode, for rendering what was given: returns
+        # (masks, order), where order maps a slot index to its selections as
+        # given (unknown text included) wherever they are not exactly the
+        # mask's options in option order.
+        masks = []
+        order = {}
+        for s in self.slots:
+            value = responses.get(s.stage_id) or []
+            if s.group_id:
+                value = value.get(s.group_id) or [] if isinstance(value, dict) else []
+            bits = self.text_bits[s.index]
+            mask = 0
+            shuffled = False
+            for text in value:
+                bit = bits.get(text, 0)
+                if bit <= mask:  # unknown, repeated, or after a later option
+                    shuffled = True
+                mask |= bit
+            masks.append(mask)
+            if shuffled:
+                order[s.index] = tuple(value)
+        return tuple(masks), order
+
+    def decode(self, masks):
+        responses = {}
+        for s, mask in zip(self.slots, masks):
+            value = list(self.values[s.index][mask])
+            if s.group_id:
+                responses.setdefault(s.stage_id, {})[s.group_id] = value
+            else:
+                responses[s.stage_id] = value
+        return responses
+
+    def slot_complete(self, slot, mask):
+        return bin(mask).count("1") >= self.slots[slot].min_selections
+
+    def complete(self, masks):
+        return all(self.slot_complete(i, m) for i, m in enumerate(masks))
+
+    # -- concept guide ----------------------------------------------
+    def guide_markdown(self, stage_id):
+        slots = self.stage_slots[stage_id]
+        headings = {"texture": "**Textures**", "tone": "**Tones / Palette**"}
+        lines = []
+        for s in slots:
+            if s.group_id:
+                lines.append(headings.get(s.group_id, f"**{s.group_id.title()}**"))
+                lines.append("")
+            for i in s.options:
+                o = self.options[i]
+                lines.append(f"- **{o.label}** — {o.guide}")
+            if s.group_id:
+                lines.append("")
+        return "\n".join(lines).strip()
@@ -0,0 +1,89 @@
+import argparse
+import csv
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from archstyle import pack, to_token
+from archstyle.analytics import code_stats
+from archstyle.batch import CombinationSpace, build_axes
+
+# Preset analytics over an archive larger than it should ever hold: writes
+# -n compact presets (drawn from --styles distinct codes, with a share of
+# broken lines) as one JSONL file, then runs `python -m archstyle.analytics`
+# on it with --workers and checks the co-occurrence CSV against counts kept
+# while writing. Prints presets/s and the peak memory of the scan next to
+# the file size. Exits non-zero on a wrong count, below --min-rate
+# presets/s, or above --max-rss-mb.
+
+def write_archive(path, n, styles, bad_share, seed=0):
+    space = CombinationSpace(build_axes())
+    rng = random.Random(seed)
+    codes = [pack(space.masks(rng.randrange(space.total))) for _ in range(styles)]
+    tokens = [to_token(c) for c in codes]
+    picks = [0] * styles
+    bad = 0
+    with open(path, "w", encoding="utf-8") as fp:
+        for lo in range(0, n, 100000):
+            lines = []
+            for i in range(lo, min(lo + 100000, n)):
+                if rng.random() < bad_share:
+                    lines.append(json.dumps({"style": "!!!", "style_name": f"Style {i}"}))
+                    bad += 1
+                    continue
+                k = rng.randrange(styles)
+                picks[k] += 1
+                lines.append(json.dumps({"style": tokens[k], "style_name": f"Style {i}", "world_name": "Bench",
+                                         "exported_at": "2025-01-01T00:00:00"}))
+            fp.write("\n".join(lines) + "\n")
+    # Expected matrix: each distinct code's indicators weighted by its picks.
+    expected = code_stats([]).pairs
+    for c, m in zip(codes, picks):
+        expected += code_stats([c]).pairs * m
+    return expected, bad
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure chunked preset analytics on one large archive.")
+    parser.add_argument("-n", type=int, default=2000000)
+    parser.add_argument("--styles", type=int, default=5000)
+    parser.add_argument("--bad-share", type=float, default=0.001)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--min-rate", type=float, default=100000)
+    parser.add_argument("--max-rss-mb", type=float, default=150)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        archive, pairs = os.path.join(tmp, "presets.jsonl"), os.path.join(tmp, "pairs.csv")
+        expected, bad = write_archive(archive, args.n, args.styles, args.bad_share)
+        size = os.path.getsize(archive)
+        t0 = time.perf_counter()
+        proc = subprocess.run([sys.executable, "-m", "archstyle.analytics", archive, "--workers", str(args.workers),
+                               "--pairs", pairs], cwd=ROOT, capture_output=True, text=True)
+        elapsed = time.perf_counter() - t0
+        if proc.returncode:
+            print(proc.stderr, file=sys.stderr)
+            return 1
+        with open(pairs, encoding="utf-8", newline="") as fp:
+            rows = list(csv.reader(fp))[1:]
+        counted = np.array([[int(v) for v in row[1:]] for row in rows], dtype=np.int64)
+    rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    rate = args.n / elapsed
+    exact = counted.shape == expected.shape and (counted == expected).all()
+    print(f"{args.n:,} presets ({bad:,} broken), {size / 1e6:.0f} MB of JSONL, {args.workers} workers: "
+          f"{elapsed:.2f}s ({rate:,.0f} presets/s, threshold {args.min_rate:,.0f})")
+    print(f"peak memory of the scan {rss:.0f} MB (threshold {args.max_rss_mb:.0f} MB); "
+          f"co-occurrence matches the written archive: {exact}")
+    return 0 if exact and rate >= args.min_rate and rss <= args.max_rss_mb else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from archstyle import pack, to_token
+from archstyle.batch import CombinationSpace, build_axes
+
+# Render API load test: starts `python -m archstyle.api` with --workers on a
+# free port, then sends -n single /render requests from -c concurrent
+# connections over a keep-alive pool (styles drawn from --styles distinct
+# codes, so some repeat and hit the render cache), and one streamed NDJSON
+# batch of --batch items. Prints requests/s and latency percentiles for the
+# singles, and items/s and time to first line for the batch. Exits non-zero
+# on any error, a short batch, requests/s below --min-rps, or p99 above
+# --max-p99-ms.
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def style_codes(n, seed=0):
+    space = CombinationSpace(build_axes())
+    rng = random.Random(seed)
+    return [to_token(pack(space.masks(rng.randrange(space.total)))) for _ in range(n)]
+
+def percentile(ordered, p):
+    return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))]
+
+async def wait_ready(session, url, timeout=15.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            async with session.get(f"{url}/health") as r:
+                if r.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        if time.monotonic() > deadline:
+            raise SystemExit("the API did not start")
+        await asyncio.sleep(0.1)
+
+async def singles(session, url, codes, n, concurrency):
+    latencies, errors = [], 0
+    queue = iter(range(n))
+    rng = random.Random(1)
+
+    async def client():
+        nonlocal errors
+        for _ in queue:
+            body = {"style": rng.choice(codes), "style_name": "Load Test"}
+            t0 = time.perf_counter()
+            async with session.post(f"{url}/render", json=body) as r:
+                await r.read()
+                if r.status != 200:
+                    errors += 1
+            latencies.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - t0
+
+async def batch(session, url, codes, n):
+    body = "".join(json.dumps({"style": codes[i % len(codes)], "world_name": f"World {i}"}) + "\n" for i in range(n))
+    t0 = time.perf_counter()
+    first, lines, errors = None, 0, 0
+    async with session.post(f"{url}/render/batch", data=body.encode("utf-8"),
+                            headers={"Content-Type": "application/x-ndjson"}) as r:
+        async for line in r.content:
+            if first is None:
+                first = time.perf_counter() - t0
+            lines += 1
+            errors += "errors" in json.loads(line)
+    return lines, errors, first or 0.0, time.perf_counter() - t0
+
+async def run(args, url):
+    codes = style_codes(args.styles)
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await wait_ready(session, url)
+        await singles(session, url, codes, min(200, args.n), args.concurrency)  # warm-up
+        result = await singles(session, url, codes, args.n, args.concurrency)
+        return result, await batch(session, url, codes, args.batch)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the render API on this machine.")
+    parser.add_argument("-n", type=int, default=5000, help="Single /render requests")
+    parser.add_argument("-c", "--concurrency", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--styles", type=int, default=2000, help="Distinct style codes to draw from")
+    parser.add_argument("--batch", type=int, default=20000, help="Items in the streamed batch")
+    parser.add_argument("--min-rps", type=float, default=250)
+    parser.add_argument("--max-p99-ms", type=float, default=500)
+    args = parser.parse_args(argv)
+
+    port = free_port()
+    server = subprocess.Popen([sys.executable, "-m", "archstyle.api", "--port", str(port),
+                               "--workers", str(args.workers)], cwd=ROOT, stderr=subprocess.DEVNULL)
+    try:
+        (latencies, errors, elapsed), (lines, batch_errors, first, batch_elapsed) = asyncio.run(
+            run(args, f"http://127.0.0.1:{port}"))
+    finally:
+        server.terminate()
+        server.wait(10)
+    latencies.sort()
+    rps = len(latencies) / elapsed
+    p50, p90, p99 = (percentile(latencies, p) * 1000 for p in (50, 90, 99))
+    print(f"/render: {len(latencies):,} requests, {errors} errors, {args.concurrency} connections, "
+          f"{args.workers} workers: {rps:,.0f} req/s (threshold {args.min_rps:,.0f}) | "
+          f"p50 {p50:.1f} ms, p90 {p90:.1f} ms, p99 {p99:.1f} ms (threshold {args.max_p99_ms:.0f} ms)")
+    print(f"/render/batch: {lines:,} of {args.batch:,} NDJSON lines, {batch_errors} errors in {batch_elapsed:.2f}s "
+          f"({lines / batch_elapsed:,.0f} items/s), first line after {first * 1000:.0f} ms")
+    ok = not errors and not batch_errors and lines == args.batch and rps >= args.min_rps and p99 <= args.max_p99_ms
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
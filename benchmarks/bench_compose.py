@@ -0,0 +1,79 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from archstyle import TABLE, compose_manifesto, compose_prompts, compose_world_outline, render_style
+from archstyle.batch import CombinationSpace, build_axes
+
+# Bulk rendering throughput: the responses-dict API (encodes every call)
+# against render_style on pre-encoded masks, as the batch engine uses it.
+# Also checks that compose_* render selections as given, as the original
+# app did: in the order given, text the table does not know included.
+
+def styles(n, seed=0):
+    space = CombinationSpace(build_axes())
+    rng = random.Random(seed)
+    return [space.masks(rng.randrange(space.total)) for _ in range(n)]
+
+def rate(fn, items):
+    t0 = time.perf_counter()
+    for item in items:
+        fn(item)
+    return len(items) / (time.perf_counter() - t0)
+
+def shuffled(responses, rng):
+    # The same selections in random order, some with an extra unknown text.
+    out = {}
+    for stage_id, value in responses.items():
+        groups = value if isinstance(value, dict) else {None: value}
+        picked = {}
+        for group_id, texts in groups.items():
+            texts = rng.sample(texts, len(texts))
+            if rng.random() < 0.2:
+                texts.insert(rng.randint(0, len(texts)), "Unlisted Option — from an older pack")
+            picked[group_id] = texts
+        out[stage_id] = picked if isinstance(value, dict) else picked[None]
+    return out
+
+def as_given(r):
+    # Expected labels per slot: each text up to " — ", joined in the given order.
+    labels = []
+    for s in TABLE.slots:
+        texts = r[s.stage_id][s.group_id] if s.group_id else r[s.stage_id]
+        labels.append(", ".join(t.split(" — ")[0].strip() for t in texts))
+    return labels
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure composer throughput in records per second.")
+    parser.add_argument("-n", type=int, default=50000)
+    args = parser.parse_args(argv)
+
+    masks = styles(args.n)
+    responses = [TABLE.decode(m) for m in masks]
+    name, notes, world = "Bench Order", "notes", "Bench World"
+
+    def via_responses(r):
+        return (compose_manifesto(r, name, notes, world), compose_prompts(r, name), compose_world_outline(r, world))
+
+    def via_masks(m):
+        return render_style(m, name, notes, world)
+
+    a = rate(via_responses, responses)
+    b = rate(via_masks, masks)
+    print(f"compose_* (responses): {a:>10,.0f} styles/s")
+    print(f"render_style (masks):  {b:>10,.0f} styles/s  ({b / a:.1f}x)")
+
+    rng = random.Random(1)
+    kept = 0
+    for r in (shuffled(r, rng) for r in responses[:2000]):
+        outline = compose_world_outline(r, world)
+        kept += all(f"** {labels or '—'}\n" in outline for labels in as_given(r))
+    print(f"compose_* kept the given order and unknown text in {kept:,} of 2,000 shuffled styles")
+    return 0 if kept == 2000 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,187 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import itertools
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from archstyle import pack
+from archstyle import imagestub
+from archstyle.batch import CombinationSpace, build_axes
+from archstyle.dispatch import Dispatcher, ProgressLog, iter_jobs
+
+# Image dispatcher against the bundled stub backend, in one process: N
+# prompts from random styles, with simulated render latency and a share of
+# 429 / 503 answers to retry. Then a second run with the same progress file
+# must skip everything, holding the done jobs as a few offset ranges. Then
+# checks failure handling: a Retry-After far above the maximum backoff is
+# capped, and a batch whose output directory disappears stops with the error
+# instead of hanging. A library batch resumed after a preset was added and
+# another deleted must send only the new preset's prompts. Last, through
+# AppTest, the Builder's "Send prompts" button must return well before the backend answers and report the result
+# on a later run. Reports latency percentiles and throughput; exits non-zero
+# if any job failed, the resume re-sent anything or kept more than
+# --max-ranges ranges, a check failed, or throughput is below --min-rate.
+
+def presets(n, seed=0):
+    space = CombinationSpace(build_axes())
+    rng = random.Random(seed)
+    for i in range(n):
+        yield {"code": pack(space.masks(rng.randrange(space.total))), "style_name": f"Style {i}"}
+
+async def run(args, progress):
+    runner, url = await imagestub.start(latency=args.latency_ms / 1000, jitter=args.latency_ms / 5000,
+                                        fail_rate=args.fail_rate, throttle_rate=args.throttle_rate, seed=1)
+    try:
+        dispatcher = Dispatcher(url, args.concurrency, args.rate, retries=6, backoff=0.05, progress=progress)
+        first = await dispatcher.run(iter_jobs(presets(-(-args.n // 3))))
+        second = await dispatcher.run(iter_jobs(presets(-(-args.n // 3))))
+        stats = runner.app["stats"]
+    finally:
+        await runner.cleanup()
+    log = ProgressLog(progress)
+    log.start(next(iter_jobs(presets(1))).id)
+    log.close()
+    return first, second, stats, len(log.done)
+
+async def capped_retry_after(retry_after=60):
+    # Every answer a 429 asking for retry_after seconds: with max_backoff
+    # 0.1 s and 2 retries the job fails within a fraction of a second.
+    runner, url = await imagestub.start(latency=0, throttle_rate=1.0, retry_after=retry_after, seed=1)
+    try:
+        t0 = time.perf_counter()
+        report = await asyncio.wait_for(Dispatcher(url, 1, retries=2, max_backoff=0.1).run(
+            iter_jobs(presets(1), ["Civic Plaza"])), retry_after)
+        return report.failed == 1 and time.perf_counter() - t0 < 1.0
+    finally:
+        await runner.cleanup()
+
+async def stops_on_dead_workers(tmp, timeout=10):
+    # An endless batch saving images into a directory removed mid-run: every
+    # worker fails to write, and the run must raise rather than block.
+    runner, url = await imagestub.start(latency=0.005, png=True, seed=1)
+    out = os.path.join(tmp, "images")
+    try:
+        asyncio.get_running_loop().call_later(0.3, shutil.rmtree, out, True)
+        endless = iter_jobs({"code": p["code"], "style_name": f"Style {i}"}
+                            for i, p in enumerate(itertools.cycle(presets(100))))
+        try:
+            await asyncio.wait_for(Dispatcher(url, 8, out_dir=out).run(endless), timeout)
+        except OSError:
+            return True
+        except asyncio.TimeoutError:
+            return False
+        return False
+    finally:
+        await runner.cleanup()
+
+class StubThread:
+    # The stub backend on its own event loop thread, for code that runs its
+    # own loop (the CLI, the app).
+    def __init__(self, **options):
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        self.runner, self.url = self._call(imagestub.start(**options))
+
+    def _call(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    @property
+    def requests(self):
+        return self.runner.app["stats"]["requests"]
+
+    def close(self):
+        self._call(self.runner.cleanup())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+def library_resume(tmp, styles=40):
+    # The CLI's library source, run twice on one progress file with a preset
+    # added and an older one deleted in between (the library lists newest
+    # first): the second run must send exactly the new preset's prompts.
+    from archstyle.dispatch import main as dispatch_main
+    from archstyle.library import PresetLibrary
+
+    db, progress = os.path.join(tmp, "presets.db"), os.path.join(tmp, "library.progress.jsonl")
+    library = PresetLibrary(db)
+    library.add(presets(styles))
+    stub = StubThread(latency=0.001, jitter=0, seed=1)
+    argv = ["--db", db, "--progress", progress, "--url", stub.url]
+    try:
+        with contextlib.redirect_stderr(io.StringIO()):
+            dispatch_main(argv)
+            first = stub.requests
+            library.add(presets(1, seed=99))
+            library.delete(styles // 2)
+            dispatch_main(argv)
+        second = stub.requests - first
+    finally:
+        stub.close()
+        library.close()
+    return first, second
+
+def app_sends_in_background(tmp, latency=1.0):
+    # Seconds the click took, and the status shown once the backend answered.
+    from streamlit.testing.v1 import AppTest
+
+    stub = StubThread(latency=latency, jitter=0, seed=1)
+    saved = {k: os.environ.get(k) for k in ("ARCHSTYLE_IMAGE_URL", "ARCHSTYLE_DISPATCH_DIR")}
+    os.environ.update(ARCHSTYLE_IMAGE_URL=stub.url, ARCHSTYLE_DISPATCH_DIR=os.path.join(tmp, "app"))
+    try:
+        at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=120).run()
+        t0 = time.perf_counter()
+        at.button(key="send_prompts").click().run()
+        clicked = time.perf_counter() - t0
+        time.sleep(latency * 1.5)
+        at.run()
+        return clicked, [e.value for e in at.success] + [e.value for e in at.error]
+    finally:
+        for k, v in saved.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+        stub.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the image dispatcher against the stub backend.")
+    parser.add_argument("-n", type=int, default=3000, help="Prompts (three per style)")
+    parser.add_argument("-c", "--concurrency", type=int, default=64)
+    parser.add_argument("--rate", type=float, default=0.0)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--fail-rate", type=float, default=0.02)
+    parser.add_argument("--throttle-rate", type=float, default=0.02)
+    parser.add_argument("--min-rate", type=float, default=300.0, help="Images per second")
+    parser.add_argument("--max-ranges", type=int, default=64, help="Offset ranges a resume may keep")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        first, second, stats, ranges = asyncio.run(run(args, os.path.join(tmp, "progress.jsonl")))
+        capped = asyncio.run(capped_retry_after())
+        stopped = asyncio.run(stops_on_dead_workers(tmp))
+        library_first, library_second = library_resume(tmp)
+        clicked, status = app_sends_in_background(tmp)
+    print(f"first run:  {first.summary()}")
+    print(f"resumed:    {second.summary()}")
+    print(f"stub saw {stats['requests']:,} requests ({stats['throttled']:,} throttled, {stats['failed']:,} failed)")
+    print(f"resume state: {ranges} offset range(s) for {first.done:,} done jobs (threshold {args.max_ranges}); "
+          f"{len(first.latencies)} latency buckets")
+    print(f"Retry-After capped at max_backoff: {capped}; stopped when every worker died: {stopped}")
+    print(f"library resume after adding one preset and deleting another: {library_first:,} prompts sent, "
+          f"then {library_second} (expected 3)")
+    sent = clicked < 0.5 and len(status) == 1 and status[0].startswith("3 done")
+    print(f"app: click returned in {clicked * 1000:.0f} ms, then {status[0] if status else 'no status'}")
+    ok = (not first.failed and not second.done and not second.failed and first.throughput >= args.min_rate
+          and ranges <= args.max_ranges and capped and stopped and library_second == 3 and sent)
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
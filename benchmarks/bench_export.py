@@ -0,0 +1,86 @@
+import argparse
+import io
+import os
+import resource
+import sys
+import time
+import zipfile
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from archstyle.export import write_archive
+from bench_library import presets
+
+# Streaming zip export: N random styles rendered into one archive written to
+# a counting sink (nothing is kept), reporting styles/s, archive size and
+# peak RSS growth. Then, through AppTest, clicks the Builder's "Download All
+# (zip)" button the way the browser does (Streamlit runs the deferred data
+# callable and serves what it returns) and checks the archive. Exits non-zero
+# if RSS grows by more than --max-rss-mb, i.e. if memory scales with the
+# number of styles, or if the app's download fails or is not a valid zip.
+
+class NullSink:
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def app_download(label="Download All (zip)"):
+    # The archive behind one of the app's download buttons, or the error
+    # Streamlit's media file manager raises when it is clicked.
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.testing.v1 import AppTest
+
+    managers = []
+    add_deferred = MediaFileManager.add_deferred
+
+    def keep(self, *args, **kwargs):
+        managers.append(self)
+        return add_deferred(self, *args, **kwargs)
+
+    with mock.patch.object(MediaFileManager, "add_deferred", keep):
+        at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=120).run()
+    button = next((b for b in at.get("download_button") if b.proto.label == label), None)
+    if button is None or not managers:
+        return None, f"no '{label}' button"
+    try:
+        url = managers[-1].execute_deferred(button.proto.deferred_file_id)
+    except Exception as e:
+        return None, str(e)
+    return managers[-1]._storage.get_file(url.rsplit("/", 1)[1].split(".")[0]).content, None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure streaming zip export speed and memory.")
+    parser.add_argument("-n", type=int, default=20000)
+    parser.add_argument("--compresslevel", type=int, default=6)
+    parser.add_argument("--max-rss-mb", type=float, default=64.0)
+    args = parser.parse_args(argv)
+
+    write_archive(presets(50, seed=1), NullSink())  # warm caches and imports
+    before = peak_rss_mb()
+    sink = NullSink()
+    t0 = time.perf_counter()
+    styles = write_archive(presets(args.n), sink, args.compresslevel)
+    elapsed = time.perf_counter() - t0
+    growth = peak_rss_mb() - before
+    print(f"exported {styles:,} styles ({4 * styles:,} files, {sink.size / 1e6:.1f} MB) in {elapsed:.1f}s "
+          f"({styles / elapsed:,.0f} styles/s)")
+    print(f"peak RSS growth {growth:.1f} MB (threshold {args.max_rss_mb:.0f} MB)")
+
+    data, error = app_download()
+    if data is not None:
+        archive = zipfile.ZipFile(io.BytesIO(data))
+        error = None if archive.testzip() is None else "corrupt member"
+        shown = f"{len(data):,} bytes, {len(archive.namelist())} files"
+    ok_app = error is None
+    print(f"app 'Download All (zip)' clicked: {shown if ok_app else error}; valid zip: {ok_app}")
+    return 0 if growth <= args.max_rss_mb and ok_app else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,79 @@
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import time
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from archstyle import TABLE, pack, to_token
+from archstyle.batch import CombinationSpace, build_axes
+from archstyle.importer import import_presets
+
+# Bulk import throughput on one core: N presets as JSONL (optionally zipped),
+# with a share of broken records, streamed through the validator. Exits
+# non-zero below --min-rate presets/s. Presets are compact by default; the
+# full layout is about ten times larger per record and its rate is bounded
+# by json parsing, so --full-share mostly measures the json module.
+# Also checks that JSONL lines which only parse when joined (a value split
+# over two lines, next to a line holding two values) are all rejected.
+
+def make_jsonl(n, full_share, bad_share, seed=0):
+    space = CombinationSpace(build_axes())
+    rng = random.Random(seed)
+    lines = []
+    for i in range(n):
+        masks = space.masks(rng.randrange(space.total))
+        record = {"app_title": "bench", "style_name": f"Style {i}", "world_name": "", "notes": ""}
+        if rng.random() < full_share:
+            record["responses"] = TABLE.decode(masks)
+        else:
+            record["style"] = to_token(pack(masks))
+        if rng.random() < bad_share:
+            if "responses" in record:
+                record["responses"]["soul"] = ["Not an option"]
+            else:
+                record["style"] = "!!!"
+        lines.append(json.dumps(record, ensure_ascii=False))
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+def misaligned(seed=0):
+    # Three lines that would read as three presets if joined into one array.
+    token = to_token(pack(CombinationSpace(build_axes()).masks(seed)))
+    preset = json.dumps({"style": token})
+    lines = ['{"style_name": "split", "notes": [{}', '{}], "style": "%s"}' % token, f"{preset}, {preset}"]
+    presets, report = import_presets([("misaligned.jsonl", io.BytesIO(("\n".join(lines) + "\n").encode("utf-8")))])
+    return len(presets), report.rejected
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure bulk preset import throughput.")
+    parser.add_argument("-n", type=int, default=200000)
+    parser.add_argument("--full-share", type=float, default=0.0, help="fraction of presets in the full layout")
+    parser.add_argument("--bad-share", type=float, default=0.01, help="fraction of invalid presets")
+    parser.add_argument("--zip", action="store_true", help="wrap the JSONL in a zip archive")
+    parser.add_argument("--min-rate", type=float, default=100000)
+    args = parser.parse_args(argv)
+
+    data = make_jsonl(args.n, args.full_share, args.bad_share)
+    name = "presets.jsonl"
+    if args.zip:
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr(name, data)
+        data, name = buf.getvalue(), "presets.zip"
+
+    t0 = time.perf_counter()
+    presets, report = import_presets([(name, io.BytesIO(data))])
+    elapsed = time.perf_counter() - t0
+    rate = report.total / elapsed
+    print(f"{name}: {len(data) / 1e6:.1f} MB, {report.summary()}")
+    print(f"validated {rate:,.0f} presets/s (threshold {args.min_rate:,.0f})")
+    accepted, rejected = misaligned()
+    print(f"misaligned JSONL lines: {accepted} accepted, {rejected} rejected (expected 0, 3)")
+    return 0 if rate >= args.min_rate and (accepted, rejected) == (0, 3) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
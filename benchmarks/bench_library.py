@@ -0,0 +1,80 @@
+import argparse
+import datetime as dt
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from archstyle import pack
+from archstyle.batch import CombinationSpace, build_axes
+from archstyle.library import PresetLibrary
+
+# Preset library at scale: bulk-insert N random presets into a fresh SQLite
+# file, then time first-page queries (limit 100) and full counts for a mix
+# of filters. Exits non-zero if a first-page query's median exceeds
+# --max-query-ms.
+
+QUERIES = {
+    "one option": dict(require={"composition": {"Radial Sanctum"}}),
+    "two options": dict(require={"composition": {"Radial Sanctum"}, "material.tone": {"Charcoal and Ash"}}),
+    "four options": dict(require={"composition": {"Radial Sanctum"}, "material.tone": {"Charcoal and Ash"},
+                                  "soul": {"Memory"}, "light": {"Shadowed Silence"}}),
+    "style name": dict(style_name="Style 42"),
+    "world name": dict(world_name="World 7"),
+    "date range": dict(since="2025-03-01", until="2025-03-07"),
+    "options + name + dates": dict(require={"composition": {"Radial Sanctum"}}, world_name="World 1",
+                                   since="2025-01-01", until="2025-06-30"),
+}
+
+def presets(n, seed=0):
+    space = CombinationSpace(build_axes())
+    rng = random.Random(seed)
+    start = dt.datetime(2025, 1, 1)
+    for i in range(n):
+        stamp = start + dt.timedelta(seconds=rng.randrange(365 * 86400))
+        yield {"code": pack(space.masks(rng.randrange(space.total))), "style_name": f"Style {i}",
+               "world_name": f"World {rng.randrange(1000)}", "notes": "",
+               "exported_at": stamp.strftime("%Y%m%d_%H%M%S")}
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(samples), result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure preset library insert and query speed.")
+    parser.add_argument("-n", type=int, default=1000000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-query-ms", type=float, default=50.0)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        library = PresetLibrary(os.path.join(tmp, "bench.db"))
+        t0 = time.perf_counter()
+        library.add(presets(args.n))
+        elapsed = time.perf_counter() - t0
+        print(f"inserted {args.n:,} presets in {elapsed:.1f}s ({args.n / elapsed:,.0f}/s)")
+
+        slow = []
+        for name, filters in QUERIES.items():
+            page_ms, rows = timed(lambda: library.query(limit=100, **filters), args.repeat)
+            count_ms, total = timed(lambda: library.count(**filters), args.repeat)
+            print(f"{name:<24} first page {page_ms:7.2f} ms ({len(rows):>3} rows) | "
+                  f"count {count_ms:8.2f} ms ({total:,})")
+            if page_ms > args.max_query_ms:
+                slow.append(name)
+        library.close()
+    if slow:
+        print(f"slower than {args.max_query_ms:.0f} ms: {', '.join(slow)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+import argparse
+import os
+import resource
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from archstyle import TABLE, STAGES
+from archstyle.ornament import OrnamentLab
+
+# Ornament Lab variant throughput: stream N variants of the default style
+# (the richest selection is used when --all-options is set), reporting
+# variants/s and peak RSS growth, then check a sample for duplicate ids and
+# prompts, that a fresh lab with the same seed reproduces the order, and that
+# the order is shuffled: every pair of neighbouring values on the slowest
+# axis (type) and the fastest (medium) should occur, none more than twice
+# as often as chance. Exits non-zero below --min-rate, on RSS growth above
+# --max-rss-mb, on any duplicate or mismatch, or if the order is not
+# shuffled.
+
+def style_masks(all_options=False):
+    responses = {}
+    for stage in STAGES:
+        if stage["type"] == "compound":
+            responses[stage["id"]] = {g["id"]: g["options"][:g["max_selections"]] if all_options else g["default"]
+                                      for g in stage["groups"]}
+        elif stage["type"] == "multi":
+            responses[stage["id"]] = stage["options"][:stage["max_selections"]] if all_options else stage["default"]
+        else:
+            responses[stage["id"]] = [stage["default"]]
+    return TABLE.encode(responses)
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure Ornament Lab variant generation.")
+    parser.add_argument("-n", type=int, default=500000)
+    parser.add_argument("--all-options", action="store_true", help="Select the maximum number of options")
+    parser.add_argument("--sample", type=int, default=100000, help="Variants checked for duplicates")
+    parser.add_argument("--min-rate", type=float, default=30000)
+    parser.add_argument("--max-rss-mb", type=float, default=16)
+    args = parser.parse_args(argv)
+
+    lab = OrnamentLab(style_masks(args.all_options), seed=7)
+    print(f"{len(lab):,} variants: {lab.describe()}")
+    before = peak_rss_mb()
+    t0 = time.perf_counter()
+    n = chars = 0
+    for v in lab.variants(0, args.n):
+        n += 1
+        chars += len(v.prompt)
+    elapsed = time.perf_counter() - t0
+    growth = peak_rss_mb() - before
+    rate = n / elapsed
+    print(f"{n:,} variants ({chars / 1e6:.1f} M chars) in {elapsed:.2f}s: {rate:,.0f}/s "
+          f"(threshold {args.min_rate:,.0f}), peak RSS growth {growth:.1f} MB")
+
+    sample = list(lab.variants(0, args.sample))
+    duplicates = len(sample) - len({v.id for v in sample}) + len(sample) - len({v.prompt for v in sample})
+    again = OrnamentLab(style_masks(args.all_options), seed=7)
+    stable = all(again.variant(v.position) == v for v in sample[:: max(1, len(sample) // 1000)])
+    print(f"sample of {len(sample):,}: {duplicates} duplicates, reproducible: {stable}")
+
+    # Each (axis value, next neighbour's value) pair should turn up about
+    # equally often; a stride or cycle through the product shows only a few.
+    indexes = [lab.index(v.position) for v in sample]
+    types, media = len(lab.axes[0]), len(lab.axes[-1])
+    spread = []
+    for k, digit in ((types, lambda i: i // (len(lab) // types)), (media, lambda i: i % media)):
+        pairs = Counter((digit(i), digit(j)) for i, j in zip(indexes, indexes[1:]))
+        spread.append(max(pairs.values()) / ((len(indexes) - 1) / k ** 2) if len(pairs) == k * k else float("inf"))
+    shuffled = max(spread) <= 2
+    print(f"neighbour pairs, most common vs. chance: type {spread[0]:.2f}x, medium {spread[1]:.2f}x; "
+          f"shuffled: {shuffled}")
+    return 0 if (rate >= args.min_rate and growth <= args.max_rss_mb and not duplicates and stable
+                 and shuffled) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from archstyle import stagepacks
+
+# Stage packs: put --packs copies of the default pack on ARCHSTYLE_PACK_PATH,
+# then time a cold `import archstyle` (nothing compiled yet) and a warm one
+# in fresh interpreters, and check that only the default pack was compiled.
+# In process, compare compiling a pack with loading its compiled file, and
+# check that touching the source rebuilds it. Exits non-zero if startup
+# compiled more than one pack, the compiled load is not at least
+# --min-speedup times faster, or a changed source was not rebuilt.
+
+PROBE = ("import sys, time; t0 = time.perf_counter(); import archstyle; "
+         "print((time.perf_counter() - t0) * 1000, archstyle.PACK.name)")
+
+def import_ms(env):
+    proc = subprocess.run([sys.executable, "-c", PROBE], cwd=ROOT, env=env, capture_output=True, text=True)
+    proc.check_returncode()
+    ms, name = proc.stdout.split()
+    return float(ms), name
+
+def best_ms(fn, rounds):
+    best = float("inf")
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure stage pack compilation, caching and lazy loading.")
+    parser.add_argument("--packs", type=int, default=48)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--min-speedup", type=float, default=2.0)
+    args = parser.parse_args(argv)
+
+    with open(os.path.join(stagepacks.PACK_DIR, "default.json"), encoding="utf-8") as fp:
+        data = json.load(fp)
+    with tempfile.TemporaryDirectory() as tmp:
+        packs, cache = os.path.join(tmp, "packs"), os.path.join(tmp, "cache")
+        os.makedirs(packs)
+        for i in range(args.packs):
+            data["title"] = f"Pack {i}"
+            with open(os.path.join(packs, f"pack{i:03d}.json"), "w", encoding="utf-8") as fp:
+                json.dump(data, fp, ensure_ascii=False)
+        env = dict(os.environ, ARCHSTYLE_PACK_PATH=packs, ARCHSTYLE_PACK_CACHE=cache,
+                   ARCHSTYLE_PACK=f"pack{args.packs // 2:03d}")
+        cold, name = import_ms(env)
+        compiled = sorted(os.listdir(cache))
+        warm = min(import_ms(env)[0] for _ in range(5))
+        print(f"import archstyle with {args.packs} packs on the path: cold {cold:.1f} ms, warm {warm:.1f} ms; "
+              f"compiled at startup: {', '.join(compiled)} (default: {name})")
+        lazy = compiled == [f"{name}.pack"]
+
+        source = os.path.join(packs, "pack000.json")
+        path = os.path.join(cache, "pack000.pack")
+        compile_ms = best_ms(lambda: stagepacks.compile_pack("pack000", source), args.rounds)
+        stagepacks._write_compiled(path, os.stat(source), stagepacks.compile_pack("pack000", source))
+        load_ms = best_ms(lambda: stagepacks._read_compiled(path, os.stat(source)), args.rounds)
+        speedup = compile_ms / load_ms
+        print(f"one pack: compile {compile_ms:.2f} ms, load compiled {load_ms:.2f} ms ({speedup:.1f}x, "
+              f"threshold {args.min_speedup:.1f}x)")
+
+        os.utime(source, ns=(time.time_ns(), time.time_ns() + 10 ** 9))
+        stale = stagepacks._read_compiled(path, os.stat(source)) is None
+        env["ARCHSTYLE_PACK"] = "pack000"
+        import_ms(env)
+        rebuilt = stagepacks._read_compiled(path, os.stat(source)) is not None
+        print(f"after touching the source: compiled file stale {stale}, rebuilt on load {rebuilt}")
+    return 0 if lazy and speedup >= args.min_speedup and stale and rebuilt else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,106 @@
+import argparse
+import logging
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Per-interaction latency of the Builder, measured with Streamlit's AppTest
+# harness: toggle a Stage 1 pill and time the rerun it triggers. The app's
+# own selection callback decides what reruns: with keyed fragments, its
+# st.rerun(targets) replaces the run with one of just the fragments it
+# names. A plain full rerun is timed too, for reference.
+#
+# AppTest builds a fresh runner (and recompiles the script) for every run,
+# and starts each run from an empty message queue, so elements outside a
+# fragment-only rerun would vanish from its tree (and their widget state
+# with them), where a browser keeps the page it has. The harness shares one
+# ScriptCache and ForwardMsgQueue across runs to match. Besides end-to-end
+# time, the time spent executing the script itself is reported, which
+# excludes AppTest's per-run setup, and each interaction is checked to have
+# ended in a fragment rerun.
+
+SOUL = [
+    "Order — symmetry, balance, civic duty, divine ratio",
+    "Growth — organic change, evolution, breathing walls, living façades",
+    "Memory — ruin, layering, patina, archaeology of time",
+]
+
+_shared = {}
+_exec = {"ms": 0.0, "fragments": None}
+
+def patch_harness():
+    from streamlit.runtime.forward_msg_queue import ForwardMsgQueue
+    from streamlit.runtime.scriptrunner import script_runner
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.testing.v1 import local_script_runner
+
+    script_cache = ScriptCache()
+    local_script_runner.ScriptCache = lambda: script_cache
+    local_script_runner.ForwardMsgQueue = lambda: _shared.setdefault("queue", ForwardMsgQueue())
+
+    exec_func = script_runner.exec_func_with_error_handling
+
+    def timed_exec(func, ctx):
+        # The fragments the last run executed (None for a full run).
+        _exec["fragments"] = ctx.fragment_ids_this_run
+        t0 = time.perf_counter()
+        try:
+            return exec_func(func, ctx)
+        finally:
+            _exec["ms"] += (time.perf_counter() - t0) * 1000
+
+    script_runner.exec_func_with_error_handling = timed_exec
+
+def timed(action):
+    _exec["ms"] = 0.0
+    t0 = time.perf_counter()
+    at = action()
+    if at.exception:
+        raise SystemExit(f"script raised: {at.exception[0].message}")
+    return (time.perf_counter() - t0) * 1000, _exec["ms"]
+
+def measure(script, runs, warmup=5):
+    from streamlit.testing.v1 import AppTest
+    _shared.clear()
+    at = AppTest.from_file(script, default_timeout=30).run()
+    results = {"interaction": [], "full rerun": []}
+    scoped = 0
+    for i in range(warmup + runs):
+        interaction = timed(lambda: at.pills(key="pills_soul").set_value([SOUL[i % len(SOUL)]]).run())
+        fragments = _exec["fragments"]
+        full = timed(lambda: at.run())
+        if i >= warmup:
+            results["interaction"].append(interaction)
+            results["full rerun"].append(full)
+            scoped += bool(fragments)
+    results["scoped"] = scoped
+    return results
+
+def summarize(samples):
+    total = sorted(s[0] for s in samples)
+    script = sorted(s[1] for s in samples)
+    p90 = int(len(total) * 0.9) - 1
+    return (f"end-to-end median {statistics.median(total):5.1f} ms p90 {total[p90]:5.1f} ms | "
+            f"script median {statistics.median(script):5.1f} ms p90 {script[p90]:5.1f} ms")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure Builder rerun latency with streamlit.testing AppTest.")
+    parser.add_argument("scripts", nargs="*", default=[os.path.join(ROOT, "app.py")])
+    parser.add_argument("--runs", type=int, default=100)
+    args = parser.parse_args(argv)
+
+    logging.disable(logging.WARNING)
+    patch_harness()
+    sys.path.insert(0, ROOT)
+    for script in args.scripts:
+        results = measure(os.path.abspath(script), args.runs)
+        for name in ("interaction", "full rerun"):
+            print(f"{script} [{name}]: {summarize(results[name])}")
+        print(f"{script}: {results['scoped']} of {args.runs} interactions ran as fragment reruns")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
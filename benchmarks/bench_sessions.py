@@ -0,0 +1,136 @@
+import argparse
+import gc
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from archstyle.importer import ImportReport, import_presets, iter_presets
+from archstyle.sessions import STORE, PresetList, SessionStore
+
+from bench_import import make_jsonl
+
+# Per-session memory with a bulk import of -n presets held by each of
+# --sessions sessions: as the app used to keep it (the uploaded bytes, a
+# list of preset dicts and the report in st.session_state), as a PresetList
+# in the session store, and once the store has moved the idle sessions to
+# disk. Checks that spilled values come back equal (also to concurrent
+# readers of one session) and that expiry deletes their files. Then, through
+# AppTest, checks that an app session's import survives a spill and comes
+# back on its next run. Exits non-zero if the compact form is not --min-drop
+# times smaller, an idle session keeps more than --max-idle-kb in memory, or
+# a value or the app's import is lost.
+
+def measure(build, sessions, then=None):
+    # Bytes still allocated per session after building them all, and after
+    # then() if given (traced in one window, so frees count too).
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    kept = [build(i) for i in range(sessions)]
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - base
+    if then:
+        then()
+        gc.collect()
+    after = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    del kept
+    return used / sessions, after / sessions
+
+def values_round_trip(tmp, data, sessions=4, readers=8):
+    # Spill -> restore -> expire on a fresh store; True if every value came
+    # back equal, each session was read once, and no file was left behind.
+    store = SessionStore(tmp)
+    expected = {}
+    for i in range(sessions):
+        report = ImportReport()
+        presets = PresetList(iter_presets([("presets.jsonl", io.BytesIO(data))], report))
+        expected[f"s{i}"] = (list(presets), report.summary(), {"n": i, "name": f"Session {i}"})
+        store.put(f"s{i}", "import", (presets, report))
+        store.put(f"s{i}", "meta", expected[f"s{i}"][2])
+    ok = store.spill_idle(0) == sessions and store.stats()["resident"] == 0
+    got = {}
+    def read(sid):
+        presets, report = store.get(sid, "import")
+        got.setdefault(sid, []).append((list(presets), report.summary(), store.get(sid, "meta")))
+    threads = [threading.Thread(target=read, args=(sid,)) for sid in expected for _ in range(readers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    ok = ok and store.stats()["restores"] == sessions
+    ok = ok and all(len(got.get(sid, ())) == readers and all(r == want for r in got[sid]) for sid, want in expected.items())
+    store.spill_idle(0)
+    store.ttl_seconds = 0
+    ok = ok and store.expire() == sessions and not os.listdir(tmp) and store.get("s0", "import") is None
+    return ok
+
+def app_round_trip(n, data):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=120).run()
+    sid = at.session_state["sid"]
+    report = ImportReport()
+    STORE.put(sid, "import", (PresetList(iter_presets([("presets.jsonl", data)], report)), report))
+    at.run()
+    before = [s.label for s in at.selectbox if s.label.startswith("Imported presets")]
+    spilled = STORE.spill_idle(0)
+    t0 = time.perf_counter()
+    at.run()
+    elapsed = time.perf_counter() - t0
+    after = [s.label for s in at.selectbox if s.label.startswith("Imported presets")]
+    return before, after, spilled, STORE.stats()["restores"], elapsed, at.exception
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure per-session memory with compaction and idle spilling.")
+    parser.add_argument("-n", type=int, default=20000, help="Presets in each session's import")
+    parser.add_argument("--sessions", type=int, default=10)
+    parser.add_argument("--min-drop", type=float, default=10)
+    parser.add_argument("--max-idle-kb", type=float, default=1)
+    args = parser.parse_args(argv)
+
+    data = make_jsonl(args.n, 0.0, 0.01)
+
+    def old_layout(i):
+        upload = bytes(data)  # the uploader's copy, kept for the session's lifetime
+        presets, report = import_presets([("presets.jsonl", io.BytesIO(upload))])
+        return upload, presets, report
+
+    def compact(i):
+        report = ImportReport()
+        store.put(f"s{i}", "import", (PresetList(iter_presets([("presets.jsonl", io.BytesIO(data))], report)), report))
+
+    old, _ = measure(old_layout, args.sessions)
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SessionStore(tmp)
+        new, idle = measure(compact, args.sessions, lambda: store.spill_idle(0))
+        idle = max(idle, 0)
+        t0 = time.perf_counter()
+        restored = store.get("s0", "import")[0]
+        restore_ms = (time.perf_counter() - t0) * 1000
+        on_disk = store.stats()["spilled_bytes"] / args.sessions
+    with tempfile.TemporaryDirectory() as tmp:
+        ok_values = values_round_trip(tmp, make_jsonl(2000, 0.0, 0.01))
+    drop = old / new
+    print(f"{args.sessions} sessions with {args.n:,} imported presets each ({len(data) / 1e6:.1f} MB uploaded):")
+    print(f"  as before       {old / 1e6:8.2f} MB per session")
+    print(f"  compact         {new / 1e6:8.2f} MB per session ({drop:.0f}x less, threshold {args.min_drop:.0f}x)")
+    print(f"  idle (spilled)  {idle / 1e3:8.2f} kB per session in memory (threshold {args.max_idle_kb:.0f} kB), "
+          f"{on_disk / 1e6:.2f} MB on disk; restored in {restore_ms:.1f} ms ({len(restored):,} presets)")
+    print(f"spill -> restore -> expire keeps values and deletes files: {ok_values}")
+
+    before, after, spilled, restores, elapsed, exception = app_round_trip(args.n, io.BytesIO(data))
+    ok_app = bool(before) and before == after and spilled == 1 and restores == 1 and not exception
+    print(f"app session: {before[0] if before else 'no import shown'}; spilled {spilled}, restored {restores} on "
+          f"the next run ({elapsed * 1000:.0f} ms); import kept: {ok_app}")
+    return 0 if drop >= args.min_drop and idle <= args.max_idle_kb * 1e3 and ok_values and ok_app else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
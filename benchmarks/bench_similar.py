@@ -0,0 +1,72 @@
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from archstyle import pack
+from archstyle.batch import CombinationSpace, build_axes
+from archstyle.similar import SimilarityIndex
+
+# Similar-styles search at scale: build a memory-mapped index of N random
+# presets, time appending --append more (what a sync costs after presets
+# are saved to the library), then time top-k queries one at a time and in
+# batches, for both metrics. Exits non-zero if a single query's median
+# exceeds --max-query-ms or the append takes over --max-append-ms.
+
+def chunks(n, seed=0, size=100000, first=1):
+    space = CombinationSpace(build_axes())
+    rng = random.Random(seed)
+    for lo in range(0, n, size):
+        hi = min(lo + size, n)
+        yield range(first + lo, first + hi), [pack(space.masks(rng.randrange(space.total))) for _ in range(lo, hi)]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure similar-styles search latency.")
+    parser.add_argument("-n", type=int, default=1000000)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--batch", type=int, default=16)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--append", type=int, default=1000)
+    parser.add_argument("--max-query-ms", type=float, default=100.0)
+    parser.add_argument("--max-append-ms", type=float, default=100.0)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        index = SimilarityIndex(os.path.join(tmp, "bench.db"))
+        t0 = time.perf_counter()
+        index.build(chunks(args.n), args.n)
+        print(f"built index of {len(index):,} presets in {time.perf_counter() - t0:.1f}s "
+              f"({os.path.getsize(index.vectors_path) / 1e6:.0f} MB on disk)")
+        new = list(chunks(args.append, seed=2, first=args.n + 1))
+        t0 = time.perf_counter()
+        index.append(new)
+        append_ms = (time.perf_counter() - t0) * 1000
+        print(f"appended {args.append:,} presets in {append_ms:.1f} ms (threshold {args.max_append_ms:.0f} ms)")
+
+        rng = random.Random(1)
+        queries = [int(index.vectors[rng.randrange(args.n), 0]) for _ in range(args.repeat * args.batch)]
+        slow = False
+        for metric in ("jaccard", "hamming"):
+            single = []
+            for code in queries[:args.repeat]:
+                t0 = time.perf_counter()
+                index.nearest(code, args.k, metric)
+                single.append((time.perf_counter() - t0) * 1000)
+            t0 = time.perf_counter()
+            for i in range(0, len(queries), args.batch):
+                index.search(queries[i:i + args.batch], args.k, metric)
+            per_query = (time.perf_counter() - t0) * 1000 / len(queries)
+            median = statistics.median(single)
+            print(f"{metric:<8} single query median {median:6.1f} ms | "
+                  f"batches of {args.batch}: {per_query:6.1f} ms per query")
+            slow = slow or median > args.max_query_ms
+        del index
+    return 1 if slow or append_ms > args.max_append_ms else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
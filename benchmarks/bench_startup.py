@@ -0,0 +1,40 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Fail if importing the core ever gets slow or starts dragging in the UI stack.
+PROBE = "import sys, {module}; sys.exit(3 if 'streamlit' in sys.modules else 0)"
+
+def import_time_ms(module="archstyle"):
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", PROBE.format(module=module)], cwd=ROOT,
+                          capture_output=True, text=True)
+    if proc.returncode == 3:
+        raise SystemExit(f"importing {module} pulled in streamlit")
+    proc.check_returncode()
+    for line in proc.stderr.splitlines():
+        # "import time: self [us] | cumulative | imported package"
+        parts = [p.strip() for p in line.split("|")]
+        if len(parts) == 3 and parts[2] == module:
+            return int(parts[1]) / 1000.0
+    raise SystemExit(f"no import-time entry for {module}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Guard the cold-import time of the archstyle core.")
+    parser.add_argument("--runs", type=int, default=15)
+    parser.add_argument("--max-ms", type=float, default=50.0, help="Fail if the median import exceeds this")
+    args = parser.parse_args(argv)
+
+    samples = [import_time_ms() for _ in range(args.runs)]
+    median = statistics.median(samples)
+    print(f"import archstyle: median {median:.1f} ms, min {min(samples):.1f} ms, max {max(samples):.1f} ms over {args.runs} runs")
+    if median > args.max_ms:
+        print(f"FAIL: median import time above {args.max_ms:.0f} ms", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,53 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from archstyle import urban
+
+# Urban Layout Lab: generation time per composition at --size, with no form
+# and with every form switched on (best of --rounds, on a cold cache), then a
+# cold view, a one-tile pan and a warm redraw of the same view. Checks that
+# a layout is reproducible from its seed. Exits non-zero when generation
+# exceeds --max-ms, a warm view exceeds --max-view-ms, or a layout differs.
+
+def best_ms(fn, rounds):
+    best = float("inf")
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure Urban Layout Lab generation and tiled views.")
+    parser.add_argument("--size", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--max-ms", type=float, default=1000, help="Slowest allowed generation")
+    parser.add_argument("--max-view-ms", type=float, default=20, help="Slowest allowed pan or warm redraw")
+    args = parser.parse_args(argv)
+
+    slowest = 0.0
+    for composition in urban.COMPOSITIONS:
+        times = [best_ms(lambda: urban.generate(composition, forms, args.size, 1), args.rounds)
+                 for forms in ((), urban.FORMS)]
+        slowest = max(slowest, *times)
+        print(f"{composition:20} {times[0]:6.0f} ms plain, {times[1]:6.0f} ms with all forms")
+    print(f"slowest generation: {slowest:.0f} ms (threshold {args.max_ms:.0f} ms)")
+
+    d = urban.generate(urban.COMPOSITIONS[0], urban.FORMS, args.size, 1)
+    stable = (d.cells == urban.generate(urban.COMPOSITIONS[0], urban.FORMS, args.size, 1).cells).all()
+    urban.TILE_CACHE.clear()
+    centre = args.size // 2
+    cold = best_ms(lambda: urban.view(d, centre, centre, 2), 1)
+    pan = best_ms(lambda: urban.view(d, centre + urban.TILE * 2, centre, 2), 1)
+    warm = best_ms(lambda: urban.view(d, centre, centre, 2), args.rounds)
+    png = best_ms(lambda: urban.png_bytes(urban.view(d, centre, centre, 2)), args.rounds)
+    print(f"640 px view: cold {cold:.1f} ms, one-tile pan {pan:.1f} ms, warm {warm:.1f} ms, "
+          f"with PNG encode {png:.1f} ms (threshold {args.max_view_ms:.0f} ms); reproducible: {stable}")
+    return 0 if slowest <= args.max_ms and max(pan, warm) <= args.max_view_ms and stable else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
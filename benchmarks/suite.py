@@ -0,0 +1,233 @@
+import argparse
+import datetime as dt
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+
+from archstyle import (TABLE, compose_manifesto, compose_prompts, compose_world_outline, render_style,
+                       read_preset, compact_preset, expand_preset)
+from archstyle.codec import dumps_preset
+from bench_compose import styles
+
+# The regression suite: composer latency, bulk rendering, preset JSON
+# round-trips and Builder reruns, written to one JSON results file and
+# compared metric by metric against a committed baseline.
+#
+#   python benchmarks/suite.py                    # run, write results.json, compare
+#   python benchmarks/suite.py --update-baseline  # accept the current numbers
+#
+# Every metric records whether lower (latency) or higher (throughput) is
+# better, and fails if it is worse than the baseline by more than its
+# tolerance (a fraction; --tolerance, or per metric in the baseline file).
+# Timings on shared or throttled machines are noisy, so cases are repeated and a
+# case that regresses is measured once more before the suite fails.
+# Baselines are machine-specific: regenerate them on the machine that
+# runs the comparison.
+
+BASELINE = os.path.join(HERE, "baseline.json")
+RESULTS = os.path.join(HERE, "results.json")
+TOLERANCE = 0.25
+NAME, NOTES, WORLD = "Bench Order", "notes", "Bench World"
+
+def per_call_us(fn, items, rounds):
+    # Best round's mean time per call: as with timeit, the fastest round is
+    # the one least disturbed by the rest of the machine.
+    samples = []
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        for item in items:
+            fn(item)
+        samples.append((time.perf_counter() - t0) / len(items) * 1e6)
+    return min(samples)
+
+def metric(value, unit, better):
+    return {"value": round(value, 3), "unit": unit, "better": better}
+
+# -- cases -----------------------------------------------------------
+
+def bench_composers(args):
+    responses = [TABLE.decode(m) for m in styles(args.calls)]
+    return {
+        "compose.manifesto": metric(per_call_us(lambda r: compose_manifesto(r, NAME, NOTES, WORLD), responses,
+                                                args.rounds), "us", "lower"),
+        "compose.prompts": metric(per_call_us(lambda r: compose_prompts(r, NAME), responses, args.rounds),
+                                  "us", "lower"),
+        "compose.world_outline": metric(per_call_us(lambda r: compose_world_outline(r, WORLD), responses,
+                                                    args.rounds), "us", "lower"),
+    }
+
+def bench_bulk(args):
+    masks = styles(args.bulk, seed=1)
+    rates = []
+    for _ in range(3):
+        t0 = time.perf_counter()
+        for m in masks:
+            render_style(m, NAME, NOTES, WORLD)
+        rates.append(len(masks) / (time.perf_counter() - t0))
+    return {"bulk.render_style": metric(max(rates), "styles/s", "higher")}
+
+def bench_presets(args):
+    from archstyle import pack
+    codes = [pack(m) for m in styles(args.calls, seed=2)]
+    compact = [compact_preset(c, NAME, WORLD, NOTES, "20250101_000000") for c in codes]
+    full = [expand_preset(c, NAME, WORLD, NOTES, "20250101_000000") for c in codes]
+    compact_text = [dumps_preset(p) for p in compact]
+    full_text = [dumps_preset(p, compact=False) for p in full]
+
+    def round_trip(p):
+        return read_preset(json.loads(dumps_preset(p)))
+
+    return {
+        "preset.dumps_compact": metric(per_call_us(dumps_preset, compact, args.rounds), "us", "lower"),
+        "preset.dumps_full": metric(per_call_us(lambda p: dumps_preset(p, compact=False), full, args.rounds),
+                                    "us", "lower"),
+        "preset.parse_compact": metric(per_call_us(lambda s: read_preset(json.loads(s)), compact_text, args.rounds),
+                                       "us", "lower"),
+        "preset.parse_full": metric(per_call_us(lambda s: read_preset(json.loads(s)), full_text, args.rounds),
+                                    "us", "lower"),
+        "preset.round_trip_compact": metric(per_call_us(round_trip, compact, args.rounds), "us", "lower"),
+    }
+
+def bench_app(args):
+    import bench_rerun
+    logging.disable(logging.WARNING)
+    bench_rerun.patch_harness()
+    results = bench_rerun.measure(os.path.join(ROOT, "app.py"), args.app_runs)
+    if results["scoped"] < args.app_runs:
+        raise SystemExit(f"app: {args.app_runs - results['scoped']} selection(s) reran the whole script")
+    out = {}
+    for name, key in (("interaction", "app.interaction"), ("full rerun", "app.full_rerun")):
+        total = [s[0] for s in results[name]]
+        script = [s[1] for s in results[name]]
+        out[key] = metric(statistics.median(total), "ms", "lower")
+        out[key + ".script"] = metric(statistics.median(script), "ms", "lower")
+    return out
+
+CASES = {"composers": bench_composers, "bulk": bench_bulk, "presets": bench_presets, "app": bench_app}
+
+# -- results and comparison -----------------------------------------
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                                text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    return {"date": dt.datetime.now().isoformat(timespec="seconds"), "commit": commit,
+            "python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count()}
+
+def compare(metrics, baseline, tolerance):
+    # (name, current, base, change, limit, failed) for each shared metric;
+    # change is signed so that positive is always worse.
+    rows = []
+    for name, m in metrics.items():
+        base = baseline.get("metrics", {}).get(name)
+        if not base or not base["value"]:
+            rows.append((name, m, None, None, None, False))
+            continue
+        change = (m["value"] - base["value"]) / base["value"]
+        if m["better"] == "higher":
+            change = -change
+        limit = base.get("tolerance", baseline.get("tolerance", tolerance))
+        rows.append((name, m, base, change, limit, change > limit))
+    return rows
+
+CASE_OF = {}
+
+def run_case(case, args):
+    # Each case --repeat times, keeping the median of every metric (the
+    # AppTest case once: it already takes a median over --app-runs reruns).
+    t0 = time.perf_counter()
+    runs = [CASES[case](args) for _ in range(1 if case == "app" else args.repeat)]
+    metrics = {name: dict(m, value=round(statistics.median(r[name]["value"] for r in runs), 3))
+               for name, m in runs[0].items()}
+    CASE_OF[case] = list(metrics)
+    print(f"[{case}] {time.perf_counter() - t0:.1f}s", file=sys.stderr)
+    return metrics
+
+def load(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as fp:
+        return json.load(fp)
+
+def save(path, data):
+    with open(path, "w") as fp:
+        json.dump(data, fp, indent=2)
+        fp.write("\n")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the benchmark suite and compare it with the baseline.")
+    parser.add_argument("cases", nargs="*", metavar="CASE", help=f"Cases to run (default: all of {', '.join(CASES)})")
+    parser.add_argument("--calls", type=int, default=500, help="Styles per latency round")
+    parser.add_argument("--rounds", type=int, default=7)
+    parser.add_argument("--bulk", type=int, default=20000, help="Styles rendered for throughput")
+    parser.add_argument("--app-runs", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=3, help="Run each case this many times and keep the median")
+    parser.add_argument("--retries", type=int, default=1, help="Times a failing case is measured again")
+    parser.add_argument("--output", default=RESULTS)
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE,
+                        help="Allowed slowdown as a fraction, unless the baseline sets its own")
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args(argv)
+    unknown = set(args.cases) - set(CASES)
+    if unknown:
+        parser.error(f"unknown case(s): {', '.join(sorted(unknown))}")
+
+    metrics = {}
+    for case in args.cases or CASES:
+        metrics.update(run_case(case, args))
+    baseline = load(args.baseline)
+
+    if args.update_baseline:
+        merged = baseline.get("metrics", {})
+        for name, m in metrics.items():
+            merged[name] = dict(m, **{k: v for k, v in merged.get(name, {}).items() if k == "tolerance"})
+        baseline.update(environment=environment(), metrics=merged)
+        baseline.setdefault("tolerance", args.tolerance)
+        save(args.baseline, baseline)
+        save(args.output, {"environment": environment(), "metrics": metrics})
+        print(f"baseline updated: {args.baseline}")
+        return 0
+
+    for _ in range(args.retries):
+        # A regression must survive a second measurement: rerun the cases
+        # that failed and keep each metric's better value.
+        failed = {name for name, *_, bad in compare(metrics, baseline, args.tolerance) if bad}
+        if not failed:
+            break
+        for case in [c for c in args.cases or CASES if CASE_OF.get(c) and failed & set(CASE_OF[c])]:
+            print(f"[{case}] regression, measuring again", file=sys.stderr)
+            for name, m in run_case(case, args).items():
+                pick = min if m["better"] == "lower" else max
+                metrics[name]["value"] = pick(metrics[name]["value"], m["value"])
+    save(args.output, {"environment": environment(), "metrics": metrics})
+
+    failed = []
+    for name, m, base, change, limit, bad in compare(metrics, baseline, args.tolerance):
+        shown = f"{m['value']:>12,.2f} {m['unit']:<9}"
+        if base is None:
+            print(f"{name:<28} {shown} (no baseline)")
+            continue
+        print(f"{name:<28} {shown} baseline {base['value']:>12,.2f}  slowdown {change:+7.1%} (limit {limit:.0%})"
+              f"{'  REGRESSION' if bad else ''}")
+        if bad:
+            failed.append(name)
+    print(f"results written to {args.output}")
+    if failed:
+        print(f"{len(failed)} regression(s): {', '.join(failed)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())